@@ -14,7 +14,9 @@ This script processes a CSV file containing image URLs and associated article UR
    - Uses multithreading to process image URLs concurrently, improving performance.
 
 4. **Logging**:
-   - Logs processing start and end times, as well as any errors encountered, to `process_log.txt`.
+   - Logs processing start and end times, as well as any errors encountered, as JSON lines to `pipeline_log.jsonl`.
+   - Times the fetch, decode and compute steps of every image and prints progress at most every few seconds.
+   - `--profile cprofile` or `--profile sampling` profiles the run (see instrumentation.py).
 
 5. **Output**:
    - Saves the processed data to a new CSV file with `_bw_ratio` appended to the original file name.
@@ -34,39 +36,42 @@ from io import BytesIO
 from PIL import Image
 import pandas as pd
 import os
-from datetime import datetime
 from urllib.parse import urlparse, urljoin
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import cairosvg
+from instrumentation import ProgressReporter, add_profile_arguments, log_event, profiled, timer, timers
 
 def is_black_and_white(url, tolerance=0):
     try:
-        response = requests.get(url)
-        response.raise_for_status()
+        with timer("bw_ratio", "fetch"):
+            response = requests.get(url)
+            response.raise_for_status()
         
-        # Check the content type
-        content_type = response.headers.get('Content-Type', '')
-        if 'svg' in content_type:
-            # Convert SVG to PNG
-            png_data = cairosvg.svg2png(bytestring=response.content)
-            img = Image.open(BytesIO(png_data))
-        else:
-            img = Image.open(BytesIO(response.content))
+        with timer("bw_ratio", "decode"):
+            # Check the content type
+            content_type = response.headers.get('Content-Type', '')
+            if 'svg' in content_type:
+                # Convert SVG to PNG
+                png_data = cairosvg.svg2png(bytestring=response.content)
+                img = Image.open(BytesIO(png_data))
+            else:
+                img = Image.open(BytesIO(response.content))
 
-        img = img.convert('RGB')
-        pixels = list(img.getdata())
+            img = img.convert('RGB')
+            pixels = list(img.getdata())
         
-        bw_count = 0
-        total_pixels = len(pixels)
-        for pixel in pixels:
-            r, g, b = pixel
-            if abs(r - g) <= tolerance and abs(g - b) <= tolerance and abs(b - r) <= tolerance:
-                bw_count += 1
-
-        bw_ratio = bw_count / total_pixels
+        with timer("bw_ratio", "compute"):
+            bw_count = 0
+            total_pixels = len(pixels)
+            for pixel in pixels:
+                r, g, b = pixel
+                if abs(r - g) <= tolerance and abs(g - b) <= tolerance and abs(b - r) <= tolerance:
+                    bw_count += 1
+
+            bw_ratio = bw_count / total_pixels
         return bw_ratio
     except Exception as e:
-        print(f"Error processing URL {url}: {e}")
+        log_event("image_failed", stage="bw_ratio", url=url, error=str(e))
         return None
 
 def process_record(index, row, df, tolerance):
@@ -85,85 +90,85 @@ def process_record(index, row, df, tolerance):
         bw_ratio = is_black_and_white(image_url, tolerance)
         df.at[index, 'bw_ratio'] = bw_ratio
     except Exception as e:
-        print(f"Error processing record {index+1}: {e}")
+        log_event("record_failed", stage="bw_ratio", record=index + 1, error=str(e))
         df.at[index, 'bw_ratio'] = None  # Set a default value in case of error
     return index
 
 def process_csv_file(file_path, tolerance=0):
-    log_file = "process_log.txt"
-    
-    with open(log_file, "a") as log:
-        try:
-            # Log the start time for the file
-            start_time = datetime.now()
-            log.write(f"Processing started for {file_path} at {start_time}\n")
-
-            # Load the input CSV file
-            df = pd.read_csv(file_path)
-
-            # Ensure there's an 'image_url', 'article_url', and 'id' column
-            if 'image_url' not in df.columns or 'article_url' not in df.columns or 'id' not in df.columns:
-                print(f"No 'image_url', 'article_url', or 'id' column found in {file_path}. Skipping this file.")
-                return
-
-            # Check if the output file exists
-            output_file_path = os.path.splitext(file_path)[0] + "_bw_ratio.csv"
-            # Check if the output file exists
-            if os.path.exists(output_file_path):
-                df_output = pd.read_csv(output_file_path)
-                last_processed_id = df_output['id'].max()
-
-                # Filter the input CSV to start processing from the last processed ID
-                df = df[df['id'] > last_processed_id]
-                df = df.reset_index(drop=True)  # Reset index after filtering
-                print(f"Resuming processing from ID {last_processed_id + 1} for {file_path}.")
+    try:
+        # Log the start time for the file
+        log_event("stage_started", stage="bw_ratio", file=file_path, tolerance=tolerance)
 
-            else:
-                df_output = pd.DataFrame()  # Initialize empty dataframe if no output file exists
-                print(f"No output file found. Starting from the beginning for {file_path}.")
-            
-            total_records = len(df)
-            if total_records == 0:
-                print(f"All records have already been processed for {file_path}.")
-                return
-
-            # Process each image URL using multithreading
-            with ThreadPoolExecutor(max_workers=10) as executor:
-                futures = {
-                    executor.submit(process_record, i, row, df, tolerance): i
-                    for i, row in df.iterrows()
-                }
-
-                for future in as_completed(futures):
-                    i = futures[future]
-                    try:
-                        # Check if the future was completed successfully
-                        future.result()
-                        # Append only new rows to the output file
-                        df_output = pd.concat([df_output, df.iloc[[i]]], ignore_index=True)
-                        df_output.to_csv(output_file_path, index=False)
-                        print(f"Record {i+1}/{total_records} in {file_path} processed and saved.")
-                    except Exception as e:
-                        print(f"Error in processing thread for record {i+1}: {e}")
-
-            print(f"Completed processing {file_path}. Output saved to {output_file_path}")
-
-            # Log the end time for the file
-            end_time = datetime.now()
-            log.write(f"Processing completed for {file_path} at {end_time}\n")
-            log.write(f"Total records processed: {total_records}\n")
-
-        except Exception as e:
-            print(f"Error processing file {file_path}: {e}")
-            log.write(f"Error processing file {file_path}: {e}\n")
+        # Load the input CSV file
+        df = pd.read_csv(file_path)
+
+        # Ensure there's an 'image_url', 'article_url', and 'id' column
+        if 'image_url' not in df.columns or 'article_url' not in df.columns or 'id' not in df.columns:
+            print(f"No 'image_url', 'article_url', or 'id' column found in {file_path}. Skipping this file.")
+            return
+
+        # Check if the output file exists
+        output_file_path = os.path.splitext(file_path)[0] + "_bw_ratio.csv"
+        # Check if the output file exists
+        if os.path.exists(output_file_path):
+            df_output = pd.read_csv(output_file_path)
+            last_processed_id = df_output['id'].max()
+
+            # Filter the input CSV to start processing from the last processed ID
+            df = df[df['id'] > last_processed_id]
+            df = df.reset_index(drop=True)  # Reset index after filtering
+            print(f"Resuming processing from ID {last_processed_id + 1} for {file_path}.")
+
+        else:
+            df_output = pd.DataFrame()  # Initialize empty dataframe if no output file exists
+            print(f"No output file found. Starting from the beginning for {file_path}.")
+
+        total_records = len(df)
+        if total_records == 0:
+            print(f"All records have already been processed for {file_path}.")
+            return
+
+        # Process each image URL using multithreading
+        progress = ProgressReporter("bw_ratio", total=total_records)
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            futures = {
+                executor.submit(process_record, i, row, df, tolerance): i
+                for i, row in df.iterrows()
+            }
+
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    # Check if the future was completed successfully
+                    future.result()
+                    # Append only new rows to the output file
+                    df_output = pd.concat([df_output, df.iloc[[i]]], ignore_index=True)
+                    df_output.to_csv(output_file_path, index=False)
+                except Exception as e:
+                    log_event("record_failed", stage="bw_ratio", record=i + 1, error=str(e))
+                progress.update()
+
+        progress.finish()
+        print(timers.report("bw_ratio"))
+        print(f"Completed processing {file_path}. Output saved to {output_file_path}")
+
+        # Log the end time for the file
+        log_event("stage_completed", stage="bw_ratio", file=file_path, records=total_records,
+                  timers=timers.summary("bw_ratio"))
+
+    except Exception as e:
+        print(f"Error processing file {file_path}: {e}")
+        log_event("stage_failed", stage="bw_ratio", file=file_path, error=str(e))
 
 def main():
     parser = argparse.ArgumentParser(description="Process CSV files and calculate black-and-white ratio for images.")
     parser.add_argument("file", type=str, help="Path to the CSV file to be processed.")
     parser.add_argument("--tolerance", type=float, default=0.1, help="Tolerance level for non-black and white pixels (default is 0.1).")
+    add_profile_arguments(parser)
     
     args = parser.parse_args()
-    process_csv_file(args.file, args.tolerance)
+    with profiled(args.profile, args.profile_output, args.profile_interval):
+        process_csv_file(args.file, args.tolerance)
 
 if __name__ == "__main__":
     main()
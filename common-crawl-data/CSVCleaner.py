@@ -9,11 +9,16 @@ This script processes a CSV file containing image URLs and associated article UR
    - After generating valid URLs, the script removes duplicate rows based on the `image_url` and `image_alt` columns.
 4. **Invalid Link Removal**:
    - Optionally checks if the `image_url` points to a valid image and removes the row if the link is broken or outdated.
+   - Links are checked concurrently with HEAD requests (see ImageLinkValidator.py) and the results are cached
+     in `link_check_cache.db`, so reruns only recheck links older than `--recheck-age` hours.
 5. **Empty Image URL Removal**:
    - Automatically removes rows with empty `image_url` fields.
 6. **ID Regeneration**:
    - The `id` column, representing row numbers, is regenerated after duplicates are removed to ensure it remains sequential.
-7. **CSV File Saving**:
+7. **Chunked Mode**:
+   - With `--chunksize`, the file is streamed in chunks. Duplicates are tracked in an on-disk hash index,
+     ids continue across chunks and the output is written incrementally.
+8. **CSV File Saving**:
    - The processed data is saved to a new CSV file with "_updated" appended to the original file name or overwrites the original file based on user preference.
 
 Usage:
@@ -33,35 +38,32 @@ Run the Script:
      
    - To overwrite the original file and remove invalid image links:
      python process_csv.py path/to/yourfile.csv --overwrite --remove-invalid-links
+
+   - To process a file too large for memory, 100000 rows at a time:
+     python process_csv.py path/to/yourfile.csv --chunksize 100000
+
+   - To see where the time goes (see instrumentation.py):
+     python process_csv.py path/to/yourfile.csv --profile cprofile
 """
 
 
 import argparse
+import hashlib
+import sqlite3
+import tempfile
 import pandas as pd
 from urllib.parse import urlparse, urljoin
-import re
 import os
-import requests
-
-# Regex pattern for validating URLs
-URL_REGEX = re.compile(
-    r'^(https?://)?'  # optional scheme
-    r'([a-zA-Z0-9.-]+)'  # domain
-    r'(:\d+)?'  # optional port
-    r'(/.*)?$'  # optional path
-)
-
-def is_valid_url(url):
-    # Returns False for relative URLs that start with "./" or "/" or "../"
-    if pd.isna(url) or url.startswith(('./', '/', '../', "\\")):
-        return False
-    if not url.startswith(('http://', 'https://')):
-        return False
-    if url.startswith(('http://', 'https://')):
-        return True
-    return re.match(URL_REGEX, url) is not None
+from functools import lru_cache
+from ImageLinkValidator import ImageLinkValidator
+from instrumentation import add_profile_arguments, profiled
 
-def construct_valid_image_url(image_url, article_url):
+# Text columns are read as strings, otherwise a chunk where every value is empty is inferred as float64
+TEXT_COLUMN_DTYPES = {'urlkey': str, 'article_title': str, 'image_url': str, 'image_alt': str, 'article_url': str}
+
+@lru_cache(maxsize=65536)
+def split_article_url(article_url):
+    """Returns the base URL and the directory path of the article an image was found on."""
     parsed_article_url = urlparse(article_url)
     base_url = f"{parsed_article_url.scheme}://{parsed_article_url.netloc}"
     
@@ -72,8 +74,11 @@ def construct_valid_image_url(image_url, article_url):
         elif urldirpath[-1].find('.') != -1:
             urldirpath.pop()
     
-    urldirpath = "/".join(urldirpath) + "/"
-    
+    return base_url, "/".join(urldirpath) + "/"
+
+@lru_cache(maxsize=65536)
+def resolve_image_src(base_url, urldirpath, image_url):
+    """Resolves a relative image src against the article directory it was found in."""
     if image_url.startswith('./'):
         # Remove the leading "./"
         image_url = urldirpath + image_url[2:]
@@ -90,51 +95,87 @@ def construct_valid_image_url(image_url, article_url):
 
     return urljoin(base_url, os.path.normpath(image_url))
 
-def is_image_url_valid(image_url):
-    try:
-        response = requests.get(image_url, timeout=10)
-        # Check if the content type is an image
-        return response.headers['Content-Type'].startswith('image')
-    except (requests.RequestException, KeyError):
-        return False
+def construct_valid_image_url(image_url, article_url):
+    base_url, urldirpath = split_article_url(article_url)
+    return resolve_image_src(base_url, urldirpath, image_url)
 
-def process_csv(file_path, overwrite=False, remove_invalid_links=False):
-    # Load the CSV file
-    df = pd.read_csv(file_path)
+def trim_whitespace(df):
+    # Strip every text column at once; non-string cells in mixed columns are left as they are
+    for column in df.columns:
+        series = df[column]
+        if series.dtype == object or isinstance(series.dtype, pd.StringDtype):
+            stripped = series.str.strip()
+            df[column] = stripped.where(stripped.notna(), series)
+    return df
 
-    # Trim whitespace from all fields
-    df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
+def repair_image_urls(df):
+    # Only absolute http(s) URLs are valid, everything else is resolved against its article
+    invalid = ~df['image_url'].str.startswith(('http://', 'https://')).fillna(False).astype(bool)
+    repaired_count = int(invalid.sum())
+    if repaired_count > 0:
+        df.loc[invalid, 'image_url'] = [
+            construct_valid_image_url(image_url, article_url)
+            for image_url, article_url in zip(df.loc[invalid, 'image_url'], df.loc[invalid, 'article_url'])
+        ]
+    return repaired_count
+
+def clean_rows(df, remove_invalid_links=False, link_validator=None):
+    # Runs every per-row cleaning step and returns the kept rows with a count per step
+    counts = {}
 
+    # Count and drop rows with empty 'image_url'
+    initial_count = len(df)
+    df = df.dropna(subset=['image_url'])
+    counts['empty'] = initial_count - len(df)
+
+    # Update relative image URLs in one pass over the column
+    counts['repaired'] = repair_image_urls(df)
+
+    # Optionally remove rows with invalid image URLs
+    counts['invalid_links'] = 0
+    if remove_invalid_links:
+        link_validator = link_validator or ImageLinkValidator()
+        link_results = link_validator.validate(df['image_url'])
+        before_check = len(df)
+        # Only links known to be broken are removed, unknown (None) results keep their rows
+        df = df[df['image_url'].map(lambda url: link_results.get(url) is not False)]
+        counts['invalid_links'] = before_check - len(df)
+
+    return df, counts
+
+def print_counts(counts):
+    if counts['empty'] > 0:
+        print(f"Removed {counts['empty']} rows with empty 'image_url'.")
+    if counts['repaired'] > 0:
+        print(f"Updated {counts['repaired']} invalid image_url values using their article_url.")
+    if counts['invalid_links'] > 0:
+        print(f"Removed {counts['invalid_links']} rows with invalid or broken image links.")
+
+def has_required_columns(df, file_path):
     # Ensure there are 'image_url', 'article_url', and 'id' columns
     if 'image_url' not in df.columns or 'article_url' not in df.columns or 'id' not in df.columns:
         print(f"No 'image_url', 'article_url', or 'id' column found in {file_path}.")
+        return False
+    return True
+
+def output_path(file_path, overwrite):
+    # Determine file path for saving
+    if overwrite:
+        return file_path
+    return os.path.splitext(file_path)[0] + "_updated.csv"
+
+def process_csv(file_path, overwrite=False, remove_invalid_links=False, link_validator=None):
+    # Load the CSV file
+    df = pd.read_csv(file_path, dtype=TEXT_COLUMN_DTYPES)
+
+    # Trim whitespace from all fields
+    df = trim_whitespace(df)
+
+    if not has_required_columns(df, file_path):
         return
 
-    # Count and drop rows with empty 'image_url'
-    initial_count = len(df)
-    df = df.dropna(subset=['image_url'])
-    empty_count = initial_count - len(df)
-    
-    if empty_count > 0:
-        print(f"Removed {empty_count} rows with empty 'image_url'.")
-
-    # Process each record to update image URLs
-    for i, row in df.iterrows():
-        image_url = row['image_url']
-        article_url = row['article_url']
-
-        # Check if the image_url is valid
-        if not is_valid_url(image_url):
-            print(f"Invalid image_url found at index {i}: {image_url}")
-            # Construct a valid image_url
-            valid_image_url = construct_valid_image_url(image_url, article_url)
-            df.at[i, 'image_url'] = valid_image_url
-            print(f"Updated image_url at index {i}: {valid_image_url}")
-
-        # Optionally remove rows with invalid image URLs
-        if remove_invalid_links and not is_image_url_valid(df.at[i, 'image_url']):
-            print(f"Invalid or broken image link found at index {i}: {df.at[i, 'image_url']}")
-            df.drop(i, inplace=True)
+    df, counts = clean_rows(df, remove_invalid_links, link_validator)
+    print_counts(counts)
 
     # Remove duplicate rows based on the updated image_url and image_alt
     if 'image_url' in df.columns and 'image_alt' in df.columns:
@@ -146,22 +187,131 @@ def process_csv(file_path, overwrite=False, remove_invalid_links=False):
     # Regenerate the 'id' column with new row numbers
     df['id'] = range(1, len(df) + 1)
 
-    # Determine file path for saving
-    if overwrite:
-        new_file_path = file_path
-    else:
-        new_file_path = os.path.splitext(file_path)[0] + "_updated.csv"
+    new_file_path = output_path(file_path, overwrite)
 
     # Save the updated CSV
     df.to_csv(new_file_path, index=False)
     print(f"Completed processing. Updated file saved to {new_file_path}")
 
+class DuplicateIndex:
+    """On-disk set of (image_url, image_alt) hashes, used to deduplicate rows across chunks."""
+
+    def __init__(self, path=None):
+        if path is None:
+            handle, path = tempfile.mkstemp(suffix=".db", prefix="csvcleaner_dedup_")
+            os.close(handle)
+            self.remove_on_close = True
+        else:
+            self.remove_on_close = False
+        self.path = path
+        # Opened by one thread and used by another in CommonCrawlPipeline, never by two at once
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen (hash BLOB PRIMARY KEY) WITHOUT ROWID")
+
+    @staticmethod
+    def row_hash(image_url, image_alt):
+        # NaN is mapped to a sentinel so that, like drop_duplicates, missing values compare equal
+        key = "\x1f".join("\x00" if pd.isna(value) else str(value) for value in (image_url, image_alt))
+        return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+    def add(self, row_hash):
+        """Records a hash and returns True if it was not seen before."""
+        return self.conn.execute("INSERT OR IGNORE INTO seen (hash) VALUES (?)", (row_hash,)).rowcount == 1
+
+    def keep_first_seen(self, df):
+        """Returns the rows whose (image_url, image_alt) has not been seen in this or any earlier chunk."""
+        df = df.drop_duplicates(subset=['image_url', 'image_alt'], keep='first')
+        hashes = [self.row_hash(url, alt) for url, alt in zip(df['image_url'], df['image_alt'])]
+
+        seen = set()
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT hash FROM seen WHERE hash IN ({','.join('?' for _ in batch)})", batch)
+            seen.update(row[0] for row in rows)
+
+        is_new = [row_hash not in seen for row_hash in hashes]
+        self.conn.executemany("INSERT INTO seen (hash) VALUES (?)",
+                              [(row_hash,) for row_hash, new in zip(hashes, is_new) if new])
+        self.conn.commit()
+        # A boolean Series, an empty plain list would select no columns instead of no rows
+        return df[pd.Series(is_new, index=df.index, dtype=bool)]
+
+    def close(self):
+        self.conn.close()
+        if self.remove_on_close:
+            os.remove(self.path)
+
+def process_csv_chunked(file_path, overwrite=False, remove_invalid_links=False, link_validator=None,
+                        chunksize=100000, dedup_index_path=None):
+    """Cleans the CSV chunk by chunk so that peak memory is bounded by the chunk size."""
+    new_file_path = output_path(file_path, overwrite)
+    partial_file_path = new_file_path + ".part"
+    duplicate_index = DuplicateIndex(dedup_index_path)
+    totals = {'empty': 0, 'repaired': 0, 'invalid_links': 0}
+    duplicate_count = 0
+    next_id = 1
+
+    # Chunks go to a temporary file that replaces the output only once every chunk is written
+    try:
+        for chunk_number, df in enumerate(pd.read_csv(file_path, chunksize=chunksize, dtype=TEXT_COLUMN_DTYPES)):
+            df = trim_whitespace(df)
+
+            if chunk_number == 0 and not has_required_columns(df, file_path):
+                return
+
+            df, counts = clean_rows(df, remove_invalid_links, link_validator)
+            for key, value in counts.items():
+                totals[key] += value
+
+            if 'image_alt' in df.columns:
+                before_dedup = len(df)
+                df = duplicate_index.keep_first_seen(df)
+                duplicate_count += before_dedup - len(df)
+
+            # Continue the 'id' sequence from the previous chunk
+            df['id'] = range(next_id, next_id + len(df))
+            next_id += len(df)
+
+            df.to_csv(partial_file_path, mode='w' if chunk_number == 0 else 'a',
+                      header=chunk_number == 0, index=False)
+            print(f"Processed chunk {chunk_number + 1}: {next_id - 1} rows written so far.")
+        os.replace(partial_file_path, new_file_path)
+    finally:
+        duplicate_index.close()
+        # A failed or stopped run leaves no half written output behind
+        if os.path.exists(partial_file_path):
+            os.remove(partial_file_path)
+
+    print_counts(totals)
+    print(f"Removed {duplicate_count} duplicate rows based on updated image_url and image_alt.")
+    print(f"Completed processing. Updated file saved to {new_file_path}")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process a CSV file containing image URLs and associated article URLs.")
     parser.add_argument("file_path", type=str, help="Path to the CSV file.")
     parser.add_argument("--overwrite", action="store_true", help="Overwrite the original file.")
     parser.add_argument("--remove-invalid-links", action="store_true", help="Remove invalid image links.")
+    parser.add_argument("--workers", type=int, default=16, help="Number of concurrent link checks (default is 16).")
+    parser.add_argument("--per-host", type=int, default=4, help="Maximum concurrent link checks per host (default is 4).")
+    parser.add_argument("--link-cache", type=str, default="link_check_cache.db", help="SQLite file caching link checks across runs.")
+    parser.add_argument("--chunksize", type=int, default=0, help="Process the file in chunks of this many rows to bound memory use.")
+    parser.add_argument("--recheck-age", type=float, default=24 * 7, help="Hours after which a cached link check is repeated (default is 168).")
+    add_profile_arguments(parser)
 
     args = parser.parse_args()
 
-    process_csv(args.file_path, args.overwrite, args.remove_invalid_links)
+    link_validator = ImageLinkValidator(
+        max_workers=args.workers,
+        per_host=args.per_host,
+        cache_path=args.link_cache,
+        recheck_age_hours=args.recheck_age,
+    )
+    with profiled(args.profile, args.profile_output, args.profile_interval):
+        if args.chunksize:
+            process_csv_chunked(args.file_path, args.overwrite, args.remove_invalid_links, link_validator,
+                                chunksize=args.chunksize)
+        else:
+            process_csv(args.file_path, args.overwrite, args.remove_invalid_links, link_validator)
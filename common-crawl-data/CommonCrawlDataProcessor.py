@@ -16,24 +16,38 @@ import pandas as pd
 import json
 import requests
 import os
+from instrumentation import log_event, timer
 
 class CommonCrawlDataProcessor:
     def __init__(self, search_query, csv_filename="commoncrawl_preprocessed_data.csv", mode="w"):
         self.search_query = search_query
         self.csv_filename = csv_filename
         self.mode = mode if mode in ["w", "a"] else "w"
+        self.index_url = "https://index.commoncrawl.org/CC-MAIN-2024-26-index"
     
     def fetch_commoncrawl_data(self):
-        url = f"https://index.commoncrawl.org/CC-MAIN-2024-26-index?url={self.search_query}&output=json"
-        response = requests.get(url)
+        url = f"{self.index_url}?url={self.search_query}&output=json"
+        with timer("cdx", "fetch"):
+            response = requests.get(url)
         if response.status_code == 200:
             return response.text
         else:
             raise Exception(f"Failed to fetch data. Status code: {response.status_code}\nURL: {url}")
     
+    def iter_commoncrawl_records(self):
+        """Streams the index response and yields one parsed record per line."""
+        url = f"{self.index_url}?url={self.search_query}&output=json"
+        with requests.get(url, stream=True) as response:
+            if response.status_code != 200:
+                raise Exception(f"Failed to fetch data. Status code: {response.status_code}\nURL: {url}")
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+    
     def parse_json_data(self, data):
-        data_lines = data.strip().split('\n')
-        json_data = [json.loads(line) for line in data_lines]
+        with timer("cdx", "parse"):
+            data_lines = data.strip().split('\n')
+            json_data = [json.loads(line) for line in data_lines]
         return json_data
     
     def create_dataframe(self, json_data):
@@ -46,6 +60,8 @@ class CommonCrawlDataProcessor:
             existing_df = pd.read_csv(self.csv_filename)
             df = pd.concat([existing_df, df], ignore_index=True)
         df.to_csv(self.csv_filename, index=False)
+        log_event("index_saved", stage="cdx", search_query=self.search_query, csv_filename=self.csv_filename,
+                  rows=len(df))
         print(f"Data has been saved to {self.csv_filename}")
     
     def process_data(self):
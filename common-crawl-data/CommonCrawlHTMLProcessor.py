@@ -11,6 +11,7 @@ Features:
 - Extracts HTML content and image data from WARC files.
 - Writes successful entries to an output CSV file.
 - Updates the original input CSV with processing status and error details.
+- Logs JSON events to pipeline_log.jsonl and times the fetch, decompress and parse steps (see instrumentation.py).
 
 Usage:
 1. Provide the input CSV filename, which should include columns such as 'filename', 'offset', 'length', and 'urlkey'.
@@ -24,7 +25,6 @@ Dependencies:
 - beautifulsoup4
 - csv
 - io
-- datetime
 - os
 
 Example usage:
@@ -36,21 +36,16 @@ import requests
 import warcio
 import csv
 from bs4 import BeautifulSoup
-from datetime import datetime
 import os
+from instrumentation import ProgressReporter, log_event, timer, timers
 
 class CommonCrawlHTMLProcessor:
-    def __init__(self, input_csv, output_csv="commoncrawl_processed_data.csv", mode="w"):
+    def __init__(self, input_csv, output_csv="commoncrawl_processed_data.csv", mode="w", timer_stage="html"):
         self.input_csv = input_csv
         self.output_csv = output_csv
-        self.log_file = "logger.txt"
+        self.warc_base_url = "https://data.commoncrawl.org"
         self.mode = mode if mode in ["w", "a"] else "w"
-
-    def logger(self, text):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        new_line = f"{timestamp} - {text}\n"
-        with open(self.log_file, "a") as file:
-            file.write(new_line)
+        self.timer_stage = timer_stage  # Stage the step timers are recorded under
 
     def extract_html_data(self, html):
         soup = BeautifulSoup(html, 'html.parser')
@@ -58,6 +53,41 @@ class CommonCrawlHTMLProcessor:
         images = [(img.get('src'), img.get('alt')) for img in soup.find_all('img')]
         return article_title, images
 
+    def fetch_record_images(self, csv_record):
+        """Fetches the WARC record of one index entry and returns a row for every image in its HTML."""
+        warc_filename = csv_record['filename']
+        warc_record_offset = int(csv_record['offset'])
+        warc_record_length = int(csv_record['length'])
+
+        # Fetch the specified range of bytes from the WARC file
+        with timer(self.timer_stage, "fetch"):
+            response = requests.get(f'{self.warc_base_url}/{warc_filename}',
+                                    headers={'Range': f'bytes={warc_record_offset}-{warc_record_offset + warc_record_length - 1}'})
+
+        image_rows = []
+        # Open the response content as a byte stream
+        with io.BytesIO(response.content) as stream:
+            # Iterate over the records in the WARC file and read the HTML content of the responses,
+            # the gzip members are inflated while iterating and reading
+            with timer(self.timer_stage, "decompress"):
+                html_pages = [record.content_stream().read() for record in warcio.ArchiveIterator(stream)
+                              if record.rec_type == 'response']
+
+        for html in html_pages:
+            # Extract the required data from the HTML
+            with timer(self.timer_stage, "parse"):
+                article_title, images = self.extract_html_data(html)
+
+            for image_url, image_alt in images:
+                image_rows.append({
+                    'urlkey': csv_record['urlkey'],
+                    'article_title': article_title,
+                    'image_url': image_url,
+                    'image_alt': image_alt,
+                    'article_url': csv_record['url']
+                })
+        return image_rows
+
     def process_records(self):
         # Read the input CSV file and add status and remark columns
         with open(self.input_csv, 'r', encoding='utf-8') as csvfile:
@@ -72,7 +102,8 @@ class CommonCrawlHTMLProcessor:
             
             records = list(reader)
 
-        self.logger("Started processing")
+        log_event("stage_started", stage="html", input_csv=self.input_csv, records=len(records))
+        progress = ProgressReporter("html", total=len(records))
 
         # Create or open the output CSV file for writing successful entries
         write_header = not os.path.exists(self.output_csv) or self.mode == "w"
@@ -85,50 +116,24 @@ class CommonCrawlHTMLProcessor:
             unique_id = 1  # Initialize a unique ID counter
 
             # Loop through each record in the input CSV
-            for idx, csv_record in enumerate(records):
-                print(f"Processing record {idx + 1}/{len(records)}: {csv_record['urlkey']}")
-                warc_filename = csv_record['filename']
-                warc_record_offset = int(csv_record['offset'])
-                warc_record_length = int(csv_record['length'])
-
+            for csv_record in records:
                 try:
-                    # Fetch the specified range of bytes from the WARC file
-                    response = requests.get(f'https://data.commoncrawl.org/{warc_filename}',
-                                            headers={'Range': f'bytes={warc_record_offset}-{warc_record_offset + warc_record_length - 1}'})
-
-                    # Open the response content as a byte stream
-                    with io.BytesIO(response.content) as stream:
-                        # Iterate over the records in the WARC file
-                        for record in warcio.ArchiveIterator(stream):
-                            if record.rec_type == 'response':
-                                # Read the HTML content from the record
-                                html = record.content_stream().read()
-
-                                # Extract the required data from the HTML
-                                article_title, images = self.extract_html_data(html)
-
-                                # Write each image data to the output CSV
-                                for image_url, image_alt in images:
-                                    writer.writerow({
-                                        'id': unique_id,
-                                        'urlkey': csv_record['urlkey'],
-                                        'article_title': article_title,
-                                        'image_url': image_url,
-                                        'image_alt': image_alt,
-                                        'article_url': csv_record['url']
-                                    })
-                                    unique_id += 1  # Increment the unique ID counter
+                    # Write each image data to the output CSV
+                    for image_row in self.fetch_record_images(csv_record):
+                        writer.writerow({'id': unique_id, **image_row})
+                        unique_id += 1  # Increment the unique ID counter
 
                     # Update the record with status and remark
                     csv_record['status'] = 'Completed'
                     csv_record['remark'] = ''
                 except Exception as e:
                     # Log the error
-                    self.logger(f"Error processing record {csv_record['urlkey']}: {str(e)}")
+                    log_event("record_failed", stage="html", urlkey=csv_record['urlkey'], error=str(e))
 
                     # Update the record with status and remark
                     csv_record['status'] = 'Error'
                     csv_record['remark'] = str(e)
+                progress.update()
 
         # Write updated records with status and remark back to the input CSV
         with open(self.input_csv, 'w', newline='', encoding='utf-8') as csvfile:
@@ -136,7 +141,10 @@ class CommonCrawlHTMLProcessor:
             writer.writeheader()
             writer.writerows(records)
 
-        self.logger("Processing completed")
+        progress.finish()
+        print(timers.report(self.timer_stage))
+        log_event("stage_completed", stage="html", records=len(records), images=unique_id - 1,
+                  errors=sum(record['status'] == 'Error' for record in records), timers=timers.summary(self.timer_stage))
 
 # Example usage:
 if __name__ == "__main__":
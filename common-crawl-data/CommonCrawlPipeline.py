@@ -0,0 +1,305 @@
+"""
+Common Crawl Pipeline
+
+This script runs the whole image extraction workflow in a single process, from the Common Crawl index
+lookup to the SQLite table used by the captioning service. It replaces running the scripts one after the other:
+
+    CommonCrawlDataProcessor -> CommonCrawlHTMLProcessor -> CSVCleaner -> BWRatioFinderAndCSVInsertor
+    -> RemoveEmptyBWRatio -> image_description/csv_to_sql.py
+
+Every stage is a generator that turns one input item into zero or more output items. Stages run in their own
+worker threads and are connected by bounded queues, so rows flow to the database as soon as they are ready
+and no intermediate CSV file is written. A slow stage fills its input queue and pauses the stages before it.
+
+Stages:
+1. **index**: Streams the CDX index records for each search query.
+2. **warc**: Fetches each WARC record and extracts the article title and images from the HTML.
+3. **clean**: Trims fields, drops empty image URLs, repairs relative URLs and removes duplicates.
+4. **bw_ratio**: Calculates the black-and-white ratio of each image and drops rows without one.
+5. **sqlite**: Numbers the rows and inserts them into the table in batches.
+
+The clean stage drops a row whose (image_url, image_alt) is already in the table, so running the pipeline again
+on the same queries adds only the rows that are new.
+
+Each stage keeps its own number of workers and reports the items it received and produced per second. The
+report also has the step timers of instrumentation.py grouped by stage, failed items
+are logged as JSON lines to --log-file, and --profile runs the pipeline under cProfile or a sampling profiler.
+
+Usage:
+    python CommonCrawlPipeline.py --queries-csv search_queries_list.csv --database vanavil.db --table images
+    python CommonCrawlPipeline.py --query "https://www.cs.stanford.edu/*" --warc-workers 16 --bw-workers 20
+    python CommonCrawlPipeline.py --query "https://www.cs.stanford.edu/*" --profile sampling
+
+Dependencies:
+- requests
+- warcio
+- beautifulsoup4
+- pandas
+- pillow
+- cairosvg
+- python-dotenv
+"""
+
+import argparse
+import csv
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+from BWRatioFinderAndCSVInsertor import is_black_and_white
+from CSVCleaner import DuplicateIndex, construct_valid_image_url
+from CommonCrawlDataProcessor import CommonCrawlDataProcessor
+from CommonCrawlHTMLProcessor import CommonCrawlHTMLProcessor
+from instrumentation import add_profile_arguments, configure_log, log_event, profiled, timers
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_description"))
+from csv_to_sql import create_indexes, create_table, set_load_pragmas, upsert_rows
+
+# Marks the end of a stage's input
+END_OF_STREAM = object()
+
+class PipelineStage:
+    """Runs a generator function over every item of its input queue with a fixed number of worker threads."""
+
+    def __init__(self, name, function, workers=1, queue_size=1000):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.input_queue = queue.Queue(maxsize=queue_size)
+        self.output_queue = None
+        self.items_in = 0
+        self.items_out = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._running_workers = 0
+        self._threads = []
+
+    def start(self):
+        self.started_at = time.time()
+        self._running_workers = self.workers
+        for worker_number in range(self.workers):
+            thread = threading.Thread(target=self.run_worker, name=f"{self.name}-{worker_number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def run_worker(self):
+        while True:
+            item = self.input_queue.get()
+            if item is END_OF_STREAM:
+                # Put the marker back so the other workers of this stage see it too
+                self.input_queue.put(END_OF_STREAM)
+                break
+
+            started = time.time()
+            produced = 0
+            try:
+                for result in self.function(item):
+                    self.output_queue.put(result)
+                    produced += 1
+            except Exception as e:
+                log_event("item_failed", stage=self.name, error=str(e))
+                with self._lock:
+                    self.errors += 1
+
+            with self._lock:
+                self.items_in += 1
+                self.items_out += produced
+                self.busy_seconds += time.time() - started
+
+        with self._lock:
+            self._running_workers -= 1
+            last_worker = self._running_workers == 0
+        if last_worker:
+            self.finished_at = time.time()
+            self.output_queue.put(END_OF_STREAM)
+
+    def report(self):
+        elapsed = max((self.finished_at or time.time()) - self.started_at, 1e-9)
+        return (f"{self.name:<9} workers={self.workers:<3} in={self.items_in:<8} out={self.items_out:<8} "
+                f"errors={self.errors:<5} in/s={self.items_in / elapsed:8.1f} out/s={self.items_out / elapsed:8.1f} "
+                f"queued={self.input_queue.qsize()}")
+
+class CommonCrawlPipeline:
+    def __init__(self, database, table_name, index_workers=2, warc_workers=8, bw_workers=10,
+                 tolerance=0.1, queue_size=1000, batch_size=500, report_interval=10):
+        self.database = database
+        self.table_name = table_name
+        self.tolerance = tolerance
+        self.batch_size = batch_size
+        self.report_interval = report_interval
+        self.html_processor = CommonCrawlHTMLProcessor(input_csv=None, timer_stage="warc")
+        self.seen_rows = None  # DuplicateIndex of the rows in the table and the rows already passed on
+        self.seen_rows_lock = threading.Lock()
+
+        self.stages = [
+            PipelineStage("index", self.lookup_index, index_workers, queue_size),
+            PipelineStage("warc", self.extract_images, warc_workers, queue_size),
+            PipelineStage("clean", self.clean_image, 1, queue_size),
+            PipelineStage("bw_ratio", self.add_bw_ratio, bw_workers, queue_size),
+        ]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.output_queue = next_stage.input_queue
+        self.output_queue = queue.Queue(maxsize=queue_size)
+        self.stages[-1].output_queue = self.output_queue
+
+    def lookup_index(self, search_query):
+        for record in CommonCrawlDataProcessor(search_query).iter_commoncrawl_records():
+            if record.get('status', '200') == '200':
+                yield record
+
+    def extract_images(self, cdx_record):
+        yield from self.html_processor.fetch_record_images(cdx_record)
+
+    def clean_image(self, row):
+        row = {key: value.strip() if isinstance(value, str) else value for key, value in row.items()}
+        if not row['image_url']:
+            return
+
+        if not row['image_url'].startswith(('http://', 'https://')):
+            row['image_url'] = construct_valid_image_url(row['image_url'], row['article_url'])
+
+        # Only the first occurrence of an (image_url, image_alt) pair is kept, as in CSVCleaner.
+        # An empty alt is stored as NULL, so it is hashed as one to match the rows of an earlier run.
+        row_hash = DuplicateIndex.row_hash(row['image_url'], row['image_alt'] or None)
+        with self.seen_rows_lock:
+            if not self.seen_rows.add(row_hash):
+                return
+        yield row
+
+    def load_seen_rows(self, cursor):
+        """Fills a new on-disk DuplicateIndex with the rows already in the table."""
+        self.seen_rows = DuplicateIndex()
+        for image_url, image_alt in cursor.execute(f"SELECT image_url, image_alt FROM {self.table_name}"):
+            self.seen_rows.add(DuplicateIndex.row_hash(image_url, image_alt))
+
+    def add_bw_ratio(self, row):
+        bw_ratio = is_black_and_white(row['image_url'], self.tolerance)
+        # Rows without a ratio are dropped, as in RemoveEmptyBWRatio
+        if bw_ratio is not None:
+            yield {**row, 'bw_ratio': bw_ratio}
+
+    def insert_rows(self, cursor, rows, first_id):
+        upsert_rows(cursor, self.table_name, [
+            (first_id + offset, row['urlkey'], row['article_title'], row['image_url'],
+             row['image_alt'] or None, row['article_url'], row['bw_ratio'])
+            for offset, row in enumerate(rows)
+        ])
+        cursor.connection.commit()
+
+    def print_report(self, inserted):
+        for stage in self.stages:
+            print(stage.report())
+        print(f"{'sqlite':<9} inserted={inserted}")
+        print(timers.report())
+
+    def run(self, search_queries):
+        conn = sqlite3.connect(self.database)
+        cursor = conn.cursor()
+        set_load_pragmas(cursor)
+        create_table(cursor, self.table_name)
+        next_id = (cursor.execute(f"SELECT MAX(id) FROM {self.table_name}").fetchone()[0] or 0) + 1
+        self.load_seen_rows(cursor)
+
+        for stage in self.stages:
+            stage.start()
+
+        # Feed the search queries from a separate thread so the database writer starts right away
+        def feed_queries():
+            for search_query in search_queries:
+                self.stages[0].input_queue.put(search_query)
+            self.stages[0].input_queue.put(END_OF_STREAM)
+
+        threading.Thread(target=feed_queries, daemon=True).start()
+
+        started = time.time()
+        last_report = started
+        inserted = 0
+        batch = []
+        try:
+            while True:
+                try:
+                    row = self.output_queue.get(timeout=1)
+                except queue.Empty:
+                    row = None
+
+                if row is END_OF_STREAM:
+                    break
+                if row is not None:
+                    batch.append(row)
+
+                if len(batch) >= self.batch_size or (batch and row is None):
+                    self.insert_rows(cursor, batch, next_id)
+                    next_id += len(batch)
+                    inserted += len(batch)
+                    batch = []
+
+                if self.report_interval and time.time() - last_report >= self.report_interval:
+                    self.print_report(inserted)
+                    last_report = time.time()
+
+            if batch:
+                self.insert_rows(cursor, batch, next_id)
+                inserted += len(batch)
+            create_indexes(cursor, self.table_name)
+        finally:
+            conn.close()
+            self.seen_rows.close()
+
+        self.print_report(inserted)
+        elapsed = time.time() - started
+        print(f"Pipeline completed in {elapsed:.1f}s, {inserted / max(elapsed, 1e-9):.1f} rows/s inserted into "
+              f"'{self.table_name}' in {self.database}.")
+        log_event("pipeline_completed", seconds=round(elapsed, 3), inserted=inserted,
+                  stages={stage.name: {"in": stage.items_in, "out": stage.items_out, "errors": stage.errors}
+                          for stage in self.stages},
+                  timers=timers.summary())
+        return inserted
+
+def read_search_queries(search_query_csv_filename):
+    with open(search_query_csv_filename, 'r', encoding='utf-8') as csvfile:
+        for item in csv.DictReader(csvfile):
+            yield item["search_query"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Common Crawl image pipeline from the index to SQLite.")
+    parser.add_argument("--query", type=str, action="append", help="Search query, can be given more than once.")
+    parser.add_argument("--queries-csv", type=str, default="search_queries_list.csv", help="CSV file with a 'search_query' column, used when no --query is given.")
+    parser.add_argument("--database", type=str, default=os.getenv('DATABASE'), help="SQLite database file (default is $DATABASE).")
+    parser.add_argument("--table", type=str, default=os.getenv('TABLE_NAME'), help="Table name (default is $TABLE_NAME).")
+    parser.add_argument("--index-workers", type=int, default=2, help="Concurrent index lookups (default is 2).")
+    parser.add_argument("--warc-workers", type=int, default=8, help="Concurrent WARC record fetches (default is 8).")
+    parser.add_argument("--bw-workers", type=int, default=10, help="Concurrent image downloads for the BW ratio (default is 10).")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Tolerance level for non-black and white pixels (default is 0.1).")
+    parser.add_argument("--queue-size", type=int, default=1000, help="Maximum items waiting between two stages (default is 1000).")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows per database transaction (default is 500).")
+    parser.add_argument("--report-interval", type=float, default=10, help="Seconds between throughput reports, 0 to disable (default is 10).")
+    parser.add_argument("--log-file", type=str, default="pipeline_log.jsonl", help="JSON lines file for failed items and the run summary.")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.database or not args.table:
+        parser.error("--database and --table are required when DATABASE and TABLE_NAME are not set.")
+
+    search_queries = args.query or read_search_queries(args.queries_csv)
+    pipeline = CommonCrawlPipeline(
+        args.database, args.table,
+        index_workers=args.index_workers,
+        warc_workers=args.warc_workers,
+        bw_workers=args.bw_workers,
+        tolerance=args.tolerance,
+        queue_size=args.queue_size,
+        batch_size=args.batch_size,
+        report_interval=args.report_interval,
+    )
+    configure_log(args.log_file)
+    with profiled(args.profile, args.profile_output, args.profile_interval):
+        pipeline.run(search_queries)
+
+if __name__ == "__main__":
+    main()
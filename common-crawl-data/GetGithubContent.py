@@ -1,24 +1,343 @@
+"""
+GitHub File Content Fetcher
+
+This script fetches the contents of files given by their GitHub blob URLs
+(https://github.com/<owner>/<repo>/blob/<ref>/<path>).
+
+Features:
+- **Grouping**: URLs are grouped by repository and ref. When at least --archive-threshold files come from one
+  repository, its tar.gz archive is streamed once and only the requested files are kept.
+- **Concurrency**: Every other file, and every file of an archive that could not be read, is fetched from
+  raw.githubusercontent.com by a pool of worker threads with pooled sessions.
+- **Cache**: With a cache path (--cache), contents are kept in a SQLite cache with their ETags. A cached file
+  is revalidated with If-None-Match, and a 304 answer is served from the cache without a download. Without
+  one nothing is written to disk.
+- **Typed results**: Every URL gets a FileResult with a status (ok, not_found, invalid_url, error) and the
+  source it came from (raw, archive, cache), instead of error strings mixed in with the contents.
+
+Usage:
+    python GetGithubContent.py https://github.com/<owner>/<repo>/blob/main/README.md
+    python GetGithubContent.py --url-file github_urls.txt --output-dir github_files
+
+    fetch_github_file(url)  # -> str, the contents or an error message, as before
+    fetch_github_file_result(url)  # -> FileResult
+
+    fetcher = GithubContentFetcher(cache_path="github_content_cache.db")
+    results = fetcher.fetch_files(urls)  # -> {url: FileResult}
+
+Dependencies:
+- requests
+"""
+
+import argparse
+import os
+import sqlite3
+import tarfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+
+RAW_BASE_URL = "https://raw.githubusercontent.com"
+ARCHIVE_BASE_URL = "https://codeload.github.com"
+
+OK = 'ok'
+NOT_FOUND = 'not_found'
+INVALID_URL = 'invalid_url'
+ERROR = 'error'
+
+class FileResult(namedtuple('FileResult', ['url', 'status', 'content', 'source', 'error'])):
+    """content is bytes for OK results and None otherwise, error holds the reason for the other statuses."""
+    __slots__ = ()
+
+    @property
+    def text(self):
+        return None if self.content is None else self.content.decode('utf-8', errors='replace')
+
+BlobLocation = namedtuple('BlobLocation', ['owner', 'repo', 'ref', 'path'])
+
+def parse_blob_url(github_url):
+    """Splits a GitHub blob URL into a BlobLocation, or returns None if it is not one."""
+    parts = urlsplit(github_url)
+    if parts.hostname not in ('github.com', 'www.github.com'):
+        return None
+    segments = [unquote(segment) for segment in parts.path.strip('/').split('/')]
+    # Refs with a slash in their name cannot be told apart from the path, the first segment is taken as the ref
+    if len(segments) < 5 or segments[2] not in ('blob', 'raw'):
+        return None
+    # The segments become directories under --output-dir, so none may climb out of it (also when percent-encoded)
+    if any(segment in ('', '.', '..') or '/' in segment or '\\' in segment or '\0' in segment for segment in segments):
+        return None
+    return BlobLocation(segments[0], segments[1], segments[3], '/'.join(segments[4:]))
+
+class ContentCache:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                cache_key TEXT PRIMARY KEY,  -- raw URL, or archive:<owner>/<repo>/<ref>:<path>
+                etag TEXT,
+                content BLOB
+            );
+            CREATE TABLE IF NOT EXISTS archives (
+                archive_key TEXT PRIMARY KEY,
+                etag TEXT
+            );
+        ''')
+        self.conn.commit()
+
+    def get_file(self, cache_key):
+        with self.lock:
+            return self.conn.execute('SELECT etag, content FROM files WHERE cache_key = ?', (cache_key,)).fetchone()
+
+    def put_files(self, entries):
+        """Stores a list of (cache_key, etag, content)."""
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO files (cache_key, etag, content) VALUES (?, ?, ?)', entries)
+            self.conn.commit()
+
+    def get_archive_etag(self, archive_key):
+        with self.lock:
+            row = self.conn.execute('SELECT etag FROM archives WHERE archive_key = ?', (archive_key,)).fetchone()
+            return row[0] if row else None
+
+    def put_archive_etag(self, archive_key, etag):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO archives (archive_key, etag) VALUES (?, ?)', (archive_key, etag))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+class NoCache:
+    """Stands in for ContentCache without a cache path: nothing is stored, so nothing is revalidated."""
+
+    def get_file(self, cache_key):
+        return None
+
+    def put_files(self, entries):
+        pass
+
+    def get_archive_etag(self, archive_key):
+        return None
+
+    def put_archive_etag(self, archive_key, etag):
+        pass
 
-def fetch_github_file(github_url):
+    def close(self):
+        pass
+
+class GithubContentFetcher:
+    def __init__(self, cache_path=None, max_workers=8, archive_threshold=10, token=None,
+                 timeout=30, raw_base_url=RAW_BASE_URL, archive_base_url=ARCHIVE_BASE_URL):
+        self.cache = ContentCache(cache_path) if cache_path else NoCache()
+        self.max_workers = max_workers
+        self.archive_threshold = archive_threshold
+        self.token = token
+        self.timeout = timeout
+        self.raw_base_url = raw_base_url.rstrip('/')
+        self.archive_base_url = archive_base_url.rstrip('/')
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+        self.stats = {'raw': 0, 'archive': 0, 'cache': 0, 'requests': 0}
+
+    def get_session(self):
+        # One pooled session per worker thread, requests.Session is not thread safe
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            if self.token:
+                session.headers['Authorization'] = f"token {self.token}"
+            self._local.session = session
+        return session
+
+    def count(self, key):
+        with self._counter_lock:
+            self.stats[key] += 1
+
+    def raw_url(self, location):
+        return f"{self.raw_base_url}/{location.owner}/{location.repo}/{location.ref}/{location.path}"
+
+    def fetch_raw(self, url, location):
+        """Fetches one file from raw.githubusercontent.com, revalidating a cached copy with its ETag."""
+        raw_url = self.raw_url(location)
+        cached = self.cache.get_file(raw_url)
+        headers = {'If-None-Match': cached[0]} if cached and cached[0] else {}
+        self.count('requests')
+        try:
+            response = self.get_session().get(raw_url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            return FileResult(url, ERROR, None, 'raw', str(e))
+
+        if response.status_code == 304 and cached:
+            self.count('cache')
+            return FileResult(url, OK, cached[1], 'cache', None)
+        if response.status_code == 404:
+            return FileResult(url, NOT_FOUND, None, 'raw', "404 Not Found")
+        if response.status_code != 200:
+            return FileResult(url, ERROR, None, 'raw', f"HTTP {response.status_code}")
+        self.cache.put_files([(raw_url, response.headers.get('ETag'), response.content)])
+        self.count('raw')
+        return FileResult(url, OK, response.content, 'raw', None)
+
+    def fetch_archive(self, owner, repo, ref, wanted):
+        """Streams a repository archive once and picks out the wanted files.
+
+        wanted maps a path in the repository to the URLs that asked for it. Returns {url: FileResult} for the
+        files found; the caller fetches the rest one by one.
+        """
+        archive_key = f"{owner}/{repo}/{ref}"
+        cache_keys = {path: f"archive:{archive_key}:{path}" for path in wanted}
+        etag = self.cache.get_archive_etag(archive_key)
+        cached = {path: self.cache.get_file(key) for path, key in cache_keys.items()}
+        # Revalidation only helps if every wanted file is in the cache, a 304 carries no body
+        headers = {'If-None-Match': etag} if etag and all(cached.values()) else {}
+
+        self.count('requests')
+        results = {}
+        try:
+            with self.get_session().get(f"{self.archive_base_url}/{owner}/{repo}/tar.gz/{ref}", headers=headers,
+                                        timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304:
+                    for path, urls in wanted.items():
+                        for url in urls:
+                            self.count('cache')
+                            results[url] = FileResult(url, OK, cached[path][1], 'cache', None)
+                    return results
+                if response.status_code != 200:
+                    print(f"Archive of {archive_key} returned HTTP {response.status_code}, fetching files one by one.")
+                    return results
+
+                found = []
+                response.raw.decode_content = True
+                # Stream mode reads the archive front to back without keeping it, members are <repo>-<ref>/<path>
+                with tarfile.open(fileobj=response.raw, mode='r|gz') as archive:
+                    for member in archive:
+                        path = member.name.split('/', 1)[-1]
+                        if not member.isfile() or path not in wanted:
+                            continue
+                        content = archive.extractfile(member).read()
+                        found.append((cache_keys[path], None, content))
+                        for url in wanted[path]:
+                            self.count('archive')
+                            results[url] = FileResult(url, OK, content, 'archive', None)
+                        if len(found) == len(wanted):
+                            break
+        except (requests.RequestException, tarfile.TarError, EOFError) as e:
+            print(f"Reading the archive of {archive_key} failed ({e}), fetching files one by one.")
+            return {}
+
+        self.cache.put_files(found)
+        # Without all wanted files cached the ETag would allow a 304 that cannot be served
+        if len(found) == len(wanted):
+            self.cache.put_archive_etag(archive_key, response.headers.get('ETag'))
+        return results
+
+    def fetch_files(self, github_urls):
+        """Fetches many blob URLs. Returns {url: FileResult} in the order of the input."""
+        results = {}
+        groups = {}
+        for url in dict.fromkeys(github_urls):
+            location = parse_blob_url(url)
+            if location is None:
+                results[url] = FileResult(url, INVALID_URL, None, None, "Not a GitHub blob URL")
+                continue
+            groups.setdefault((location.owner, location.repo, location.ref), {}).setdefault(location.path, []).append(url)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            archive_futures = {executor.submit(self.fetch_archive, owner, repo, ref, wanted): wanted
+                               for (owner, repo, ref), wanted in groups.items() if len(wanted) >= self.archive_threshold}
+            single = [url for (owner, repo, ref), wanted in groups.items() if len(wanted) < self.archive_threshold
+                      for urls in wanted.values() for url in urls]
+            raw_futures = [executor.submit(self.fetch_raw, url, parse_blob_url(url)) for url in single]
+
+            for future, wanted in archive_futures.items():
+                archive_results = future.result()
+                results.update(archive_results)
+                # Files missing from the archive, or the whole group if it failed, go through raw URLs
+                missing = [url for urls in wanted.values() for url in urls if url not in archive_results]
+                raw_futures.extend(executor.submit(self.fetch_raw, url, parse_blob_url(url)) for url in missing)
+            for future in raw_futures:
+                result = future.result()
+                results[result.url] = result
+
+        return {url: results[url] for url in dict.fromkeys(github_urls)}
+
+    def close(self):
+        self.cache.close()
+
+def fetch_github_file_result(github_url, fetcher=None):
+    """Fetches a single file and returns its FileResult.
+
+    Pass a fetcher to reuse its sessions and cache across calls, otherwise one without a cache is opened and closed.
+    """
+    if fetcher is not None:
+        return fetcher.fetch_files([github_url])[github_url]
+    fetcher = GithubContentFetcher()
     try:
-        # Replace 'github.com' with 'raw.githubusercontent.com' in the URL
-        raw_url = github_url.replace('github.com', 'raw.githubusercontent.com').replace('/blob/', '/')
-        
-        # Send a GET request to fetch the raw file contents
-        response = requests.get(raw_url)
-        
-        # Check if the request was successful
-        if response.status_code == 200:
-            file_content = response.text
-            return file_content
-        else:
-            return f"Failed to fetch file: {response.status_code}"
-    except Exception as e:
-        return f"An error occurred: {str(e)}"
-
-# Example usage
-github_file_url = 'https://github.com/mayuragarwal2004/sugam-frontend/blob/main/src/NoPage.jsx'
-file_content = fetch_github_file(github_file_url)
-
-print(file_content)
+        return fetcher.fetch_files([github_url])[github_url]
+    finally:
+        fetcher.close()
+
+def fetch_github_file(github_url, fetcher=None):
+    """Fetches a single file and returns its contents, or an error message as the original version did."""
+    result = fetch_github_file_result(github_url, fetcher)
+    if result.status == OK:
+        return result.text
+    if result.status == NOT_FOUND:
+        return "Failed to fetch file: 404"
+    if result.error.startswith("HTTP "):
+        return f"Failed to fetch file: {result.error[len('HTTP '):]}"
+    return f"An error occurred: {result.error}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch the contents of GitHub files from their blob URLs.")
+    parser.add_argument("urls", nargs="*", help="GitHub blob URLs.")
+    parser.add_argument("--url-file", type=str, help="File with one GitHub blob URL per line.")
+    parser.add_argument("--output-dir", type=str, help="Write every fetched file to <output-dir>/<owner>/<repo>/<ref>/<path>.")
+    parser.add_argument("--cache", type=str, help="SQLite cache of contents and ETags, for example github_content_cache.db (default is none).")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent downloads (default is 8).")
+    parser.add_argument("--archive-threshold", type=int, default=10,
+                        help="Download the repository archive when at least this many files come from it (default is 10).")
+    args = parser.parse_args()
+
+    urls = list(args.urls)
+    if args.url_file:
+        with open(args.url_file, encoding='utf-8') as f:
+            urls.extend(line.strip() for line in f if line.strip())
+    if not urls:
+        urls = ['https://github.com/mayuragarwal2004/sugam-frontend/blob/main/src/NoPage.jsx']
+
+    fetcher = GithubContentFetcher(args.cache, args.workers, args.archive_threshold, token=os.getenv("GITHUB_TOKEN"))
+    results = fetcher.fetch_files(urls)
+    output_root = os.path.realpath(args.output_dir) if args.output_dir else None
+    for result in results.values():
+        if result.status != OK:
+            print(f"{result.url}: {result.status} ({result.error})")
+        elif args.output_dir:
+            location = parse_blob_url(result.url)
+            file_path = os.path.realpath(os.path.join(output_root, location.owner, location.repo, location.ref,
+                                                      *location.path.split('/')))
+            if os.path.commonpath([output_root, file_path]) != output_root:
+                print(f"{result.url}: not written, its path leads outside {args.output_dir}")
+                continue
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'wb') as f:
+                f.write(result.content)
+        elif len(results) == 1:
+            print(result.text)
+
+    succeeded = sum(result.status == OK for result in results.values())
+    print(f"Fetched {succeeded}/{len(results)} files: {fetcher.stats['raw']} raw, {fetcher.stats['archive']} from archives, "
+          f"{fetcher.stats['cache']} from the cache, {fetcher.stats['requests']} requests.")
+    fetcher.close()
+
+if __name__ == "__main__":
+    main()
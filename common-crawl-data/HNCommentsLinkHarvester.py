@@ -0,0 +1,288 @@
+"""
+Hacker News Comment Link Harvester
+
+This script collects the links posted in Hacker News comments through the Algolia search_by_date API and keeps
+them in a SQLite link store. It replaces the single request of HNCommentsLinkExtractor.py, which only sees the
+first page of hits.
+
+Features:
+- **Time slicing**: The API returns at most 1000 hits per query, so the time range is cut into slices, and a
+  slice with more hits than that is split in half until every part fits.
+- **Concurrency**: Slices are fetched by several worker threads with pooled sessions.
+- **Resume**: The store keeps a cursor up to which every slice was harvested. Without --since, the next run
+  starts from it.
+- **Deduplication**: Links are canonicalized (lowercase host, no fragment, no default port, no tracking
+  parameters) and stored once, with the number of comments that mention them. A comment seen again on a
+  rerun is not counted twice.
+- **Export**: The domains of the stored links can be written in the search_query format of
+  search_queries_list.csv, ready for CommonCrawlPipeline.py.
+
+Usage:
+    python HNCommentsLinkHarvester.py --hours 72 --workers 4
+    python HNCommentsLinkHarvester.py --export-queries hn_search_queries.csv --min-mentions 3
+
+Dependencies:
+- requests
+"""
+
+import argparse
+import csv
+import html
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+SEARCH_BY_DATE_URL = "https://hn.algolia.com/api/v1/search_by_date"
+
+# Most hits the API returns for one query, over all its pages
+MAX_HITS_PER_QUERY = 1000
+
+HREF_PATTERN = re.compile(r'href="([^"]+)"')
+URL_PATTERN = re.compile(r'https?://[^\s<>"\']+')
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMETERS = re.compile(r'^(utm_.*|fbclid|gclid|mc_cid|mc_eid|ref|ref_src)$')
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+IGNORED_HOSTS = {'news.ycombinator.com'}
+
+def canonicalize_url(url):
+    """Returns a canonical form of the URL, or None if it is not an http(s) URL."""
+    url = html.unescape(url).strip().rstrip('.,;:!?)]}\'"')
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+
+    host = parts.hostname.lower()
+    if parts.port and str(parts.port) != DEFAULT_PORTS[scheme]:
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                             if not TRACKING_PARAMETERS.match(key)))
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+def extract_links(comment_html):
+    """Returns the canonical links of a comment, from its anchors and from URLs written as plain text."""
+    text = html.unescape(comment_html or '')
+    links = set()
+    for url in HREF_PATTERN.findall(text) + URL_PATTERN.findall(text):
+        link = canonicalize_url(url)
+        if link and urlsplit(link).hostname not in IGNORED_HOSTS:
+            links.add(link)
+    return links
+
+class LinkStore:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS links (
+                url TEXT PRIMARY KEY,
+                domain TEXT NOT NULL,
+                mentions INTEGER NOT NULL DEFAULT 0,
+                first_seen_at INTEGER,
+                last_seen_at INTEGER,
+                first_comment_id TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_links_domain ON links (domain);
+            CREATE TABLE IF NOT EXISTS comments (
+                comment_id TEXT PRIMARY KEY,
+                created_at INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS harvest_state (
+                query TEXT PRIMARY KEY,
+                cursor INTEGER  -- Every comment created before this Unix time was harvested
+            );
+        ''')
+        self.conn.commit()
+
+    def add_comments(self, hits):
+        """Stores the links of comments not seen before. Returns the number of new comments."""
+        with self.lock:
+            new_comments = 0
+            for hit in hits:
+                inserted = self.conn.execute('INSERT OR IGNORE INTO comments (comment_id, created_at) VALUES (?, ?)',
+                                             (hit['objectID'], hit.get('created_at_i'))).rowcount
+                if not inserted:
+                    continue
+                new_comments += 1
+                created_at = hit.get('created_at_i')
+                self.conn.executemany('''
+                    INSERT INTO links (url, domain, mentions, first_seen_at, last_seen_at, first_comment_id)
+                    VALUES (?, ?, 1, ?, ?, ?)
+                    ON CONFLICT(url) DO UPDATE SET
+                        mentions = mentions + 1,
+                        first_seen_at = MIN(first_seen_at, excluded.first_seen_at),
+                        last_seen_at = MAX(last_seen_at, excluded.last_seen_at)
+                ''', [(link, urlsplit(link).hostname, created_at, created_at, hit['objectID'])
+                      for link in extract_links(hit.get('comment_text'))])
+            self.conn.commit()
+            return new_comments
+
+    def get_cursor(self, query):
+        row = self.conn.execute('SELECT cursor FROM harvest_state WHERE query = ?', (query,)).fetchone()
+        return row[0] if row else None
+
+    def set_cursor(self, query, cursor):
+        with self.lock:
+            self.conn.execute('''
+                INSERT INTO harvest_state (query, cursor) VALUES (?, ?)
+                ON CONFLICT(query) DO UPDATE SET cursor = MAX(cursor, excluded.cursor)
+            ''', (query, cursor))
+            self.conn.commit()
+
+    def export_search_queries(self, path, min_mentions=1):
+        """Writes one search query per domain, most mentioned first, in the format of search_queries_list.csv."""
+        rows = self.conn.execute('''
+            SELECT domain, MIN(url), SUM(mentions) AS total FROM links
+            GROUP BY domain HAVING total >= ?
+            ORDER BY total DESC, domain
+        ''', (min_mentions,)).fetchall()
+        with open(path, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['search_query'])
+            for domain, url, _ in rows:
+                writer.writerow([f"{urlsplit(url).scheme}://{domain}/*"])
+        return len(rows)
+
+class HNCommentsLinkHarvester:
+    def __init__(self, store, query="http", workers=4, slice_seconds=3600, timeout=30):
+        self.store = store
+        self.query = query
+        self.workers = workers
+        self.slice_seconds = slice_seconds
+        self.timeout = timeout
+        self.requests_made = 0
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+
+    def get_session(self):
+        # One pooled session per worker thread, requests.Session is not thread safe
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            self._local.session = session
+        return session
+
+    def search(self, start, end, page, attempts=4):
+        """Fetches one page of the comments created in [start, end)."""
+        params = {
+            "tags": "comment",
+            "query": self.query,
+            "numericFilters": f"created_at_i>={start},created_at_i<{end}",
+            "hitsPerPage": MAX_HITS_PER_QUERY,
+            "page": page,
+        }
+        for attempt in range(attempts):
+            with self._counter_lock:
+                self.requests_made += 1
+            try:
+                response = self.get_session().get(SEARCH_BY_DATE_URL, params=params, timeout=self.timeout)
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise requests.HTTPError(f"status {response.status_code}")
+                response.raise_for_status()
+                return response.json()
+            except (requests.RequestException, ValueError) as e:
+                if attempt == attempts - 1:
+                    raise
+                print(f"Request for {start}-{end} page {page} failed ({e}), retrying.")
+                time.sleep(2 ** attempt)
+
+    def harvest_slice(self, start, end):
+        """Harvests the comments created in [start, end). Returns (comments seen, new comments)."""
+        data = self.search(start, end, 0)
+        if data.get('nbHits', 0) > MAX_HITS_PER_QUERY and end - start > 1:
+            # Too many hits to page through, split the slice until every part fits under the cap
+            middle = (start + end) // 2
+            first = self.harvest_slice(start, middle)
+            second = self.harvest_slice(middle, end)
+            return first[0] + second[0], first[1] + second[1]
+
+        hits = list(data.get('hits', []))
+        for page in range(1, data.get('nbPages', 1)):
+            hits.extend(self.search(start, end, page).get('hits', []))
+        return len(hits), self.store.add_comments(hits)
+
+    def harvest(self, since, until):
+        """Harvests [since, until) slice by slice and moves the stored cursor over completed slices."""
+        slices = [(start, min(start + self.slice_seconds, until)) for start in range(since, until, self.slice_seconds)]
+        done = set()
+        next_slice = 0
+        seen = new = failed = 0
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.harvest_slice, start, end): index
+                       for index, (start, end) in enumerate(slices)}
+            for future in as_completed(futures):
+                index = futures[future]
+                start, end = slices[index]
+                try:
+                    slice_seen, slice_new = future.result()
+                except Exception as e:
+                    print(f"Slice {datetime.fromtimestamp(start, timezone.utc)} failed: {e}")
+                    failed += 1
+                    continue
+                seen += slice_seen
+                new += slice_new
+                done.add(index)
+
+                # The cursor only moves over slices that are done without a gap before them
+                while next_slice in done:
+                    next_slice += 1
+                if next_slice:
+                    self.store.set_cursor(self.query, slices[next_slice - 1][1])
+                print(f"Slice {datetime.fromtimestamp(start, timezone.utc):%Y-%m-%d %H:%M}: {slice_seen} comments, "
+                      f"{slice_new} new ({len(done)}/{len(slices)} slices)")
+
+        elapsed = time.time() - started
+        print(f"Harvested {seen} comments ({new} new) from {len(slices)} slices in {elapsed:.1f}s "
+              f"with {self.requests_made} requests, {failed} slices failed.")
+        return new
+
+def parse_time(value):
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+def main():
+    parser = argparse.ArgumentParser(description="Harvest the links posted in Hacker News comments.")
+    parser.add_argument("--store", type=str, default="hn_links.db", help="SQLite link store (default is hn_links.db).")
+    parser.add_argument("--query", type=str, default="http", help="Algolia search query (default is http).")
+    parser.add_argument("--since", type=parse_time, help="Start time (ISO format, UTC). Default is the stored cursor, else --hours ago.")
+    parser.add_argument("--until", type=parse_time, help="End time (ISO format, UTC). Default is now.")
+    parser.add_argument("--hours", type=float, default=24, help="Hours to harvest when there is no cursor or --since (default is 24).")
+    parser.add_argument("--slice-hours", type=float, default=1, help="Length of a time slice in hours (default is 1).")
+    parser.add_argument("--workers", type=int, default=4, help="Slices fetched concurrently (default is 4).")
+    parser.add_argument("--export-queries", type=str, help="Write the stored domains as search queries to this CSV file and exit.")
+    parser.add_argument("--min-mentions", type=int, default=1, help="Only export domains mentioned this often (default is 1).")
+    args = parser.parse_args()
+
+    store = LinkStore(args.store)
+    if args.export_queries:
+        exported = store.export_search_queries(args.export_queries, args.min_mentions)
+        print(f"Wrote {exported} search queries to {args.export_queries}.")
+        return
+
+    until = args.until or int(datetime.now(timezone.utc).timestamp())
+    since = args.since or store.get_cursor(args.query) or int(until - timedelta(hours=args.hours).total_seconds())
+    if since >= until:
+        print("Nothing to harvest, the cursor is already at the end time.")
+        return
+
+    print(f"Harvesting comments from {datetime.fromtimestamp(since, timezone.utc)} to {datetime.fromtimestamp(until, timezone.utc)}.")
+    harvester = HNCommentsLinkHarvester(store, args.query, args.workers, int(args.slice_hours * 3600))
+    harvester.harvest(since, until)
+
+if __name__ == "__main__":
+    main()
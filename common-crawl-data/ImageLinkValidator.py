@@ -0,0 +1,142 @@
+"""
+This module checks whether image URLs still point to an image, without downloading the images.
+
+Features:
+- Sends a HEAD request for every URL and falls back to a ranged GET (first byte only) for servers
+  that do not support HEAD or do not report a Content-Type for it.
+- Checks URLs concurrently with a bounded number of worker threads, a per-host limit so a single
+  site is never hit by all workers at once, and pooled keep-alive sessions per thread.
+- Caches results in a small SQLite file so later runs only recheck URLs older than the recheck age.
+  Only definitive answers (an HTTP status was received) are cached. Timeouts and connection errors give
+  None ("unknown"), are not cached and are checked again on the next run.
+- Times every check under the "fetch" step of instrumentation.py and prints progress every few seconds.
+
+Usage:
+    validator = ImageLinkValidator(max_workers=16, per_host=4, cache_path="link_check_cache.db")
+    results = validator.validate(["https://example.com/a.png", "https://example.com/b.png"])
+    # results -> {"https://example.com/a.png": True, "https://example.com/b.png": False}
+    # None means the check failed without an answer, callers should keep such rows
+
+Dependencies:
+- requests
+"""
+
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import ProgressReporter, timer
+
+# Status codes returned by servers that do not implement HEAD properly
+HEAD_UNSUPPORTED_STATUS = {403, 405, 501}
+
+class ImageLinkValidator:
+    def __init__(self, max_workers=16, per_host=4, timeout=10, cache_path=None, recheck_age_hours=24 * 7):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.cache_path = cache_path
+        self.recheck_age = recheck_age_hours * 3600
+        self._local = threading.local()
+        self._host_limits = defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+        self._host_limits_lock = threading.Lock()
+
+    def get_session(self):
+        # One pooled session per worker thread, requests.Session is not thread safe
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.per_host)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+        return session
+
+    def host_limit(self, url):
+        with self._host_limits_lock:
+            return self._host_limits[urlparse(url).netloc]
+
+    def check_url(self, url):
+        """Returns True for an image Content-Type, False for any other answer and None without an answer."""
+        session = self.get_session()
+        with self.host_limit(url), timer("link_check", "fetch"):
+            try:
+                response = session.head(url, timeout=self.timeout, allow_redirects=True)
+                content_type = response.headers.get('Content-Type')
+                if response.status_code in HEAD_UNSUPPORTED_STATUS or (response.ok and not content_type):
+                    # Ask for the first byte only instead of the whole image
+                    response = session.get(url, timeout=self.timeout, headers={'Range': 'bytes=0-0'}, stream=True)
+                    response.close()
+                    content_type = response.headers.get('Content-Type')
+                return response.ok and bool(content_type) and content_type.startswith('image')
+            except requests.RequestException:
+                return None
+
+    def load_cached(self, urls):
+        # Returns the cached results that are still younger than the recheck age
+        if not self.cache_path:
+            return {}
+        cutoff = time.time() - self.recheck_age
+        cached = {}
+        with sqlite3.connect(self.cache_path) as conn:
+            self.create_cache_table(conn)
+            url_list = list(urls)
+            for start in range(0, len(url_list), 500):
+                batch = url_list[start:start + 500]
+                rows = conn.execute(f'''
+                    SELECT url, is_valid FROM link_checks
+                    WHERE checked_at >= ? AND url IN ({",".join("?" for _ in batch)})
+                ''', [cutoff] + batch)
+                cached.update({url: bool(is_valid) for url, is_valid in rows})
+        return cached
+
+    def store_results(self, results):
+        if not self.cache_path or not results:
+            return
+        checked_at = time.time()
+        with sqlite3.connect(self.cache_path) as conn:
+            self.create_cache_table(conn)
+            conn.executemany('''
+                INSERT INTO link_checks (url, is_valid, checked_at) VALUES (?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET is_valid = excluded.is_valid, checked_at = excluded.checked_at
+            ''', [(url, int(is_valid), checked_at) for url, is_valid in results.items()])
+
+    @staticmethod
+    def create_cache_table(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS link_checks (
+                url TEXT PRIMARY KEY,
+                is_valid INTEGER NOT NULL,
+                checked_at REAL NOT NULL
+            )
+        ''')
+
+    def validate(self, urls):
+        """Checks every unique URL once and returns a dict of url -> True, False or None (unknown)."""
+        unique_urls = set(urls)
+        results = self.load_cached(unique_urls)
+        pending = [url for url in unique_urls if url not in results]
+        if results:
+            print(f"Reusing {len(results)} cached link checks, checking {len(pending)} links.")
+
+        checked = {}
+        progress = ProgressReporter("link_check", total=len(pending), interval=10)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.check_url, url): url for url in pending}
+            for future in as_completed(futures):
+                checked[futures[future]] = future.result()
+                progress.update()
+
+        # Transport errors are temporary, caching them would drop good links until the recheck age passes
+        unknown = sum(1 for is_valid in checked.values() if is_valid is None)
+        if unknown:
+            print(f"{unknown} links could not be checked (timeouts or connection errors), they are kept.")
+        self.store_results({url: is_valid for url, is_valid in checked.items() if is_valid is not None})
+        results.update(checked)
+        return results
@@ -2,11 +2,12 @@
 This script processes a CSV file containing image data by removing records with empty 'bw_ratio' values.
 
 Usage:
-    python remove_empty_bw_ratio.py input_csv output_csv
+    python remove_empty_bw_ratio.py input_csv output_csv [--chunksize N]
 
 Arguments:
     input_csv  - Path to the input CSV file containing image data.
     output_csv - Path to save the output CSV file after removing records with empty 'bw_ratio' values.
+    --chunksize - Optional. Streams the input in chunks of N rows, writing the output incrementally.
 
 The script loads the input CSV, removes any rows where the 'bw_ratio' column is empty, and saves the cleaned data
 to the specified output CSV file.
@@ -22,10 +23,14 @@ Dependencies:
 
 import pandas as pd
 import argparse
+import os
+
+# Text columns are read as strings, otherwise a chunk where every value is empty is inferred as float64
+TEXT_COLUMN_DTYPES = {'urlkey': str, 'article_title': str, 'image_url': str, 'image_alt': str, 'article_url': str}
 
 def remove_empty_bw_ratio(input_csv, output_csv):
     # Load the CSV file into a DataFrame
-    df = pd.read_csv(input_csv)
+    df = pd.read_csv(input_csv, dtype=TEXT_COLUMN_DTYPES)
 
     # Remove rows where 'bw_ratio' is empty
     df_cleaned = df.dropna(subset=['bw_ratio'])
@@ -38,10 +43,36 @@ def remove_empty_bw_ratio(input_csv, output_csv):
     # Save the cleaned DataFrame to a new CSV file
     df_cleaned.to_csv(output_csv, index=False)
 
+def remove_empty_bw_ratio_chunked(input_csv, output_csv, chunksize=100000):
+    # Stream the CSV so that only one chunk is held in memory at a time
+    partial_csv = output_csv + ".part"
+    next_id = 1
+
+    # Chunks go to a temporary file that replaces the output only once every chunk is written
+    try:
+        for chunk_number, df in enumerate(pd.read_csv(input_csv, chunksize=chunksize, dtype=TEXT_COLUMN_DTYPES)):
+            df_cleaned = df.dropna(subset=['bw_ratio'])
+
+            # Continue the 'id' sequence from the previous chunk
+            df_cleaned = df_cleaned.assign(id=range(next_id, next_id + len(df_cleaned)))
+            next_id += len(df_cleaned)
+
+            df_cleaned.to_csv(partial_csv, mode='w' if chunk_number == 0 else 'a',
+                              header=chunk_number == 0, index=False)
+        os.replace(partial_csv, output_csv)
+    finally:
+        # A failed or stopped run leaves no half written output behind
+        if os.path.exists(partial_csv):
+            os.remove(partial_csv)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Remove records with empty 'bw_ratio' values from a CSV file.")
     parser.add_argument("input_csv", help="Path to the input CSV file")
     parser.add_argument("output_csv", help="Path to save the output CSV file")
+    parser.add_argument("--chunksize", type=int, default=0, help="Process the file in chunks of this many rows to bound memory use")
     args = parser.parse_args()
 
-    remove_empty_bw_ratio(args.input_csv, args.output_csv)
+    if args.chunksize:
+        remove_empty_bw_ratio_chunked(args.input_csv, args.output_csv, args.chunksize)
+    else:
+        remove_empty_bw_ratio(args.input_csv, args.output_csv)
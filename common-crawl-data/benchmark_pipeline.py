@@ -0,0 +1,478 @@
+"""
+Pipeline Benchmark Suite
+
+This script measures the throughput of every pipeline stage without touching commoncrawl.org or live image
+hosts. It serves the inputs from local stand-in servers, running in this process:
+
+- **CDX index**: Answers CommonCrawlDataProcessor's ?url=<query>&output=json lookups with fixture records.
+- **WARC server**: Serves a WARC file built from fixture HTML pages and answers byte-range requests.
+- **Image host**: Serves PNG images of the given sizes after the given latency.
+
+The fixture pages link their images with absolute and relative URLs and share a logo, so CSVCleaner has URLs to
+repair and duplicates to remove.
+
+Stages run in order, each on the previous stage's output and each in a fresh process, so the peak RSS of one
+stage is not inflated by another. When a selected stage needs the output of a stage that was not selected, that
+stage runs first without being measured, unless its output is already in --workdir:
+1. **cdx**: CommonCrawlDataProcessor.process_data for every query.
+2. **html**: CommonCrawlHTMLProcessor.process_records over the CDX records.
+3. **clean**: CSVCleaner.process_csv over the extracted image rows.
+4. **bw_ratio**: BWRatioFinderAndCSVInsertor.process_csv_file over the cleaned rows.
+5. **queue**: The app.py caption queue, driven by the load_test.py workers until every entry is captioned.
+
+For every stage the report has records per second, peak RSS, latency percentiles of one unit of work
+(a query, a WARC record, an image or a queue request) and the step timers the stage recorded. It is written
+as JSON. The run fails when a stage fails (the queue stage fails when no entry was claimed), and --baseline
+compares the report with an earlier one and also fails when a stage got slower by more than --max-regression.
+
+Usage:
+    python benchmark_pipeline.py --records 400 --output benchmark.json
+    python benchmark_pipeline.py --stages html,clean --image-latency-ms 50
+    python benchmark_pipeline.py --workdir bench_run --stages cdx,html,clean
+    python benchmark_pipeline.py --workdir bench_run --stages bw_ratio  # Reuses images_updated.csv
+    python benchmark_pipeline.py --baseline benchmark.json --max-regression 0.2
+
+Dependencies:
+- requests
+- warcio
+- beautifulsoup4
+- pandas
+- pillow
+- cairosvg (bw_ratio stage)
+- flask (queue stage)
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import logging
+import os
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from urllib.parse import parse_qs, urlsplit
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_DESCRIPTION_DIR = os.path.join(BASE_DIR, "image_description")
+
+STAGES = ["cdx", "html", "clean", "bw_ratio", "queue"]
+
+# The stage whose output a stage reads, and the file that output is in
+STAGE_INPUT_FROM = {"html": "cdx", "clean": "html", "bw_ratio": "clean"}
+STAGE_OUTPUTS = {"cdx": "cdx.csv", "html": "images.csv", "clean": "images_updated.csv"}
+WARC_FILENAME = "crawl-data/CC-MAIN-BENCHMARK/segments/0/warc/benchmark-00000.warc.gz"
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body, content_type="application/octet-stream", headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+class CDXIndexHandler(StandInHandler):
+    # Set on the subclass made by start_stand_ins: search query -> list of CDX records
+    records_by_query = {}
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query).get('url', [''])[0]
+        records = self.records_by_query.get(query)
+        if not records:
+            self.reply(404, b"No Captures found for: " + query.encode())
+            return
+        body = "".join(json.dumps(record) + "\n" for record in records).encode()
+        self.reply(200, body, "text/x-ndjson")
+
+class WARCHandler(StandInHandler):
+    # Set on the subclass: WARC filename -> file contents, and the latency of one request
+    files = {}
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        content = self.files.get(urlsplit(self.path).path.lstrip('/'))
+        if content is None:
+            self.reply(404, b"Not found")
+            return
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if not match:
+            self.reply(200, content)
+            return
+        start, end = int(match.group(1)), min(int(match.group(2)), len(content) - 1)
+        self.reply(206, content[start:end + 1], headers=[("Content-Range", f"bytes {start}-{end}/{len(content)}")])
+
+class ImageHandler(StandInHandler):
+    # Set on the subclass: PNG bytes per size, and the latency of one request
+    images = []
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        match = re.match(r'/images/(\d+)\.png$', urlsplit(self.path).path)
+        if not match:
+            self.reply(404, b"Not found")
+            return
+        self.reply(200, self.images[int(match.group(1)) % len(self.images)], "image/png")
+
+def start_server(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def make_png(size, seed):
+    from PIL import Image
+    # Noise in every band, so the BW ratio has real work to do
+    bands = [Image.effect_noise((size, size), 64 + 16 * band + seed % 16) for band in range(3)]
+    buffer = io.BytesIO()
+    Image.merge("RGB", bands).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def fixture_page(image_host, query_number, page_number, images_per_page, distinct_images):
+    """Returns the article URL and HTML of a fixture page."""
+    article_url = f"{image_host}/q{query_number}/articles/{page_number}.html"
+    tags = ['<img src="/images/0.png" alt="Site logo">']
+    for slot in range(1, images_per_page):
+        image_number = 1 + (page_number * images_per_page + slot) % (distinct_images - 1)
+        # Mix the ways pages link their images: absolute, root relative and directory relative
+        src = [f"{image_host}/images/{image_number}.png", f"/images/{image_number}.png",
+               f"../../images/{image_number}.png"][slot % 3]
+        tags.append(f'<img src="{src}" alt="Image {image_number}">')
+    body = "\n".join(tags)
+    return article_url, f"<html><head><title>Article {page_number}</title></head><body>{body}</body></html>"
+
+def build_warc(image_host, args):
+    """Writes the fixture pages into one WARC file. Returns its contents and the CDX records by query."""
+    from warcio.statusandheaders import StatusAndHeaders
+    from warcio.warcwriter import WARCWriter
+
+    buffer = io.BytesIO()
+    writer = WARCWriter(buffer, gzip=True)
+    records_by_query = {}
+    for page_number in range(args.records):
+        query_number = page_number % args.queries
+        article_url, html = fixture_page(image_host, query_number, page_number, args.images_per_page,
+                                         args.distinct_images)
+        offset = buffer.tell()
+        http_headers = StatusAndHeaders("200 OK", [("Content-Type", "text/html; charset=utf-8")], protocol="HTTP/1.1")
+        writer.write_record(writer.create_warc_record(article_url, "response", payload=io.BytesIO(html.encode()),
+                                                      http_headers=http_headers))
+        records_by_query.setdefault(f"{image_host}/q{query_number}/*", []).append({
+            "urlkey": f"1,0,0,127:{urlsplit(image_host).port})/q{query_number}/articles/{page_number}.html",
+            "timestamp": "20240601000000",
+            "url": article_url,
+            "mime": "text/html",
+            "status": "200",
+            "length": str(buffer.tell() - offset),
+            "offset": str(offset),
+            "filename": WARC_FILENAME,
+        })
+    return buffer.getvalue(), records_by_query
+
+def start_stand_ins(args):
+    """Starts the three stand-in servers. Returns the servers and the stage configuration."""
+    image_handler = type("BenchmarkImageHandler", (ImageHandler,), {
+        "images": [make_png(size, seed) for seed, size in enumerate(args.image_sizes)],
+        "latency": args.image_latency_ms / 1000,
+    })
+    image_server, image_host = start_server(image_handler)
+
+    warc_content, records_by_query = build_warc(image_host, args)
+    warc_server, warc_base_url = start_server(type("BenchmarkWARCHandler", (WARCHandler,), {
+        "files": {WARC_FILENAME: warc_content},
+        "latency": args.warc_latency_ms / 1000,
+    }))
+    cdx_server, cdx_url = start_server(type("BenchmarkCDXIndexHandler", (CDXIndexHandler,), {
+        "records_by_query": records_by_query,
+    }))
+
+    config = {
+        "index_url": f"{cdx_url}/CC-MAIN-BENCHMARK-index",
+        "warc_base_url": warc_base_url,
+        "queries": list(records_by_query),
+        "tolerance": args.tolerance,
+        "queue_entries": args.queue_entries,
+        "queue_clients": args.queue_clients,
+        "queue_batch_size": args.queue_batch_size,
+    }
+    return [image_server, warc_server, cdx_server], config
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def latency_summary(latencies):
+    from load_test import percentile
+    if not latencies:
+        return None
+    return {
+        "count": len(latencies),
+        "p50": round(percentile(latencies, 0.50) * 1000, 2),
+        "p90": round(percentile(latencies, 0.90) * 1000, 2),
+        "p99": round(percentile(latencies, 0.99) * 1000, 2),
+        "max": round(max(latencies) * 1000, 2),
+    }
+
+def timed(function, latencies):
+    """Wraps a function so every call appends its duration to latencies."""
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+    return wrapper
+
+def count_rows(csv_path):
+    with open(csv_path, encoding="utf-8") as f:
+        return max(sum(1 for _ in f) - 1, 0)
+
+def run_cdx(workdir, config, latencies):
+    from CommonCrawlDataProcessor import CommonCrawlDataProcessor
+    output = os.path.join(workdir, "cdx.csv")
+    for number, search_query in enumerate(config["queries"]):
+        processor = CommonCrawlDataProcessor(search_query, output, "w" if number == 0 else "a")
+        processor.index_url = config["index_url"]
+        timed(processor.process_data, latencies)()
+    return count_rows(output)
+
+def run_html(workdir, config, latencies):
+    from CommonCrawlHTMLProcessor import CommonCrawlHTMLProcessor
+    processor = CommonCrawlHTMLProcessor(os.path.join(workdir, "cdx.csv"), os.path.join(workdir, "images.csv"))
+    processor.warc_base_url = config["warc_base_url"]
+    processor.fetch_record_images = timed(processor.fetch_record_images, latencies)
+    processor.process_records()
+    return count_rows(processor.input_csv)
+
+def run_clean(workdir, config, latencies):
+    import CSVCleaner
+    timed(CSVCleaner.process_csv, latencies)(os.path.join(workdir, "images.csv"))
+    return count_rows(os.path.join(workdir, "images.csv"))
+
+def run_bw_ratio(workdir, config, latencies):
+    import BWRatioFinderAndCSVInsertor as bw_stage
+    # process_record looks the function up at call time, so the wrapper times every image
+    bw_stage.is_black_and_white = timed(bw_stage.is_black_and_white, latencies)
+    bw_stage.process_csv_file(os.path.join(workdir, "images_updated.csv"), config["tolerance"])
+    return count_rows(os.path.join(workdir, "images_updated.csv"))
+
+def run_queue(workdir, config, latencies):
+    from collections import defaultdict
+    from load_test import create_database, run_worker, start_server as start_app_server
+    os.environ["DATABASE"] = os.path.join(workdir, "queue.db")
+    os.environ["TABLE_NAME"] = "benchmark_entries"
+    create_database(os.environ["DATABASE"], os.environ["TABLE_NAME"], config["queue_entries"])
+    from app import app
+    server, base_url = start_app_server(app)
+
+    claimed, errors, gave_up, route_latencies = [], [], [], defaultdict(list)
+
+    # An exception in a worker thread would otherwise only be printed, it counts as a stage error instead
+    def run_client():
+        try:
+            run_worker(base_url, config["queue_batch_size"], claimed, route_latencies, errors, gave_up)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+
+    workers = [threading.Thread(target=run_client) for _ in range(config["queue_clients"])]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    server.shutdown()
+    if not claimed:
+        raise RuntimeError(f"no entries were claimed ({len(errors)} errors, last: {errors[-1] if errors else None})")
+    for route_latency in route_latencies.values():
+        latencies.extend(route_latency)
+    return len(claimed), {"errors": len(errors), "gave_up": len(gave_up),
+                          "routes": {route: latency_summary(values) for route, values in route_latencies.items()}}
+
+# Imported before the clock starts, so import time is not counted as stage time
+STAGE_MODULES = {
+    "cdx": ["CommonCrawlDataProcessor"],
+    "html": ["CommonCrawlHTMLProcessor"],
+    "clean": ["CSVCleaner"],
+    "bw_ratio": ["BWRatioFinderAndCSVInsertor"],
+    "queue": ["load_test", "flask"],
+}
+
+STAGE_RUNNERS = {
+    "cdx": run_cdx,
+    "html": run_html,
+    "clean": run_clean,
+    "bw_ratio": run_bw_ratio,
+    "queue": run_queue,
+}
+
+def run_stage(name, workdir, config):
+    """Runs one stage in the current process and returns its measurements. Meant for a fresh process."""
+    sys.path[:0] = [BASE_DIR, IMAGE_DESCRIPTION_DIR]
+    # The stages log to files in the working directory and print once per record
+    os.chdir(workdir)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    latencies = []
+    try:
+        for module in STAGE_MODULES[name] + ["load_test"]:
+            importlib.import_module(module)
+    except ImportError as e:
+        return {"skipped": f"missing dependency: {e}"}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            outcome = STAGE_RUNNERS[name](workdir, config, latencies)
+            seconds = time.perf_counter() - started
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+    records, extra = outcome if isinstance(outcome, tuple) else (outcome, {})
+    return {
+        "records": records,
+        "seconds": round(seconds, 3),
+        "records_per_second": round(records / seconds, 2) if seconds else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "latency_ms": latency_summary(latencies),
+        # Step timers of instrumentation.py recorded by the stage, per timer stage ({"html": {"fetch": ...}})
+        "timers": importlib.import_module("instrumentation").timers.summary(),
+        **extra,
+    }
+
+def upstream_stages(stages, workdir):
+    """Stages that were not selected but produce an input a selected stage needs and that is not in workdir yet."""
+    needed = set()
+    for name in reversed(STAGES):
+        producer = STAGE_INPUT_FROM.get(name)
+        if (name in stages or name in needed) and producer and producer not in stages \
+                and not os.path.exists(os.path.join(workdir, STAGE_OUTPUTS[producer])):
+            needed.add(producer)
+    return needed
+
+def run_in_fresh_process(name, workdir, config):
+    # A fresh process per stage, so peak RSS and imports belong to that stage alone
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(run_stage, name, workdir, config).result()
+
+def compare_with_baseline(report, baseline_path, max_regression):
+    """Prints the change of every stage's records per second. Returns the stages that regressed."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    ignored = ("stages", "max_regression")
+    changed = [key for key, value in report["config"].items()
+               if key not in ignored and baseline.get("config", {}).get(key) != value]
+    if changed:
+        print(f"Warning: the baseline was run with different settings ({', '.join(changed)}).", file=sys.stderr)
+    regressions = []
+    for name, result in report["stages"].items():
+        before = baseline.get("stages", {}).get(name, {}).get("records_per_second")
+        now = result.get("records_per_second")
+        if not before:
+            continue
+        if now is None:
+            # A stage that was measured in the baseline and fails now counts as a regression
+            if "error" in result:
+                regressions.append(name)
+                print(f"{name:<9} {before:10.1f} -> failed ({result['error']})  REGRESSION", file=sys.stderr)
+            continue
+        change = now / before - 1
+        regressed = change < -max_regression
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<9} {before:10.1f} -> {now:10.1f} records/s ({change:+.1%}){'  REGRESSION' if regressed else ''}",
+              file=sys.stderr)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages against local stand-in servers.")
+    parser.add_argument("--stages", type=str, default=",".join(STAGES), help=f"Comma separated stages to run (default is {','.join(STAGES)}).")
+    parser.add_argument("--records", type=int, default=200, help="Fixture pages in the index and the WARC file (default is 200).")
+    parser.add_argument("--queries", type=int, default=4, help="Search queries the pages are spread over (default is 4).")
+    parser.add_argument("--images-per-page", type=int, default=10, help="Images on every fixture page (default is 10).")
+    parser.add_argument("--distinct-images", type=int, default=500, help="Distinct image URLs over all pages (default is 500).")
+    parser.add_argument("--image-sizes", type=lambda value: [int(size) for size in value.split(",")], default=[64, 256, 512],
+                        help="Comma separated side lengths of the served images (default is 64,256,512).")
+    parser.add_argument("--image-latency-ms", type=float, default=20, help="Latency of the image host (default is 20).")
+    parser.add_argument("--warc-latency-ms", type=float, default=5, help="Latency of the WARC server (default is 5).")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="BW ratio tolerance (default is 0.1).")
+    parser.add_argument("--queue-entries", type=int, default=5000, help="Pending entries in the queue stage (default is 5000).")
+    parser.add_argument("--queue-clients", type=int, default=16, help="Concurrent caption workers in the queue stage (default is 16).")
+    parser.add_argument("--queue-batch-size", type=int, default=25, help="Entries claimed per queue request (default is 25).")
+    parser.add_argument("--output", type=str, help="Write the JSON report to this file instead of stdout.")
+    parser.add_argument("--baseline", type=str, help="Earlier JSON report to compare records per second with.")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed drop in records per second against the baseline (default is 0.2).")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the directory with the stage outputs.")
+    parser.add_argument("--workdir", type=str, help="Directory for the stage outputs, kept after the run. Outputs already in it are reused as stage inputs.")
+    args = parser.parse_args()
+
+    stages = [name for name in args.stages.split(",") if name]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+    args.distinct_images = max(args.distinct_images, 2)
+
+    servers, config = start_stand_ins(args)
+    if args.workdir:
+        workdir = os.path.abspath(args.workdir)
+        os.makedirs(workdir, exist_ok=True)
+    else:
+        workdir = tempfile.mkdtemp(prefix="pipeline_benchmark_")
+    upstream = upstream_stages(stages, workdir)
+    report = {
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("output", "baseline", "keep_workdir", "workdir")},
+        "stages": {},
+    }
+    try:
+        for name in STAGES:
+            if name in upstream:
+                result = run_in_fresh_process(name, workdir, config)
+                failure = result.get("skipped") or result.get("error")
+                print(f"{name:<9} run without measuring, as input for later stages{f' ({failure})' if failure else ''}",
+                      file=sys.stderr)
+                continue
+            if name not in stages:
+                continue
+            result = run_in_fresh_process(name, workdir, config)
+            report["stages"][name] = result
+            summary = result.get("skipped") or result.get("error") or \
+                f"{result['records']} records in {result['seconds']}s, {result['records_per_second']} records/s"
+            print(f"{name:<9} {summary}", file=sys.stderr)
+    finally:
+        for server in servers:
+            server.shutdown()
+        if args.keep_workdir or args.workdir:
+            print(f"Stage outputs kept in {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    failed = [name for name, result in report["stages"].items() if "error" in result]
+    if failed:
+        print(f"Failed stages: {', '.join(failed)}", file=sys.stderr)
+    regressions = compare_with_baseline(report, args.baseline, args.max_regression) if args.baseline else []
+    if failed or regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,116 @@
+import os
+import threading
 import requests
-from transformers import AutoProcessor, AutoModelForCausalLM
 from PIL import Image
-import torch
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
 from io import BytesIO
 
+# torch, transformers and matplotlib take seconds to import. They are imported where they are first needed,
+# so tools that only use fetch_image or the task tables start right away.
+
+# Tasks needed for a full record in the image_description table: column -> (task prompt, text input)
+DESCRIBE_TASKS = {
+    'caption': ('<CAPTION>', None),
+    'detailed_caption': ('<DETAILED_CAPTION>', None),
+    'more_detailed_caption': ('<MORE_DETAILED_CAPTION>', None),
+    'objects_detected': ('<OBJECT_DETECTION>', None),
+    'logo_detection_img': ('<VQA>', "Is it a company logo?"),
+    'human_detected': ('<VQA>', "Is there a human in the image?"),
+}
+
+# Most new tokens generated per task with the 'cpu' profile. Yes/no answers and short captions stop long
+# before 1024 tokens, and object detection needs the most room for its location tokens.
+CPU_TOKEN_BUDGETS = {
+    '<VQA>': 32,
+    '<CAPTION>': 64,
+    '<DETAILED_CAPTION>': 256,
+    '<MORE_DETAILED_CAPTION>': 512,
+    '<OBJECT_DETECTION>': 1024,
+}
+
+# Inference profiles:
+# - default: beam search with a 1024 token budget for every task, the settings used so far.
+# - cpu: dynamic int8 quantization of the linear layers, greedy decoding and the budgets of CPU_TOKEN_BUDGETS.
+INFERENCE_PROFILES = {
+    'default': dict(quantize=False, num_beams=3, token_budgets={}),
+    'cpu': dict(quantize=True, num_beams=1, token_budgets=CPU_TOKEN_BUDGETS),
+}
+
 class FlorenceImageProcessor:
-    def __init__(self, model_id='HuggingFaceM4/Florence-2-DocVQA', device=None):
-        # Set device and precision for PyTorch
-        self.device = device or ("cuda:0" if torch.cuda.is_available() else "cpu")
-        self.torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
-        
-        # Initialize the model and processor
-        self.model = AutoModelForCausalLM.from_pretrained(
-            model_id, torch_dtype=self.torch_dtype, trust_remote_code=True).to(self.device)
-        self.processor = AutoProcessor.from_pretrained(model_id, trust_remote_code=True)
+    def __init__(self, model_id='HuggingFaceM4/Florence-2-DocVQA', device=None, batch_size=8,
+                 profile='default', num_threads=None, local_files_only=False):
+        """Sets up the processor. The model is loaded on first use, or by calling load_model or warm_up.
+
+        model_id is a model name on the Hugging Face Hub or the path of a local snapshot. A local snapshot,
+        or local_files_only=True, loads from disk without any network request.
+        """
+        if profile not in INFERENCE_PROFILES:
+            raise ValueError(f"Unknown inference profile '{profile}', expected one of {', '.join(INFERENCE_PROFILES)}.")
+        self.model_id = model_id
+        self.profile_name = profile
+        self.profile = INFERENCE_PROFILES[profile]
+        self.device = device  # None picks cuda:0 when available, else cpu, once the model is loaded
+        self.torch_dtype = None
+        self.num_threads = num_threads
+        self.local_files_only = local_files_only or os.path.isdir(model_id)
+        self.batch_size = batch_size  # Images sent through one generate call by the *_batch methods
+        self.generation_kwargs = dict(max_new_tokens=1024, do_sample=False, num_beams=self.profile['num_beams'])
+        if self.profile['num_beams'] > 1:
+            self.generation_kwargs['early_stopping'] = False
+
+        self._model = None
+        self._processor = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            self.load_model()
+        return self._model
+
+    @property
+    def processor(self):
+        if self._processor is None:
+            self.load_model()
+        return self._processor
+
+    def load_model(self):
+        """Loads the model and the processor. Does nothing if they are already loaded."""
+        with self._load_lock:
+            if self._model is not None:
+                return
+            import torch
+            from transformers import AutoProcessor, AutoModelForCausalLM
+
+            # Set device and precision for PyTorch
+            self.device = self.device or ("cuda:0" if torch.cuda.is_available() else "cpu")
+            self.torch_dtype = torch.float16 if self.device.startswith("cuda") else torch.float32
+            if self.profile['quantize'] and self.device != "cpu":
+                raise ValueError(f"The '{self.profile_name}' profile quantizes the model for the CPU, "
+                                 f"it cannot run on {self.device}.")
+            if self.num_threads:
+                torch.set_num_threads(self.num_threads)  # Threads used inside each matrix multiplication
+
+            # Initialize the model and processor
+            model = AutoModelForCausalLM.from_pretrained(
+                self.model_id, torch_dtype=self.torch_dtype, trust_remote_code=True,
+                local_files_only=self.local_files_only).to(self.device)
+            if self.profile['quantize']:
+                # Weights of the linear layers are stored as int8, activations are quantized on the fly
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            model.eval()
+            self._processor = AutoProcessor.from_pretrained(
+                self.model_id, trust_remote_code=True, local_files_only=self.local_files_only)
+            self._model = model
+
+    def warm_up(self, image=None):
+        """Loads the model and runs one short caption, so the first real request does not pay for the setup."""
+        self.load_model()
+        self.describe_image(image or Image.new('RGB', (64, 64), 'white'), tasks=['caption'])
+
+    def task_generation_kwargs(self, task_prompt):
+        """Returns the generate arguments for a task, with the token budget of the profile."""
+        max_new_tokens = self.profile['token_budgets'].get(task_prompt, self.generation_kwargs['max_new_tokens'])
+        return {**self.generation_kwargs, 'max_new_tokens': max_new_tokens}
 
     def run_florence(self, task_prompt, image, text_input=None):
         """General method to run the Florence model for different tasks."""
@@ -28,10 +123,7 @@ class FlorenceImageProcessor:
         generated_ids = self.model.generate(
             input_ids=inputs["input_ids"],
             pixel_values=inputs["pixel_values"],
-            max_new_tokens=1024,
-            early_stopping=False,
-            do_sample=False,
-            num_beams=3,
+            **self.task_generation_kwargs(task_prompt),
         )
         generated_text = self.processor.batch_decode(generated_ids, skip_special_tokens=False)[0]
         parsed_answer = self.processor.post_process_generation(
@@ -41,6 +133,95 @@ class FlorenceImageProcessor:
         )
         return parsed_answer
 
+    def generate_from_features(self, image_features, input_ids, attention_mask, task_prompt=None):
+        """Runs the language model on already encoded images and tokenized, possibly padded, prompts."""
+        import torch
+        text_embeds = self.model.get_input_embeddings()(input_ids)
+        # Same layout as the model's own generate: image tokens first, then the prompt tokens.
+        # Unlike it, padding in the prompts is masked out, so prompts of different lengths can share a batch.
+        image_mask = torch.ones(image_features.shape[:2], dtype=image_features.dtype, device=image_features.device)
+        inputs_embeds = torch.cat([image_features, text_embeds], dim=1)
+        attention_mask = torch.cat([image_mask, attention_mask.to(image_features.dtype)], dim=1)
+        return self.model.language_model.generate(
+            input_ids=None,
+            inputs_embeds=inputs_embeds,
+            attention_mask=attention_mask,
+            **self.task_generation_kwargs(task_prompt),
+        )
+
+    def encode_images(self, images):
+        """Preprocesses a list of images and runs the vision encoder on them once."""
+        import torch
+        pixel_values = self.processor.image_processor(images, return_tensors="pt")["pixel_values"]
+        with torch.inference_mode():
+            return self.model._encode_image(pixel_values.to(self.device, self.torch_dtype))
+
+    def run_task_on_features(self, image_features, images, task_prompt, text_inputs=None):
+        """Runs one Florence task against images that were already encoded with encode_images.
+
+        text_inputs is None, one string used for every image, or a list with one string per image.
+        """
+        import torch
+        if text_inputs is None or isinstance(text_inputs, str):
+            text_inputs = [text_inputs] * len(images)
+        prompts = [task_prompt if text is None else task_prompt + text for text in text_inputs]
+        # The processor turns task tokens such as <CAPTION> into the prompts the model was trained on
+        text = self.processor.tokenizer(self.processor._construct_prompts(prompts), return_tensors="pt",
+                                        padding=True).to(self.device)
+        with torch.inference_mode():
+            generated_ids = self.generate_from_features(image_features, text["input_ids"], text["attention_mask"],
+                                                        task_prompt)
+        generated_texts = self.processor.batch_decode(generated_ids, skip_special_tokens=False)
+        return [
+            self.processor.post_process_generation(generated_text, task=task_prompt,
+                                                   image_size=(image.width, image.height))
+            for image, generated_text in zip(images, generated_texts)
+        ]
+
+    def run_florence_batch(self, task_prompt, images, text_inputs=None, batch_size=None):
+        """Runs one Florence task on a list of images, batch_size images per generate call.
+
+        text_inputs is None, one string used for every image, or a list with one string per image.
+        Returns the parsed answers in the order of the images.
+        """
+        if text_inputs is None or isinstance(text_inputs, str):
+            text_inputs = [text_inputs] * len(images)
+        batch_size = batch_size or self.batch_size
+
+        parsed_answers = []
+        for start in range(0, len(images), batch_size):
+            batch_images = images[start:start + batch_size]
+            image_features = self.encode_images(batch_images)
+            parsed_answers.extend(self.run_task_on_features(
+                image_features, batch_images, task_prompt, text_inputs[start:start + batch_size]))
+        return parsed_answers
+
+    def describe_images(self, images, tasks=None, batch_size=None):
+        """Runs several tasks on a list of images, encoding each image only once.
+
+        tasks is a list of keys of DESCRIBE_TASKS (default all of them). Returns one dict per image,
+        keyed like the columns of the image_description table.
+        """
+        tasks = tasks or list(DESCRIBE_TASKS)
+        batch_size = batch_size or self.batch_size
+
+        descriptions = []
+        for start in range(0, len(images), batch_size):
+            batch_images = images[start:start + batch_size]
+            image_features = self.encode_images(batch_images)
+            batch_descriptions = [{} for _ in batch_images]
+            for task in tasks:
+                task_prompt, text_input = DESCRIBE_TASKS[task]
+                answers = self.run_task_on_features(image_features, batch_images, task_prompt, text_input)
+                for description, answer in zip(batch_descriptions, answers):
+                    description[task] = answer[task_prompt]
+            descriptions.extend(batch_descriptions)
+        return descriptions
+
+    def describe_image(self, image, tasks=None):
+        """Runs several tasks on one image, encoding it only once."""
+        return self.describe_images([image], tasks)[0]
+
     def run_vqa(self, image, vqa_text):
         """Method to run a Visual Question Answering (VQA) task using Florence."""
         task_prompt = "<VQA>"
@@ -75,8 +256,39 @@ class FlorenceImageProcessor:
         """Detects whether there is a human in the image."""
         return self.run_vqa(image, "Is there a human in the image?")
 
+    def run_vqa_batch(self, images, vqa_text):
+        """Runs VQA on a list of images with one question, or one question per image."""
+        return [result['<VQA>'] for result in self.run_florence_batch('<VQA>', images, vqa_text)]
+
+    def generate_caption_batch(self, images):
+        """Generates captions for a list of images."""
+        return [result['<CAPTION>'] for result in self.run_florence_batch('<CAPTION>', images)]
+
+    def generate_detailed_caption_batch(self, images):
+        """Generates detailed captions for a list of images."""
+        return [result['<DETAILED_CAPTION>'] for result in self.run_florence_batch('<DETAILED_CAPTION>', images)]
+
+    def generate_more_detailed_caption_batch(self, images):
+        """Generates more detailed captions for a list of images."""
+        return [result['<MORE_DETAILED_CAPTION>'] for result in self.run_florence_batch('<MORE_DETAILED_CAPTION>', images)]
+
+    def detect_objects_batch(self, images):
+        """Detects objects in a list of images."""
+        return [result['<OBJECT_DETECTION>'] for result in self.run_florence_batch('<OBJECT_DETECTION>', images)]
+
+    def detect_logo_batch(self, images):
+        """Detects whether there is a logo in each of the images."""
+        return self.run_vqa_batch(images, "Is it a company logo?")
+
+    def detect_human_batch(self, images):
+        """Detects whether there is a human in each of the images."""
+        return self.run_vqa_batch(images, "Is there a human in the image?")
+
     def plot_bbox(self, image, data):
         """Plots bounding boxes on the image."""
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as patches
+
         fig, ax = plt.subplots()
 
         # Display the image
@@ -1,8 +1,19 @@
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, g, jsonify, request, render_template
 import sqlite3
 from datetime import datetime, timedelta
+import csv
+import gzip
+import io
+import json
+import zlib
 from dotenv import load_dotenv
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
+import threading
+import time
+import uuid
+from csv_to_sql import create_change_tracking, create_indexes, create_search_index
+from metrics import Metrics
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,95 +23,537 @@ DATABASE = os.getenv('DATABASE')
 TABLE_NAME = os.getenv('TABLE_NAME')
 
 app = Flask(__name__)
+metrics = Metrics()
 
-# Helper function to get a database connection
-def get_db_connection():
+# Number of entries handed out per /get_entries call, unless the client asks for another batch size
+DEFAULT_BATCH_SIZE = 10
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 500))
+
+# Entries locked for longer than this are handed out again (default 3 hours)
+LEASE_TTL_SECONDS = int(os.getenv('LEASE_TTL_SECONDS', 3 * 60 * 60))
+
+# Largest request body accepted, counted after decompression for gzip bodies (default 32 MB)
+MAX_BODY_BYTES = int(os.getenv('MAX_BODY_BYTES', 32 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_BODY_BYTES
+
+# Milliseconds a request waits for the SQLite write lock before giving up
+BUSY_TIMEOUT_MS = int(os.getenv('BUSY_TIMEOUT_MS', 5000))
+
+_thread_local = threading.local()
+
+# Helper function to add the columns that older tables were created without
+def ensure_schema():
     conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row  # This allows dict-like access to the database rows
+    try:
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info({TABLE_NAME})')}
+        if columns and 'lease_token' not in columns:
+            conn.execute(f'ALTER TABLE {TABLE_NAME} ADD COLUMN lease_token TEXT')
+            conn.commit()
+        if columns and 'skip_reason' not in columns:
+            conn.execute(f'ALTER TABLE {TABLE_NAME} ADD COLUMN skip_reason TEXT')
+            # The pending index is recreated below with skipped entries left out
+            conn.execute(f'DROP INDEX IF EXISTS idx_{TABLE_NAME}_pending')
+            conn.commit()
+        if columns and 'claim_count' not in columns:
+            conn.execute(f'ALTER TABLE {TABLE_NAME} ADD COLUMN claim_count INTEGER DEFAULT 0')
+            conn.commit()
+        version_columns = {row[1] for row in conn.execute(f'PRAGMA table_info({TABLE_NAME}_version)')}
+        if version_columns and 'row_count' not in version_columns:
+            # Counters created before /metrics have no row count, and their triggers do not maintain one
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(f'ALTER TABLE {TABLE_NAME}_version ADD COLUMN row_count INTEGER NOT NULL DEFAULT 0')
+            conn.execute(f'UPDATE {TABLE_NAME}_version SET row_count = (SELECT COUNT(*) FROM {TABLE_NAME})')
+            conn.execute(f'DROP TRIGGER IF EXISTS {TABLE_NAME}_version_insert')
+            conn.execute(f'DROP TRIGGER IF EXISTS {TABLE_NAME}_version_delete')
+            create_change_tracking(conn.cursor(), TABLE_NAME)
+            conn.commit()
+        if columns:
+            create_indexes(conn.cursor(), TABLE_NAME)
+            create_search_index(conn.cursor(), TABLE_NAME)
+            create_change_tracking(conn.cursor(), TABLE_NAME)
+            conn.commit()
+    finally:
+        conn.close()
+
+if DATABASE and TABLE_NAME:
+    ensure_schema()
+
+# Helper function to get the database connection of the current thread.
+# Connections are opened once per worker thread and reused by every request that thread serves.
+def get_db_connection():
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE)
+        conn.row_factory = sqlite3.Row  # This allows dict-like access to the database rows
+        conn.execute('PRAGMA journal_mode = WAL')  # Readers no longer block the writer and vice versa
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')  # Wait for the write lock instead of failing
+        _thread_local.conn = conn
     return conn
 
-# Helper function to unlock entries that have been locked for more than 3 hours
-def unlock_old_entries(cursor):
-    three_hours_ago = datetime.now() - timedelta(hours=3)
-    cursor.execute(f'''
-        UPDATE {TABLE_NAME}
-        SET is_locked = 0, locked_at = NULL
-        WHERE is_locked = 1 AND locked_at <= ?
-    ''', (three_hours_ago,))
-    cursor.connection.commit()
+# Roll back whatever a failed request left open, so the reused connection does not keep holding locks
+@app.teardown_request
+def end_transaction(exception=None):
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+# Time every request so /metrics can report latency per route
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
 
-# Route 1: Get top 10 entries where caption is empty and not locked
+@app.after_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.increment('vanavil_requests_total', route=route, status=response.status_code)
+    if 'request_started' in g:
+        metrics.observe_latency(route, time.perf_counter() - g.request_started)
+    return response
+
+# Helper function to get the time before which a lease counts as expired
+def lease_expiry_cutoff():
+    return datetime.now() - timedelta(seconds=LEASE_TTL_SECONDS)
+
+# Route 1: Claim a batch of entries where caption is empty, not skipped by triage and not locked.
+# The batch size can be set with ?limit=N (default 10, at most MAX_BATCH_SIZE).
 @app.route('/get_entries', methods=['GET'])
 def get_entries():
+    limit = request.args.get('limit', DEFAULT_BATCH_SIZE, type=int)
+    if limit is None or limit < 1:
+        return jsonify({"error": "Invalid input, 'limit' must be a positive integer."}), 400
+    limit = min(limit, MAX_BATCH_SIZE)
+
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    # Unlock old entries
-    unlock_old_entries(cursor)
-
-    # Fetch top 10 entries where caption is empty and the entry is not locked
+    # Select and lock the entries in a single statement, so two clients can never claim the same rows.
+    # Entries whose lease expired are claimable again, so no separate unlock pass is needed.
+    # Every entry of the batch carries the same lease token, and claim_count tells workers how often it was tried.
+    lease_token = uuid.uuid4().hex
     cursor.execute(f'''
-        SELECT * FROM {TABLE_NAME} 
-        WHERE caption IS NULL AND is_locked = 0
-        LIMIT 10
-    ''')
+        UPDATE {TABLE_NAME}
+        SET is_locked = 1, locked_at = ?, lease_token = ?, claim_count = COALESCE(claim_count, 0) + 1
+        WHERE id IN (
+            SELECT id FROM {TABLE_NAME}
+            WHERE caption IS NULL AND skip_reason IS NULL AND is_locked = 0
+            UNION ALL
+            SELECT id FROM {TABLE_NAME}
+            WHERE caption IS NULL AND is_locked = 1 AND locked_at <= ?
+            LIMIT ?
+        )
+        RETURNING *
+    ''', (datetime.now(), lease_token, lease_expiry_cutoff(), limit))
 
     entries = cursor.fetchall()
+    conn.commit()
 
-    # Mark these entries as locked and set the current timestamp
-    ids = [entry['id'] for entry in entries]
-    if ids:
-        cursor.execute(f'''
-            UPDATE {TABLE_NAME}
-            SET is_locked = 1, locked_at = ?
-            WHERE id IN ({",".join("?" for _ in ids)})
-        ''', [datetime.now()] + ids)
-        conn.commit()
-
-    conn.close()
+    if entries:
+        metrics.increment('vanavil_claim_requests_total')
+        metrics.increment('vanavil_entries_claimed_total', len(entries))
 
     # Convert rows to dictionaries for JSON response
-    entries_list = [dict(entry) for entry in entries]
-    return jsonify(entries_list), 200
+    entries_list = sorted((dict(entry) for entry in entries), key=lambda entry: entry['id'])
+    response = jsonify(entries_list)
+    if entries_list:
+        response.headers['X-Lease-Token'] = lease_token
+    return response, 200
+
+# Route to extend the lease of a claimed batch while its entries are still being processed
+@app.route('/extend_lease', methods=['POST'])
+def extend_lease():
+    data = request.json
+    if not data or 'lease_token' not in data:
+        return jsonify({"error": "Invalid input, 'lease_token' required."}), 400
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    # Only entries still held under this token are extended; an expired and reclaimed batch is not
+    locked_at = datetime.now()
+    cursor.execute(f'''
+        UPDATE {TABLE_NAME}
+        SET locked_at = ?
+        WHERE lease_token = ? AND is_locked = 1 AND caption IS NULL
+    ''', (locked_at, data['lease_token']))
+    extended = cursor.rowcount
+    conn.commit()
+
+    if not extended:
+        return jsonify({"error": "Lease not found or already expired."}), 409
+    metrics.increment('vanavil_leases_extended_total')
+
+    expires_at = locked_at + timedelta(seconds=LEASE_TTL_SECONDS)
+    return jsonify({"lease_token": data['lease_token'], "extended": extended,
+                    "expires_at": expires_at.isoformat()}), 200
+
+# Route to hand back claimed entries that a worker will not process, for example when it shuts down.
+# Without 'ids' every entry still held under the token is released, otherwise only the listed ones.
+@app.route('/release_lease', methods=['POST'])
+def release_lease():
+    data = request.json
+    if not data or 'lease_token' not in data:
+        return jsonify({"error": "Invalid input, 'lease_token' required."}), 400
+    ids = data.get('ids')
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(entry_id, int) for entry_id in ids)):
+        return jsonify({"error": "Invalid input, 'ids' must be a list of integers."}), 400
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    query = f'''
+        UPDATE {TABLE_NAME}
+        SET is_locked = 0, locked_at = NULL, lease_token = NULL
+        WHERE lease_token = ? AND is_locked = 1 AND caption IS NULL
+    '''
+    if ids is None:
+        cursor.execute(query, (data['lease_token'],))
+        released = cursor.rowcount
+    else:
+        released = 0
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            cursor.execute(query + f' AND id IN ({",".join("?" for _ in batch)})', [data['lease_token']] + batch)
+            released += cursor.rowcount
+    conn.commit()
+
+    metrics.increment('vanavil_entries_released_total', released)
+    return jsonify({"lease_token": data['lease_token'], "released": released}), 200
 
-# Route 2: Update entries with provided data
+# Columns a caption worker fills in for an entry. An entry skipped by triage only carries a skip_reason.
+RESULT_COLUMNS = ['caption', 'detailed_caption', 'more_detailed_caption',
+                  'logo_detection_img', 'objects_detected', 'human_detected', 'skip_reason']
+
+# Helper function to read the posted results. Accepts a JSON object with an 'entries' list or
+# NDJSON with one entry per line, optionally gzip-compressed.
+# At most MAX_BODY_BYTES are decompressed, since a small gzip body can expand to almost any size.
+def read_posted_entries():
+    body = request.stream
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        body = gzip.GzipFile(fileobj=body, mode='rb')
+    raw = body.read(MAX_BODY_BYTES + 1)
+    if len(raw) > MAX_BODY_BYTES:
+        raise RequestEntityTooLarge(f"Request body is larger than {MAX_BODY_BYTES} bytes.")
+
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl', 'application/json-lines'):
+        entries = [json.loads(line) for line in raw.decode('utf-8').splitlines() if line.strip()]
+        return None, entries
+
+    data = json.loads(raw)
+    if not isinstance(data, dict) or 'entries' not in data:
+        raise ValueError("Invalid input, 'entries' required.")
+    return data.get('lease_token'), data['entries']
+
+# Helper function to turn one posted entry into the values of RESULT_COLUMNS.
+# Objects and lists (for example the output of detect_objects) are stored as JSON text.
+def result_values(entry):
+    values = []
+    for column in RESULT_COLUMNS:
+        value = entry.get(column)
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        elif value is not None and not isinstance(value, (str, int, float)):
+            raise ValueError(f"Unsupported value for '{column}'.")
+        values.append(value)
+    return values
+
+# Route 2: Update entries with the results of a claimed batch.
+# Every entry is checked against the lease token it was claimed with, all accepted entries are written in
+# a single transaction, and the response reports the outcome of each entry so that a worker only has to
+# resend the ones that failed. An id repeated within the batch is only applied once, the repeats are invalid.
 @app.route('/update_entries', methods=['POST'])
 def update_entries():
-    data = request.json
-    if not data or 'entries' not in data:
-        return jsonify({"error": "Invalid input, 'entries' required."}), 400
+    try:
+        body_lease_token, entries = read_posted_entries()
+    except RequestEntityTooLarge as e:
+        return jsonify({"error": e.description}), 413
+    except (ValueError, OSError, EOFError) as e:
+        return jsonify({"error": str(e) or "Invalid input."}), 400
+    if not isinstance(entries, list):
+        return jsonify({"error": "Invalid input, 'entries' must be a list."}), 400
+    default_lease_token = body_lease_token or request.headers.get('X-Lease-Token')
+
+    results = []
+    accepted = []
+    seen_ids = set()
+    for entry in entries:
+        entry_id = entry.get('id') if isinstance(entry, dict) else None
+        if not isinstance(entry_id, int):
+            results.append({"id": entry_id, "status": "invalid", "error": "Entry without an integer 'id'."})
+            continue
+        if entry_id in seen_ids:
+            results.append({"id": entry_id, "status": "invalid", "error": "Duplicate id, the entry appears earlier in the batch."})
+            continue
+        seen_ids.add(entry_id)
+        lease_token = entry.get('lease_token') or default_lease_token
+        if not lease_token:
+            results.append({"id": entry_id, "status": "invalid", "error": "No lease token given."})
+            continue
+        try:
+            accepted.append((entry_id, lease_token, result_values(entry)))
+        except ValueError as e:
+            results.append({"id": entry_id, "status": "invalid", "error": str(e)})
+            continue
+        results.append({"id": entry_id, "status": "updated"})
 
     conn = get_db_connection()
     cursor = conn.cursor()
 
     try:
-        # Iterate over the provided entries and update them in the database
-        for entry in data['entries']:
+        # Take the write lock up front so no lease can change between the check and the update
+        cursor.execute('BEGIN IMMEDIATE')
+
+        current_leases = {}
+        accepted_ids = [entry_id for entry_id, _, _ in accepted]
+        for start in range(0, len(accepted_ids), 500):
+            batch = accepted_ids[start:start + 500]
             cursor.execute(f'''
-                UPDATE {TABLE_NAME}
-                SET caption = ?, detailed_caption = ?, more_detailed_caption = ?, 
-                    logo_detection_img = ?, objects_detected = ?, human_detected = ?, 
-                    is_locked = 0, locked_at = NULL
-                WHERE id = ?
-            ''', (
-                entry.get('caption'),
-                entry.get('detailed_caption'),
-                entry.get('more_detailed_caption'),
-                entry.get('logo_detection_img'),
-                entry.get('objects_detected'),
-                entry.get('human_detected'),
-                entry.get('id')
-            ))
-        
+                SELECT id, lease_token FROM {TABLE_NAME}
+                WHERE is_locked = 1 AND id IN ({",".join("?" for _ in batch)})
+            ''', batch)
+            current_leases.update((row['id'], row['lease_token']) for row in cursor.fetchall())
+
+        rejected = {}
+        for entry_id, lease_token, _ in accepted:
+            if entry_id not in current_leases:
+                rejected[entry_id] = ('not_claimed', "Entry is not locked, it was never claimed or is already updated.")
+            elif current_leases[entry_id] != lease_token:
+                rejected[entry_id] = ('lease_mismatch', "Lease token does not match, the entry was claimed again.")
+
+        cursor.executemany(f'''
+            UPDATE {TABLE_NAME}
+            SET {", ".join(f"{column} = ?" for column in RESULT_COLUMNS)},
+                is_locked = 0, locked_at = NULL, lease_token = NULL
+            WHERE id = ?
+        ''', [values + [entry_id] for entry_id, _, values in accepted if entry_id not in rejected])
         conn.commit()
-        return jsonify({"message": "Entries updated successfully"}), 200
 
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
-    finally:
+
+    for result in results:
+        if result['status'] == 'updated' and result['id'] in rejected:
+            result['status'], result['error'] = rejected[result['id']]
+
+    updated = sum(1 for result in results if result['status'] == 'updated')
+    metrics.increment('vanavil_entries_updated_total', updated)
+    for result in results:
+        if result['status'] != 'updated':
+            metrics.increment('vanavil_entries_rejected_total', reason=result['status'])
+    for entry_id, _, values in accepted:
+        skip_reason = values[RESULT_COLUMNS.index('skip_reason')]
+        if skip_reason and entry_id not in rejected:
+            metrics.increment('vanavil_entries_triaged_total', reason=skip_reason)
+    return jsonify({"updated": updated, "failed": len(results) - updated, "results": results}), 200
+
+# Columns returned by the public image API, the lease bookkeeping stays internal
+IMAGE_COLUMNS = ['id', 'url_key', 'article_title', 'image_url', 'image_alt', 'article_url', 'bw_ratio',
+                 'caption', 'detailed_caption', 'more_detailed_caption', 'logo_detection_img',
+                 'objects_detected', 'human_detected']
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Helper function to turn free text into an FTS5 query: every word must match, the last one as a prefix
+def fts_query(text):
+    words = [word.replace('"', '""') for word in text.split()]
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+
+# Route to page through images, optionally filtered by a text search and a bw_ratio range.
+# Pages are keyset-paginated on id: pass the returned next_cursor as ?after= to get the next page.
+@app.route('/api/images', methods=['GET'])
+def api_images():
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    after = request.args.get('after', 0, type=int)
+    min_bw = request.args.get('min_bw', type=float)
+    max_bw = request.args.get('max_bw', type=float)
+    if limit is None or limit < 1:
+        return jsonify({"error": "Invalid input, 'limit' must be a positive integer."}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    conditions = ['t.id > ?']
+    params = [after]
+    source = f'{TABLE_NAME} t'
+    order_by = 't.id'
+
+    search = fts_query(request.args.get('q', ''))
+    if search:
+        # Let the search index walk its matches in rowid order, so no sort is needed
+        source = f'{TABLE_NAME}_fts f JOIN {TABLE_NAME} t ON t.id = f.rowid'
+        conditions = ['f.rowid > ?', f'{TABLE_NAME}_fts MATCH ?']
+        params.append(search)
+        order_by = 'f.rowid'
+    if min_bw is not None:
+        conditions.append('t.bw_ratio >= ?')
+        params.append(min_bw)
+    if max_bw is not None:
+        conditions.append('t.bw_ratio <= ?')
+        params.append(max_bw)
+    if request.args.get('captioned') == '1':
+        conditions.append('t.caption IS NOT NULL')
+
+    cursor = get_db_connection().cursor()
+    # Fetch one extra row to know whether another page follows
+    cursor.execute(f'''
+        SELECT {", ".join(f"t.{column}" for column in IMAGE_COLUMNS)}
+        FROM {source}
+        WHERE {" AND ".join(conditions)}
+        ORDER BY {order_by}
+        LIMIT ?
+    ''', params + [limit + 1])
+    rows = cursor.fetchall()
+
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = items[-1]['id'] if len(rows) > limit else None
+    response = jsonify({"items": items, "next_cursor": next_cursor})
+    response.headers['Access-Control-Allow-Origin'] = '*'  # The viewer is served from another origin
+    return response, 200
+
+# Most frequent titles returned by /api/titles, enough for a word cloud
+MAX_TITLES = 1000
+
+# Route to count the images per article title, over every image matching ?q= instead of one page.
+# The viewer builds its word cloud from these counts.
+@app.route('/api/titles', methods=['GET'])
+def api_titles():
+    source = f'{TABLE_NAME} t'
+    where = ''
+    params = []
+    search = fts_query(request.args.get('q', ''))
+    if search:
+        source = f'{TABLE_NAME}_fts f JOIN {TABLE_NAME} t ON t.id = f.rowid'
+        where = f'WHERE {TABLE_NAME}_fts MATCH ?'
+        params.append(search)
+
+    cursor = get_db_connection().cursor()
+    cursor.execute(f'''
+        SELECT t.article_title, COUNT(*) AS count
+        FROM {source}
+        {where}
+        GROUP BY t.article_title
+        ORDER BY count DESC
+        LIMIT ?
+    ''', params + [MAX_TITLES])
+    response = jsonify({"titles": [dict(row) for row in cursor.fetchall()]})
+    response.headers['Access-Control-Allow-Origin'] = '*'  # The viewer is served from another origin
+    return response, 200
+
+EXPORT_BATCH_SIZE = 1000
+
+# Helper function to encode export rows as CSV or NDJSON text, one batch of rows at a time
+def export_lines(cursor, export_format):
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(IMAGE_COLUMNS)
+        yield buffer.getvalue()
+    while True:
+        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+        if not rows:
+            break
+        if export_format == 'csv':
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(tuple(row) for row in rows)
+            yield buffer.getvalue()
+        else:
+            yield "".join(json.dumps(dict(row)) + "\n" for row in rows)
+
+# Helper function to gzip a stream of text chunks on the fly
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+# Route to stream the whole table as CSV or NDJSON, optionally gzip-compressed and limited to captioned rows.
+# The ETag comes from the table's change counter, so an unchanged table answers 304 without being read.
+@app.route('/export', methods=['GET'])
+def export():
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "Invalid input, 'format' must be csv or ndjson."}), 400
+    captioned_only = request.args.get('captioned') == '1'
+    use_gzip = request.args.get('gzip') == '1' or request.accept_encodings['gzip'] > 0
+
+    # A dedicated connection and read transaction, so the rows streamed match the ETag sent up front.
+    # It is closed when the response is closed, whether or not the body was ever streamed.
+    conn = sqlite3.connect(DATABASE, check_same_thread=False)
+    try:
+        conn.row_factory = sqlite3.Row
+        conn.execute('BEGIN')
+        version = conn.execute(f'SELECT generation, seq FROM {TABLE_NAME}_version WHERE id = 1').fetchone()
+        if version is None:
+            conn.close()
+            return jsonify({"error": "Change tracking is not set up for this table."}), 500
+        generation, seq = version
+        etag = f'{generation}-{seq}-{export_format}-{int(captioned_only)}{"-gz" if use_gzip else ""}'
+
+        if etag in request.if_none_match:
+            conn.close()
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+
+        cursor = conn.execute(f'''
+            SELECT {", ".join(IMAGE_COLUMNS)} FROM {TABLE_NAME}
+            {"WHERE caption IS NOT NULL" if captioned_only else ""}
+            ORDER BY id
+        ''')
+    except Exception:
         conn.close()
-        
+        raise
+
+    chunks = export_lines(cursor, export_format)
+    if use_gzip:
+        chunks = gzip_chunks(chunks)
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = app.response_class(chunks, mimetype=mimetype)
+    response.call_on_close(conn.close)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'  # Clients and proxies may keep it, but must revalidate
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Content-Disposition'] = f'attachment; filename={TABLE_NAME}.{export_format}'
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# Route exposing queue depth and request metrics in the Prometheus text format.
+# The queue counts come from the partial indexes and the change counter, never from a table scan.
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    cursor = get_db_connection().cursor()
+    pending = cursor.execute(
+        f'SELECT COUNT(*) FROM {TABLE_NAME} WHERE caption IS NULL AND skip_reason IS NULL AND is_locked = 0').fetchone()[0]
+    skipped = cursor.execute(
+        f'SELECT COUNT(*) FROM {TABLE_NAME} WHERE caption IS NULL AND skip_reason IS NOT NULL AND is_locked = 0').fetchone()[0]
+    locked, oldest_lock = cursor.execute(
+        f'SELECT COUNT(*), MIN(locked_at) FROM {TABLE_NAME} WHERE is_locked = 1').fetchone()
+    expired = cursor.execute(
+        f'SELECT COUNT(*) FROM {TABLE_NAME} WHERE is_locked = 1 AND locked_at <= ?',
+        (lease_expiry_cutoff(),)).fetchone()[0]
+    total = cursor.execute(f'SELECT row_count FROM {TABLE_NAME}_version WHERE id = 1').fetchone()[0]
+
+    oldest_lease_age = 0.0
+    if oldest_lock:
+        oldest_lease_age = max((datetime.now() - datetime.fromisoformat(str(oldest_lock))).total_seconds(), 0.0)
+
+    queue_help = "Entries in the caption queue by state."
+    gauges = [
+        ('vanavil_queue_entries', queue_help, {'state': 'pending'}, pending),
+        ('vanavil_queue_entries', queue_help, {'state': 'locked'}, locked),
+        ('vanavil_queue_entries', queue_help, {'state': 'skipped'}, skipped),
+        ('vanavil_queue_entries', queue_help, {'state': 'completed'}, total - pending - locked - skipped),
+        ('vanavil_leases_expired', "Locked entries whose lease is older than the TTL.", {}, expired),
+        ('vanavil_oldest_lease_age_seconds', "Age of the oldest active lease.", {}, f"{oldest_lease_age:.3f}"),
+        ('vanavil_lease_ttl_seconds', "Configured lease TTL.", {}, LEASE_TTL_SECONDS),
+    ]
+    return app.response_class(metrics.render(gauges), mimetype='text/plain; version=0.0.4'), 200
+
 # Route to render entry details in an HTML view
 @app.route('/view/<int:entry_id>', methods=['GET'])
 def view_entry(entry_id):
@@ -114,8 +567,6 @@ def view_entry(entry_id):
     if not entry:
         return f"Entry with ID {entry_id} not found.", 404
 
-    conn.close()
-
     # Pass the entry to the HTML template and render it
     return render_template('view_entry.html', entry=entry)
 
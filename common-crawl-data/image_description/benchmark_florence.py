@@ -0,0 +1,201 @@
+"""
+Benchmarks for FlorenceImageProcessor.
+
+Modes:
+- batch: images per second of generate_caption called once per image, against generate_caption_batch
+  with each of the given batch sizes. Also reports whether the batched captions match the single ones.
+- tasks: seconds per image for the six tasks of a full record run one by one (six vision encoder passes),
+  against describe_image (one pass), and how many of the task outputs agree.
+- profiles: seconds per image of describe_images with the default inference profile and with the 'cpu'
+  profile (int8 linear layers, greedy decoding, per-task token budgets), and per task how many of the
+  'cpu' outputs are identical to the default ones. The two models are loaded one after the other.
+- startup: seconds to import FlorenceImageProcessor in a fresh interpreter, to construct it, to load
+  the model and to warm it up, and the time of the first caption after the warm-up.
+
+By default the images are synthetic (deterministic gradients with a few shapes), so the benchmark runs
+without network access to image hosts. Pass --image-url (repeatable) to benchmark real images instead.
+
+Usage:
+    python benchmark_florence.py batch --images 16 --batch-sizes 1,4,8 --device cpu
+    python benchmark_florence.py tasks --images 4
+    python benchmark_florence.py profiles --images 8 --threads 8
+    python benchmark_florence.py startup --model-id /models/Florence-2-DocVQA
+
+Dependencies:
+- torch
+- transformers
+- pillow
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+from FlorenceImageProcessor import DESCRIBE_TASKS, FlorenceImageProcessor, INFERENCE_PROFILES
+
+def synthetic_images(count, size=(384, 384)):
+    images = []
+    for index in range(count):
+        image = Image.linear_gradient('L').resize(size).convert('RGB')
+        draw = ImageDraw.Draw(image)
+        offset = (index * 37) % (size[0] // 2)
+        draw.rectangle([offset, offset, offset + size[0] // 3, offset + size[1] // 4], fill=(200, 30, 30))
+        draw.ellipse([size[0] // 2, offset, size[0] // 2 + size[0] // 4, offset + size[1] // 4], fill=(30, 30, 200))
+        images.append(image)
+    return images
+
+def load_images(args, processor):
+    if not args.image_url:
+        return synthetic_images(args.images)
+    images = [processor.fetch_image(url) for url in args.image_url]
+    return [image for image in images if image is not None]
+
+def run_batch_benchmark(args, processor, images):
+    results = {"mode": "batch", "device": processor.device, "images": len(images)}
+
+    started = time.perf_counter()
+    single_captions = [processor.generate_caption(image) for image in images]
+    elapsed = time.perf_counter() - started
+    results["single"] = {"seconds": round(elapsed, 3), "images_per_second": round(len(images) / elapsed, 3)}
+
+    for batch_size in args.batch_sizes:
+        started = time.perf_counter()
+        batch_captions = processor.run_florence_batch('<CAPTION>', images, batch_size=batch_size)
+        elapsed = time.perf_counter() - started
+        matching = sum(1 for single, batched in zip(single_captions, batch_captions)
+                       if single == batched['<CAPTION>'])
+        results[f"batch_{batch_size}"] = {
+            "seconds": round(elapsed, 3),
+            "images_per_second": round(len(images) / elapsed, 3),
+            "matching_outputs": f"{matching}/{len(images)}",
+        }
+    return results
+
+def describe_separately(processor, image):
+    # The six tasks as they were run before describe_image existed
+    return {
+        'caption': processor.generate_caption(image),
+        'detailed_caption': processor.generate_detailed_caption(image),
+        'more_detailed_caption': processor.generate_more_detailed_caption(image),
+        'objects_detected': processor.detect_objects(image),
+        'logo_detection_img': processor.detect_logo(image),
+        'human_detected': processor.detect_human(image),
+    }
+
+def run_tasks_benchmark(args, processor, images):
+    results = {"mode": "tasks", "device": processor.device, "images": len(images)}
+
+    started = time.perf_counter()
+    separate = [describe_separately(processor, image) for image in images]
+    elapsed = time.perf_counter() - started
+    results["separate_tasks"] = {"seconds_per_image": round(elapsed / len(images), 3)}
+
+    started = time.perf_counter()
+    shared = [processor.describe_image(image) for image in images]
+    elapsed = time.perf_counter() - started
+    matching = sum(1 for before, after in zip(separate, shared) for task in DESCRIBE_TASKS if before[task] == after[task])
+    results["describe_image"] = {
+        "seconds_per_image": round(elapsed / len(images), 3),
+        "matching_outputs": f"{matching}/{len(images) * len(DESCRIBE_TASKS)}",
+    }
+    return results
+
+def load_profile(args, profile):
+    started = time.perf_counter()
+    processor = FlorenceImageProcessor(model_id=args.model_id, device=args.device, profile=profile,
+                                       num_threads=args.threads, local_files_only=args.local_files_only)
+    processor.load_model()
+    return processor, {"load_seconds": round(time.perf_counter() - started, 3)}
+
+def time_describe(processor, images, results):
+    started = time.perf_counter()
+    descriptions = processor.describe_images(images)
+    results["seconds_per_image"] = round((time.perf_counter() - started) / len(images), 3)
+    return descriptions
+
+def run_profiles_benchmark(args):
+    results = {"mode": "profiles", "device": args.device, "threads": args.threads}
+
+    processor, results["default"] = load_profile(args, "default")
+    images = load_images(args, processor)
+    results["images"] = len(images)
+    baseline = time_describe(processor, images, results["default"])
+    del processor  # Only one of the two models is kept in memory
+
+    processor, results["cpu"] = load_profile(args, "cpu")
+    descriptions = time_describe(processor, images, results["cpu"])
+    results["cpu"]["speedup"] = round(results["default"]["seconds_per_image"] / results["cpu"]["seconds_per_image"], 2)
+    results["cpu"]["matching_outputs"] = {
+        task: f"{sum(1 for before, after in zip(baseline, descriptions) if before[task] == after[task])}/{len(images)}"
+        for task in DESCRIBE_TASKS
+    }
+    return results
+
+def measure_import_seconds():
+    # A fresh interpreter, so modules imported by this script do not make the import look faster
+    code = ("import time; started = time.perf_counter(); import FlorenceImageProcessor; "
+            "print(time.perf_counter() - started)")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=sys.path[0] or None).stdout
+    return float(output.strip().splitlines()[-1])
+
+def run_startup_benchmark(args):
+    results = {"mode": "startup", "device": args.device, "import_seconds": round(measure_import_seconds(), 3)}
+
+    started = time.perf_counter()
+    processor = FlorenceImageProcessor(model_id=args.model_id, device=args.device, profile=args.profile,
+                                       num_threads=args.threads, local_files_only=args.local_files_only)
+    results["construct_seconds"] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    processor.load_model()
+    results["load_model_seconds"] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    processor.warm_up()
+    results["warm_up_seconds"] = round(time.perf_counter() - started, 3)
+
+    image = synthetic_images(1)[0]
+    started = time.perf_counter()
+    processor.generate_caption(image)
+    results["first_caption_seconds"] = round(time.perf_counter() - started, 3)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FlorenceImageProcessor.")
+    parser.add_argument("mode", choices=["batch", "tasks", "profiles", "startup"], help="Benchmark to run.")
+    parser.add_argument("--model-id", type=str, default='HuggingFaceM4/Florence-2-DocVQA', help="Model to load.")
+    parser.add_argument("--device", type=str, default="cpu", help="Device to run on (default is cpu).")
+    parser.add_argument("--images", type=int, default=16, help="Number of synthetic images (default is 16).")
+    parser.add_argument("--image-url", type=str, action="append", help="Benchmark this image instead of synthetic ones.")
+    parser.add_argument("--batch-sizes", type=lambda value: [int(size) for size in value.split(",")], default=[1, 4, 8],
+                        help="Comma-separated batch sizes for the batch mode (default is 1,4,8).")
+    parser.add_argument("--profile", type=str, default="default", choices=list(INFERENCE_PROFILES),
+                        help="Inference profile for the batch, tasks and startup modes (default is default).")
+    parser.add_argument("--threads", type=int, help="Torch threads (default is the torch default).")
+    parser.add_argument("--local-files-only", action="store_true", help="Load the model from the local cache without network checks.")
+    args = parser.parse_args()
+
+    if args.mode == "profiles":
+        print(json.dumps(run_profiles_benchmark(args), indent=2))
+        return
+    if args.mode == "startup":
+        print(json.dumps(run_startup_benchmark(args), indent=2))
+        return
+
+    processor = FlorenceImageProcessor(model_id=args.model_id, device=args.device, profile=args.profile,
+                                       num_threads=args.threads, local_files_only=args.local_files_only)
+    processor.warm_up()  # Keep the model load out of the timings
+    images = load_images(args, processor)
+    if args.mode == "batch":
+        results = run_batch_benchmark(args, processor, images)
+    else:
+        results = run_tasks_benchmark(args, processor, images)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+"""
+Caption worker for the queue served by app.py.
+
+The worker claims a batch of entries from /get_entries, downloads their images and describes them with
+FlorenceImageProcessor.describe_images. It then posts the results for the whole batch to /update_entries
+under the batch's lease token.
+
+The work is pipelined so the model does not sit idle while images download:
+- While one batch is in inference, the next batch is claimed and its images are downloaded concurrently
+  in background threads.
+- Results are posted from a background thread while the next batch is already in inference.
+
+Before inference every entry goes through triage.py. Tracking pixels, spacers, blank images and the
+like are posted without inference and with a skip_reason. Icons and logos get a reduced task set. An
+image whose bytes were already described, such as a site logo on every page, gets a copy of the earlier
+description with skip_reason 'duplicate_image'. --no-triage describes every image in full.
+
+Entries whose image cannot be downloaded or decoded are not posted. Their lease expires after
+LEASE_TTL_SECONDS and they are handed out again later. Once an entry has been claimed --max-fetch-attempts
+times, a failed download is posted with skip_reason 'fetch_failed' instead, so it leaves the queue.
+
+Results that still cannot be posted after a few attempts (connection errors, error statuses or answers that
+are not JSON) are logged and their entries released through /release_lease.
+
+When claiming a batch fails, for example while app.py restarts, the worker waits and tries again with
+a growing delay, up to --poll-interval.
+
+On Ctrl+C or SIGTERM the worker finishes and posts the batch in inference, releases the batch it
+prefetched through /release_lease and exits. A second signal stops right away and releases the
+current batch as well.
+
+Pass --stub-model to run the whole loop without torch or the Florence model. It is meant for trying the
+worker end to end against a local app.py.
+
+Usage:
+    python caption_worker.py --server http://127.0.0.1:5003 --batch-size 8 --download-workers 16
+    python caption_worker.py --server http://127.0.0.1:5003 --inference-profile cpu --threads 8
+    python caption_worker.py --server http://127.0.0.1:5003 --stub-model --exit-when-empty
+
+Dependencies:
+- requests
+- pillow
+- torch and transformers (not needed with --stub-model)
+"""
+
+import argparse
+import signal
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+from triage import FULL_DECISION, SKIP, Decision, content_hash, triage_entry, triage_image
+
+# Columns filled in for every entry, in the order of FlorenceImageProcessor.DESCRIBE_TASKS
+RESULT_COLUMNS = ['caption', 'detailed_caption', 'more_detailed_caption',
+                  'objects_detected', 'logo_detection_img', 'human_detected']
+
+# Descriptions kept by image hash, so repeated images are described once per worker
+DESCRIPTION_CACHE_SIZE = 10000
+
+# Seconds to wait after the first failed claim, doubled after every further failure
+CLAIM_RETRY_DELAY = 1.0
+
+class StubImageProcessor:
+    """Stands in for FlorenceImageProcessor with fixed answers derived from the image size."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay  # Seconds of simulated inference per image
+
+    def warm_up(self):
+        pass
+
+    def describe_images(self, images, tasks=None):
+        descriptions = []
+        for image in images:
+            time.sleep(self.delay)
+            size = f"{image.width}x{image.height}"
+            description = {
+                'caption': f"A {size} image.",
+                'detailed_caption': f"A {size} image in {image.mode} mode.",
+                'more_detailed_caption': f"A {size} image in {image.mode} mode, described by the stub model.",
+                'objects_detected': {'bboxes': [], 'labels': []},
+                'logo_detection_img': "No",
+                'human_detected': "No",
+            }
+            descriptions.append({task: description[task] for task in tasks or RESULT_COLUMNS})
+        return descriptions
+
+class ClaimedBatch:
+    def __init__(self, lease_token, entries):
+        self.lease_token = lease_token
+        self.entries = entries
+        self.prepared = []  # (image, image hash, triage decision) per entry, see prepare_entry
+        self.download_seconds = 0.0
+
+class CaptionWorker:
+    def __init__(self, server_url, processor, batch_size=8, download_workers=8, tasks=None,
+                 timeout=30, poll_interval=30, exit_when_empty=False, triage=True, max_fetch_attempts=3):
+        self.server_url = server_url.rstrip("/")
+        self.processor = processor
+        self.batch_size = batch_size
+        self.download_workers = download_workers
+        self.tasks = tasks
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.exit_when_empty = exit_when_empty
+        self.triage = triage
+        self.max_fetch_attempts = max_fetch_attempts
+        self.stop_event = threading.Event()
+        self.description_cache = OrderedDict()
+        self.described = 0
+        self.skipped = 0
+        self.duplicates = 0
+        self.without_image = 0
+        self.fetch_failed = 0
+        self.updated = 0
+        self.failed = 0
+        self._local = threading.local()
+        self._counts_lock = threading.Lock()
+
+    def get_session(self):
+        # One pooled session per thread, requests.Session is not thread safe
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.download_workers, pool_maxsize=self.download_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+        return session
+
+    def claim_batch(self):
+        """Claims up to batch_size entries. Returns a ClaimedBatch, without entries when the queue is empty."""
+        response = self.get_session().get(f"{self.server_url}/get_entries", params={"limit": self.batch_size},
+                                          timeout=self.timeout)
+        response.raise_for_status()
+        entries = response.json()
+        lease_token = response.headers.get("X-Lease-Token") or (entries[0]["lease_token"] if entries else None)
+        return ClaimedBatch(lease_token, entries)
+
+    def fetch_image(self, url):
+        """Downloads and decodes one image. Returns (image, raw bytes), or None if that fails."""
+        try:
+            response = self.get_session().get(url, timeout=self.timeout)
+            response.raise_for_status()
+            image = Image.open(BytesIO(response.content))
+            image.load()  # Decode here in the download thread, not later in the inference loop
+            return (image if image.mode == 'RGB' else image.convert('RGB')), response.content
+        except Exception as e:
+            print(f"Error fetching or processing image from URL {url}: {e}")
+            return None
+
+    def prepare_entry(self, entry):
+        """Triages one entry and downloads its image when it is needed. Returns (image, image hash, decision).
+
+        The decision is None when the image could not be fetched and the entry may be tried again later.
+        """
+        decision = triage_entry(entry) if self.triage else None
+        if decision is not None:
+            return None, None, decision
+        fetched = self.fetch_image(entry['image_url'])
+        if fetched is None:
+            if (entry.get('claim_count') or 0) >= self.max_fetch_attempts:
+                return None, None, Decision(SKIP, [], 'fetch_failed')
+            return None, None, None
+        image, content = fetched
+        decision = triage_image(entry, image, len(content)) if self.triage else FULL_DECISION
+        return image, content_hash(content), decision
+
+    def prefetch_batch(self, downloads):
+        """Claims the next batch and prepares its entries with the download pool."""
+        batch = self.claim_batch()
+        started = time.perf_counter()
+        batch.prepared = list(downloads.map(self.prepare_entry, batch.entries))
+        batch.download_seconds = time.perf_counter() - started
+        return batch
+
+    def remember(self, key, description):
+        self.description_cache[key] = description
+        self.description_cache.move_to_end(key)
+        if len(self.description_cache) > DESCRIPTION_CACHE_SIZE:
+            self.description_cache.popitem(last=False)
+
+    def describe(self, batch):
+        """Runs the model on the images of a batch that need it. Returns the result entries to post."""
+        results = []
+        waiting = {}  # (image hash, tasks) -> entries that get this description
+        groups = defaultdict(list)  # tasks -> (key, image) to describe with these tasks
+        for entry, (image, image_hash, decision) in zip(batch.entries, batch.prepared):
+            if decision is None:
+                self.without_image += 1
+                continue
+            if decision.route == SKIP:
+                results.append({"id": entry["id"], "skip_reason": decision.reason})
+                if decision.reason == 'fetch_failed':
+                    self.fetch_failed += 1
+                else:
+                    self.skipped += 1
+                continue
+
+            tasks = tuple(decision.tasks or self.tasks or RESULT_COLUMNS)
+            if decision.tasks and self.tasks:
+                # A reduced task set never adds tasks this worker was not asked to run
+                tasks = tuple(task for task in tasks if task in self.tasks)
+                if not tasks:
+                    results.append({"id": entry["id"], "skip_reason": decision.reason})
+                    self.skipped += 1
+                    continue
+            key = (image_hash, tasks)
+            if key in self.description_cache:
+                results.append({"id": entry["id"], **self.description_cache[key], "skip_reason": "duplicate_image"})
+                self.duplicates += 1
+            elif key in waiting:
+                waiting[key].append((entry, decision))
+            else:
+                waiting[key] = [(entry, decision)]
+                groups[tasks].append((key, image))
+
+        for tasks, items in groups.items():
+            descriptions = self.processor.describe_images([image for _, image in items], tasks=list(tasks))
+            for (key, _), description in zip(items, descriptions):
+                self.remember(key, description)
+                (entry, decision), *duplicates = waiting[key]
+                results.append({"id": entry["id"], **description, "skip_reason": decision.reason})
+                results.extend({"id": duplicate["id"], **description, "skip_reason": "duplicate_image"}
+                               for duplicate, _ in duplicates)
+                self.described += 1
+                self.duplicates += len(duplicates)
+        return results
+
+    def post_results(self, lease_token, results, attempts=3):
+        """Posts the results of one batch, retrying on connection errors, error statuses and answers that are
+        not JSON. When every attempt fails, the entries are released so another worker can describe them."""
+        for attempt in range(attempts):
+            try:
+                response = self.get_session().post(f"{self.server_url}/update_entries",
+                                                   json={"lease_token": lease_token, "entries": results},
+                                                   timeout=self.timeout)
+                response.raise_for_status()
+                # A proxy in front of app.py may answer with an HTML page, .json() raises ValueError then
+                outcome = response.json()
+                if not isinstance(outcome, dict) or "results" not in outcome:
+                    raise ValueError(f"unexpected answer {response.text[:200]!r}")
+                break
+            except (requests.RequestException, ValueError) as e:
+                print(f"Error posting {len(results)} results (attempt {attempt + 1} of {attempts}): {e}")
+                if attempt == attempts - 1:
+                    with self._counts_lock:
+                        self.failed += len(results)
+                    self.release(ClaimedBatch(lease_token, results), ids=[result["id"] for result in results])
+                    return
+                time.sleep(2 ** attempt)
+
+        for result in outcome["results"]:
+            if result["status"] != "updated":
+                print(f"Entry {result['id']} was not updated: {result['status']} ({result.get('error')})")
+        with self._counts_lock:
+            self.updated += outcome["updated"]
+            self.failed += outcome["failed"]
+
+    def release(self, batch, ids=None):
+        """Hands the entries of a batch that was not processed back to the queue, or only the given ids."""
+        if not batch or not batch.entries:
+            return
+        payload = {"lease_token": batch.lease_token}
+        if ids is not None:
+            payload["ids"] = ids
+        try:
+            response = self.get_session().post(f"{self.server_url}/release_lease", json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            print(f"Released {response.json()['released']} unprocessed entries.")
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error releasing lease {batch.lease_token}, its entries are handed out again once it expires: {e}")
+
+    def report_post_error(self, future):
+        # An exception in the poster thread would otherwise stay in its future unseen
+        if future.exception() is not None:
+            print(f"Posting a batch failed: {future.exception()!r}")
+
+    def handle_signal(self, signum, frame):
+        if self.stop_event.is_set():
+            raise KeyboardInterrupt
+        print("Stopping after the current batch, press Ctrl+C again to stop right away.")
+        self.stop_event.set()
+
+    def run(self):
+        # Load the model before claiming anything, so no lease waits on the model download
+        started = time.perf_counter()
+        self.processor.warm_up()
+        print(f"Model ready in {time.perf_counter() - started:.1f}s.")
+
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=self.download_workers, thread_name_prefix="download") as downloads, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch") as prefetcher, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix="post") as poster:
+            next_batch = prefetcher.submit(self.prefetch_batch, downloads)
+            batch = None
+            claim_failures = 0
+            try:
+                while next_batch is not None:
+                    try:
+                        batch = next_batch.result()
+                    except (requests.RequestException, ValueError) as e:
+                        # The server is down or answered garbage, nothing was claimed
+                        next_batch = None
+                        claim_failures += 1
+                        delay = min(CLAIM_RETRY_DELAY * 2 ** (claim_failures - 1), self.poll_interval)
+                        print(f"Error claiming a batch ({e}), retrying in {delay:.0f}s.")
+                        if self.stop_event.wait(delay):
+                            break
+                        next_batch = prefetcher.submit(self.prefetch_batch, downloads)
+                        continue
+                    claim_failures = 0
+                    next_batch = None
+
+                    if not batch.entries:
+                        batch = None
+                        if self.exit_when_empty or self.stop_event.wait(self.poll_interval):
+                            break
+                        next_batch = prefetcher.submit(self.prefetch_batch, downloads)
+                        continue
+
+                    # Claim and download the next batch while this one is in inference
+                    if not self.stop_event.is_set():
+                        next_batch = prefetcher.submit(self.prefetch_batch, downloads)
+
+                    inference_started = time.perf_counter()
+                    results = self.describe(batch)
+                    inference_seconds = time.perf_counter() - inference_started
+                    if results:
+                        posted = poster.submit(self.post_results, batch.lease_token, results)
+                        posted.add_done_callback(self.report_post_error)
+
+                    print(f"Batch of {len(batch.entries)} entries: {len(results)} posted, "
+                          f"{len(batch.entries) - len(results)} without image, "
+                          f"download {batch.download_seconds:.2f}s, inference {inference_seconds:.2f}s")
+                    batch = None
+                    if self.stop_event.is_set():
+                        break
+            finally:
+                # Whatever was claimed but not described goes back to the queue
+                self.release(batch)
+                if next_batch is not None:
+                    try:
+                        self.release(next_batch.result())
+                    except (requests.RequestException, ValueError) as e:
+                        print(f"Error claiming the next batch: {e}")
+
+        elapsed = time.time() - started
+        print(f"Described {self.described} images in {elapsed:.1f}s ({self.described / max(elapsed, 1e-9):.2f} images/s), "
+              f"{self.duplicates} duplicates copied, {self.skipped} skipped by triage, {self.without_image} without image, "
+              f"{self.fetch_failed} given up after {self.max_fetch_attempts} failed downloads. "
+              f"{self.updated} entries updated, {self.failed} not updated.")
+
+def load_processor(args):
+    if args.stub_model:
+        return StubImageProcessor(delay=args.stub_delay)
+    # Imported here so --stub-model works without torch and transformers installed
+    from FlorenceImageProcessor import FlorenceImageProcessor
+    return FlorenceImageProcessor(model_id=args.model_id, device=args.device, batch_size=args.batch_size,
+                                  profile=args.inference_profile, num_threads=args.threads,
+                                  local_files_only=args.local_files_only)
+
+def main():
+    parser = argparse.ArgumentParser(description="Caption the images queued in app.py with the Florence model.")
+    parser.add_argument("--server", type=str, default="http://127.0.0.1:5003", help="Base URL of app.py (default is http://127.0.0.1:5003).")
+    parser.add_argument("--batch-size", type=int, default=8, help="Entries claimed and described together (default is 8).")
+    parser.add_argument("--download-workers", type=int, default=8, help="Concurrent image downloads (default is 8).")
+    parser.add_argument("--tasks", type=lambda value: value.split(","), help=f"Comma-separated subset of {','.join(RESULT_COLUMNS)} (default is all).")
+    parser.add_argument("--model-id", type=str, default='HuggingFaceM4/Florence-2-DocVQA', help="Model to load, a Hub name or a local snapshot path.")
+    parser.add_argument("--local-files-only", action="store_true", help="Load the model from the local cache without network checks.")
+    parser.add_argument("--device", type=str, help="Device to run on (default is cuda:0 when available, else cpu).")
+    parser.add_argument("--inference-profile", type=str, default="default", help="Florence inference profile, 'default' or 'cpu' (default is default).")
+    parser.add_argument("--threads", type=int, help="Torch threads for inference (default is the torch default).")
+    parser.add_argument("--poll-interval", type=float, default=30, help="Seconds to wait when the queue is empty (default is 30).")
+    parser.add_argument("--exit-when-empty", action="store_true", help="Exit once the queue is empty instead of polling.")
+    parser.add_argument("--max-fetch-attempts", type=int, default=3, help="Claims after which an image that cannot be downloaded is posted as fetch_failed (default is 3).")
+    parser.add_argument("--no-triage", action="store_true", help="Describe every image in full, without triage.")
+    parser.add_argument("--stub-model", action="store_true", help="Use fixed answers instead of the Florence model.")
+    parser.add_argument("--stub-delay", type=float, default=0.0, help="Seconds of simulated inference per image with --stub-model.")
+    args = parser.parse_args()
+
+    if args.tasks and not set(args.tasks) <= set(RESULT_COLUMNS):
+        parser.error(f"--tasks must be a subset of {','.join(RESULT_COLUMNS)}.")
+
+    worker = CaptionWorker(
+        args.server, load_processor(args),
+        batch_size=args.batch_size,
+        download_workers=args.download_workers,
+        tasks=args.tasks,
+        poll_interval=args.poll_interval,
+        exit_when_empty=args.exit_when_empty,
+        triage=not args.no_triage,
+        max_fetch_attempts=args.max_fetch_attempts,
+    )
+    signal.signal(signal.SIGINT, worker.handle_signal)
+    signal.signal(signal.SIGTERM, worker.handle_signal)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        print("Stopped.")
+
+if __name__ == "__main__":
+    main()
@@ -24,7 +24,10 @@ def create_table(cursor, table_name):
                 objects_detected TEXT,
                 human_detected TEXT,  -- New column added here
                 is_locked INTEGER DEFAULT 0,  -- Tracks if an entry is sent to a client
-                locked_at TIMESTAMP  -- Tracks when the entry was locked
+                locked_at TIMESTAMP,  -- Tracks when the entry was locked
+                lease_token TEXT,  -- Identifies the batch the entry was handed out in
+                skip_reason TEXT,  -- Why triage skipped some or all caption tasks for the entry
+                claim_count INTEGER DEFAULT 0  -- Times the entry was handed out, caps retries of unfetchable images
             )
         ''')
         print(f"Table '{table_name}' created successfully (if not existing).")
@@ -64,12 +67,203 @@ def insert_csv_to_db(cursor, table_name, csv_file):
     except Exception as e:
         print(f"Error inserting data into table '{table_name}': {e}")
 
+# Columns filled from the CSV, the caption columns are left to the captioning clients
+LOAD_COLUMNS = ['id', 'url_key', 'article_title', 'image_url', 'image_alt', 'article_url', 'bw_ratio']
+
+# Function to convert a CSV row into the values of LOAD_COLUMNS
+def csv_row_values(row):
+    return (
+        row['id'],
+        row['urlkey'],
+        row['article_title'],
+        row['image_url'],
+        row['image_alt'] if row['image_alt'] else None,  # Handle empty alt
+        row['article_url'],
+        float(row['bw_ratio']) if row['bw_ratio'] else None,  # Handle missing bw_ratio
+    )
+
+# Function to apply the PRAGMAs used while loading: WAL journaling and relaxed syncing
+def set_load_pragmas(cursor):
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute("PRAGMA synchronous = NORMAL")
+
+# Columns written by the captioning clients and the lease bookkeeping, with the value of a fresh row
+RESULT_COLUMNS = {
+    'caption': 'NULL',
+    'detailed_caption': 'NULL',
+    'more_detailed_caption': 'NULL',
+    'logo_detection_img': 'NULL',
+    'objects_detected': 'NULL',
+    'human_detected': 'NULL',
+    'skip_reason': 'NULL',
+    'is_locked': '0',
+    'locked_at': 'NULL',
+    'lease_token': 'NULL',
+    'claim_count': '0',
+}
+
+# Function to insert or update rows by id, so loading the same CSV twice does not fail or duplicate rows.
+# Captions already written by clients are kept, unless the row now points at another image:
+# then the results and the lease of the old image are reset so the new one gets captioned.
+def upsert_rows(cursor, table_name, rows):
+    # The right-hand sides see the stored row, so every CASE compares against the old image_url
+    update_columns = ", ".join(
+        [f"{column} = CASE WHEN image_url IS excluded.image_url THEN {column} ELSE {fresh} END"
+         for column, fresh in RESULT_COLUMNS.items()] +
+        [f"{column} = excluded.{column}" for column in LOAD_COLUMNS[1:]])
+    cursor.executemany(f'''
+        INSERT INTO {table_name} ({", ".join(LOAD_COLUMNS)})
+        VALUES ({", ".join("?" for _ in LOAD_COLUMNS)})
+        ON CONFLICT(id) DO UPDATE SET {update_columns}
+    ''', rows)
+
+# Function to bulk load CSV data in batched transactions
+def bulk_insert_csv_to_db(cursor, table_name, csv_file, batch_size=5000):
+    try:
+        with open(csv_file, newline='', encoding='utf-8') as csvfile:
+            reader = csv.DictReader(csvfile)
+            total_rows = 0
+            batch = []
+            for row in reader:
+                batch.append(csv_row_values(row))
+                if len(batch) >= batch_size:
+                    upsert_rows(cursor, table_name, batch)
+                    cursor.connection.commit()
+                    total_rows += len(batch)
+                    batch = []
+            if batch:
+                upsert_rows(cursor, table_name, batch)
+                cursor.connection.commit()
+                total_rows += len(batch)
+        print(f"{total_rows} rows bulk loaded into table '{table_name}'.")
+    except FileNotFoundError:
+        print(f"CSV file '{csv_file}' not found. Please provide a valid file path.")
+    except Exception as e:
+        cursor.connection.rollback()
+        print(f"Error bulk loading data into table '{table_name}': {e}")
+
+# Function to create the indexes used by the captioning service.
+# The partial index only holds pending, unlocked rows, which is exactly the work queue read by /get_entries.
+def create_indexes(cursor, table_name):
+    try:
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_pending
+            ON {table_name} (id)
+            WHERE caption IS NULL AND skip_reason IS NULL AND is_locked = 0
+        ''')
+        # Entries left out of the queue by triage, counted by /metrics
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_skipped
+            ON {table_name} (is_locked)
+            WHERE caption IS NULL AND skip_reason IS NOT NULL
+        ''')
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_locked
+            ON {table_name} (locked_at)
+            WHERE is_locked = 1
+        ''')
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_lease
+            ON {table_name} (lease_token)
+            WHERE lease_token IS NOT NULL
+        ''')
+        print(f"Indexes on '{table_name}' created successfully (if not existing).")
+    except sqlite3.Error as e:
+        print(f"Error creating indexes on '{table_name}': {e}")
+
+# Columns covered by the full-text search index used by /api/images
+SEARCH_COLUMNS = ['article_title', 'image_alt', 'article_url', 'caption', 'detailed_caption', 'more_detailed_caption']
+
+# Function to create the FTS5 search index and the triggers that keep it in sync with the table.
+# The index is external-content, so the text is stored only once, in the table itself.
+# An index over other columns than SEARCH_COLUMNS is dropped and built again.
+def create_search_index(cursor, table_name):
+    columns = ", ".join(SEARCH_COLUMNS)
+    new_values = ", ".join(f"new.{column}" for column in SEARCH_COLUMNS)
+    old_values = ", ".join(f"old.{column}" for column in SEARCH_COLUMNS)
+    try:
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{table_name}_fts",)).fetchone()
+        if exists and [row[1] for row in cursor.execute(f"PRAGMA table_info({table_name}_fts)")] != SEARCH_COLUMNS:
+            for trigger in ("insert", "delete", "update"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {table_name}_fts_{trigger}")
+            cursor.execute(f"DROP TABLE {table_name}_fts")
+            exists = None
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {table_name}_fts
+            USING fts5({columns}, content='{table_name}', content_rowid='id')
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table_name}_fts_insert AFTER INSERT ON {table_name} BEGIN
+                INSERT INTO {table_name}_fts (rowid, {columns}) VALUES (new.id, {new_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table_name}_fts_delete AFTER DELETE ON {table_name} BEGIN
+                INSERT INTO {table_name}_fts ({table_name}_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            END
+        ''')
+        # Claiming and unlocking entries also updates rows, only changes to searched columns touch the index
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table_name}_fts_update AFTER UPDATE OF {columns} ON {table_name} BEGIN
+                INSERT INTO {table_name}_fts ({table_name}_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO {table_name}_fts (rowid, {columns}) VALUES (new.id, {new_values});
+            END
+        ''')
+        if not exists:
+            # Index the rows that were loaded before the search index existed
+            cursor.execute(f"INSERT INTO {table_name}_fts ({table_name}_fts) VALUES ('rebuild')")
+            print(f"Search index '{table_name}_fts' created successfully.")
+    except sqlite3.Error as e:
+        print(f"Error creating search index for '{table_name}': {e}")
+
+# Columns whose changes count as a change of the exported data; lock bookkeeping is left out
+DATA_COLUMNS = LOAD_COLUMNS[1:] + ['caption', 'detailed_caption', 'more_detailed_caption',
+                                   'logo_detection_img', 'objects_detected', 'human_detected']
+
+# Function to create the change counter of a table. Triggers bump the sequence on every insert, delete
+# and data update, so /export can tell whether anything changed without reading the table.
+# The generation is random, so a recreated database never reuses the sequence numbers of an old one.
+# The row count is kept up to date as well, so /metrics never has to count the whole table.
+def create_change_tracking(cursor, table_name):
+    try:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table_name}_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                generation TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                row_count INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO {table_name}_version (id, generation, seq, row_count)
+            VALUES (1, lower(hex(randomblob(8))), 0, (SELECT COUNT(*) FROM {table_name}))
+        ''')
+        bump = f"UPDATE {table_name}_version SET seq = seq + 1 WHERE id = 1;"
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table_name}_version_insert AFTER INSERT ON {table_name} BEGIN
+                UPDATE {table_name}_version SET seq = seq + 1, row_count = row_count + 1 WHERE id = 1;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table_name}_version_delete AFTER DELETE ON {table_name} BEGIN
+                UPDATE {table_name}_version SET seq = seq + 1, row_count = row_count - 1 WHERE id = 1;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table_name}_version_update
+            AFTER UPDATE OF {", ".join(DATA_COLUMNS)} ON {table_name} BEGIN {bump} END
+        ''')
+    except sqlite3.Error as e:
+        print(f"Error creating change tracking for '{table_name}': {e}")
+
 # Main function to handle database connection and user inputs
 def main():
     # Accept database, table, and CSV file names from user input
     database_name = os.getenv('DATABASE')
     table_name = input("Enter the table name: ")
     csv_file = input("Enter the CSV file name (e.g., 'your_file.csv'): ")
+    load_mode = input("Enter load mode (bulk or row) [default: bulk]: ") or "bulk"
 
     # Check if the CSV file exists before proceeding
     if not os.path.exists(csv_file):
@@ -77,6 +271,7 @@ def main():
         return
 
     # Create a connection to the SQLite database
+    conn = None
     try:
         conn = sqlite3.connect(database_name)
         cursor = conn.cursor()
@@ -86,7 +281,16 @@ def main():
         create_table(cursor, table_name)
 
         # Insert data from CSV to the SQLite database
-        insert_csv_to_db(cursor, table_name, csv_file)
+        if load_mode == "row":
+            insert_csv_to_db(cursor, table_name, csv_file)
+        else:
+            set_load_pragmas(cursor)
+            bulk_insert_csv_to_db(cursor, table_name, csv_file)
+
+        # Index the work queue once the data is in place
+        create_indexes(cursor, table_name)
+        create_search_index(cursor, table_name)
+        create_change_tracking(cursor, table_name)
 
         # Commit changes and close the connection
         conn.commit()
@@ -0,0 +1,16 @@
+# Gunicorn settings for serving app.py in production:
+#
+#     gunicorn -c gunicorn.conf.py app:app
+#
+# SQLite allows one writer at a time, so threads serve the queue about as well as extra processes. A single
+# process also keeps the /metrics counters in one place: with several workers each one would report only its
+# own (see metrics.py). Each thread keeps its own database connection (see get_db_connection).
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5003")
+worker_class = "gthread"
+workers = int(os.getenv("WEB_WORKERS", 1))
+threads = int(os.getenv("WEB_THREADS", 16))
+timeout = int(os.getenv("WEB_TIMEOUT", 120))  # Large /update_entries batches can take a while
+keepalive = 5  # Caption workers poll the same server, keep their connections open
+accesslog = os.getenv("ACCESS_LOG")  # Off unless a path or "-" is given
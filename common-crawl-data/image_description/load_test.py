@@ -0,0 +1,174 @@
+"""
+Local load generator for the captioning queue in app.py.
+
+It creates a throwaway database with the given number of pending entries, serves app.py on a local port
+and lets N concurrent workers run the caption worker loop against it: claim a batch from /get_entries,
+then post results for it to /update_entries, until the queue is empty.
+
+It reports requests per second and p50/p99 latency for both routes. Every claimed id is recorded, and
+the run fails if any id was handed out to more than one worker. A worker backs off after a failed claim,
+and gives up (failing the run) after several failures in a row, so an unreachable server ends the run.
+
+To measure a server started separately (for example with gunicorn.conf.py), pass --url. The database
+behind that server has to be prepared beforehand.
+
+Usage:
+    python load_test.py --entries 20000 --clients 32 --batch-size 25
+    python load_test.py --url http://127.0.0.1:5003 --clients 64
+
+Dependencies:
+- flask
+- requests
+- python-dotenv
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+import requests
+from werkzeug.serving import make_server
+
+def create_database(database, table_name, entries):
+    from csv_to_sql import create_indexes, create_table
+    conn = sqlite3.connect(database)
+    cursor = conn.cursor()
+    create_table(cursor, table_name)
+    cursor.executemany(f'''
+        INSERT INTO {table_name} (id, url_key, article_title, image_url, image_alt, article_url, bw_ratio)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (i, "com,example)/", "Example", f"https://example.com/{i}.png", f"image {i}", "https://example.com/", 0.5)
+        for i in range(1, entries + 1)
+    ])
+    conn.commit()
+    create_indexes(cursor, table_name)
+    conn.close()
+
+def start_server(app):
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def caption_result(entry):
+    return {
+        "id": entry["id"],
+        "caption": f"caption {entry['id']}",
+        "detailed_caption": f"detailed caption {entry['id']}",
+        "more_detailed_caption": f"more detailed caption {entry['id']}",
+        "logo_detection_img": "No",
+        "objects_detected": "{}",
+        "human_detected": "No",
+    }
+
+def timed_request(session, method, url, latencies, errors, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = session.request(method, url, timeout=60, **kwargs)
+    except requests.RequestException as e:
+        errors.append(str(e))
+        return None
+    latencies.append(time.perf_counter() - started)
+    if response.status_code != 200:
+        errors.append(f"{response.status_code}: {response.text[:200]}")
+        return None
+    return response
+
+# A worker backs off after a failed claim and gives up after this many failures in a row
+MAX_CONSECUTIVE_FAILURES = 5
+RETRY_DELAY = 0.5
+
+def run_worker(base_url, batch_size, claimed, latencies, errors, gave_up):
+    session = requests.Session()
+    failures = 0
+    while True:
+        response = timed_request(session, "GET", f"{base_url}/get_entries", latencies["/get_entries"], errors,
+                                 params={"limit": batch_size})
+        if response is None:
+            failures += 1
+            if failures >= MAX_CONSECUTIVE_FAILURES:
+                gave_up.append(threading.current_thread().name)
+                return
+            time.sleep(RETRY_DELAY * 2 ** (failures - 1))
+            continue
+        failures = 0
+        entries = response.json()
+        if not entries:
+            return
+        claimed.extend((entry["id"], entry["lease_token"]) for entry in entries)
+
+        timed_request(session, "POST", f"{base_url}/update_entries", latencies["/update_entries"], errors,
+                      json={"lease_token": entries[0]["lease_token"],
+                            "entries": [caption_result(entry) for entry in entries]})
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the captioning queue and check that no entry is claimed twice.")
+    parser.add_argument("--entries", type=int, default=20000, help="Number of pending entries (default is 20000).")
+    parser.add_argument("--clients", type=int, default=32, help="Number of concurrent workers (default is 32).")
+    parser.add_argument("--batch-size", type=int, default=25, help="Entries claimed per request (default is 25).")
+    parser.add_argument("--url", type=str, help="Base URL of an already running server instead of a local one.")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        workdir = tempfile.mkdtemp(prefix="vanavil_load_test_")
+        os.environ["DATABASE"] = os.path.join(workdir, "load_test.db")
+        os.environ["TABLE_NAME"] = "load_test_entries"
+        create_database(os.environ["DATABASE"], os.environ["TABLE_NAME"], args.entries)
+
+        from app import app
+        server, base_url = start_server(app)
+
+    claimed = []
+    errors = []
+    gave_up = []
+    latencies = defaultdict(list)
+    started = time.time()
+    workers = [
+        threading.Thread(target=run_worker, args=(base_url, args.batch_size, claimed, latencies, errors, gave_up))
+        for _ in range(args.clients)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - started
+    if server:
+        server.shutdown()
+
+    claim_counts = Counter(entry_id for entry_id, _ in claimed)
+    double_claims = sum(1 for count in claim_counts.values() if count > 1)
+    leases = len({lease_token for _, lease_token in claimed})
+    print(f"Workers: {args.clients}, batch size: {args.batch_size}, time: {elapsed:.2f}s")
+    for route in ("/get_entries", "/update_entries"):
+        route_latencies = latencies[route]
+        print(f"{route:<16} requests={len(route_latencies):<7} rps={len(route_latencies) / elapsed:8.1f} "
+              f"p50={percentile(route_latencies, 0.50) * 1000:7.1f}ms p99={percentile(route_latencies, 0.99) * 1000:7.1f}ms")
+    print(f"Claimed {len(claimed)} entries ({len(claim_counts)} unique) in {leases} leases, "
+          f"{len(claimed) / elapsed:.0f} entries/s")
+    print(f"Request errors: {len(errors)}")
+    if gave_up:
+        print(f"Workers that gave up after {MAX_CONSECUTIVE_FAILURES} failed claims in a row: {len(gave_up)}")
+        print(f"Last error: {errors[-1]}")
+    print(f"Double claims: {double_claims}")
+
+    if double_claims or gave_up or (not args.url and len(claim_counts) != args.entries):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
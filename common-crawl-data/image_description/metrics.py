@@ -0,0 +1,92 @@
+"""
+In-process counters and latency histograms for the captioning service, rendered in the Prometheus text format.
+
+The values live in the memory of one server process. Several gunicorn workers behind one port would each
+keep their own counters, and every scrape would see only the worker that answered it, so gunicorn.conf.py
+runs a single worker with several threads.
+"""
+
+import threading
+from collections import defaultdict
+
+# Upper bounds (in seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.latency_counts = defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+        self.latency_sums = defaultdict(float)
+        self.latency_totals = defaultdict(int)
+
+    def increment(self, name, value=1, **labels):
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe_latency(self, route, seconds):
+        with self._lock:
+            buckets = self.latency_counts[route]
+            for index, upper_bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= upper_bound:
+                    buckets[index] += 1
+            self.latency_sums[route] += seconds
+            self.latency_totals[route] += 1
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+    @staticmethod
+    def format_value(value):
+        # Whole numbers are written in full, {:g} would round counts above a million
+        if isinstance(value, float) and not value.is_integer():
+            return repr(value)
+        return str(int(value))
+
+    def render(self, gauges):
+        """Returns all counters and histograms, plus the given gauges, in the Prometheus text format.
+
+        gauges is a list of (name, help, labels, value) tuples measured at scrape time.
+        """
+        lines = []
+        described = set()
+
+        def describe(name, help_text, metric_type):
+            if name not in described:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                described.add(name)
+
+        for name, help_text, labels, value in gauges:
+            describe(name, help_text, "gauge")
+            lines.append(f"{name}{self.format_labels(sorted(labels.items()))} {value}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                describe(name, COUNTER_HELP.get(name, name), "counter")
+                lines.append(f"{name}{self.format_labels(labels)} {self.format_value(value)}")
+
+            name = "vanavil_request_duration_seconds"
+            for route in sorted(self.latency_totals):
+                describe(name, "Request latency per route.", "histogram")
+                for upper_bound, count in zip(LATENCY_BUCKETS, self.latency_counts[route]):
+                    lines.append(f'{name}_bucket{{route="{route}",le="{upper_bound}"}} {count}')
+                lines.append(f'{name}_bucket{{route="{route}",le="+Inf"}} {self.latency_totals[route]}')
+                lines.append(f'{name}_sum{{route="{route}"}} {self.latency_sums[route]:.6f}')
+                lines.append(f'{name}_count{{route="{route}"}} {self.latency_totals[route]}')
+
+        return "\n".join(lines) + "\n"
+
+COUNTER_HELP = {
+    "vanavil_claim_requests_total": "Calls to /get_entries that claimed at least one entry.",
+    "vanavil_entries_claimed_total": "Entries handed out by /get_entries.",
+    "vanavil_entries_updated_total": "Entries written by /update_entries.",
+    "vanavil_entries_triaged_total": "Entries written with a skip_reason, by reason.",
+    "vanavil_entries_rejected_total": "Entries refused by /update_entries, by reason.",
+    "vanavil_leases_extended_total": "Successful /extend_lease calls.",
+    "vanavil_entries_released_total": "Claimed entries handed back by /release_lease.",
+    "vanavil_requests_total": "Requests handled, by route and status code.",
+}
@@ -0,0 +1,87 @@
+"""
+Cheap checks that decide how much Florence inference an image is worth before any generation runs.
+
+Many rows are tracking pixels, spacer GIFs, tiny icons or the same site logo repeated on every page. The
+checks only use what is already in the row (image_alt, bw_ratio) or what the download gives for free
+(byte size, dimensions, pixel extrema, a hash of the bytes), and route each entry to one of:
+- full: every task of DESCRIBE_TASKS.
+- reduced: REDUCED_TASKS only, for icon-sized images and logos.
+- skip: no inference at all.
+
+The reason for a skip or a reduced task set is stored in the skip_reason column of the table, so skipped
+rows leave the caption queue and can be audited or requeued later.
+
+Usage:
+    decision = triage_entry(entry)                          # before the download, None if undecided
+    decision = triage_image(entry, image, len(content))     # after the download
+    if decision.route == SKIP: ...
+
+Dependencies:
+- pillow
+"""
+
+import hashlib
+import re
+from collections import namedtuple
+
+FULL = 'full'
+REDUCED = 'reduced'
+SKIP = 'skip'
+
+# Images below this many pixels on either side are pixels, spacers or bullets
+MIN_SIDE = 32
+# Images below this many pixels on either side are icons, only the caption and the logo check run
+REDUCED_SIDE = 128
+# Files smaller than this hold no more than a flat color or a few lines
+MIN_BYTES = 256
+# Wider or taller than this ratio are borders, dividers and banners
+MAX_ASPECT_RATIO = 8
+# Images whose pixels are (almost) all gray get no object and human detection
+GRAYSCALE_BW_RATIO = 0.99
+
+# Only alt texts that cannot describe a real picture, words like 'pixel' or 'blank' also appear in real captions
+PLACEHOLDER_ALT = re.compile(r'\b(spacer|1x1|tracking pixel)\b', re.IGNORECASE)
+ICON_ALT = re.compile(r'\b(logo|icon|badge|button|avatar|favicon)\b', re.IGNORECASE)
+
+REDUCED_TASKS = ['caption', 'logo_detection_img']
+GRAYSCALE_TASKS = ['caption', 'detailed_caption', 'more_detailed_caption', 'logo_detection_img']
+
+# tasks is None for the full task set
+Decision = namedtuple('Decision', ['route', 'tasks', 'reason'])
+
+FULL_DECISION = Decision(FULL, None, None)
+
+def content_hash(content):
+    """Hash of the image bytes, used to describe an image shown on many pages only once."""
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+def triage_entry(entry):
+    """Checks the row alone, before the image is downloaded. Returns a Decision, or None if undecided."""
+    if PLACEHOLDER_ALT.search(entry.get('image_alt') or ''):
+        return Decision(SKIP, [], 'placeholder_alt')
+    return None
+
+def triage_image(entry, image, byte_size):
+    """Checks the downloaded image. Returns a Decision."""
+    width, height = image.size
+    if min(width, height) < MIN_SIDE:
+        return Decision(SKIP, [], 'too_small')
+    if byte_size < MIN_BYTES:
+        return Decision(SKIP, [], 'too_few_bytes')
+    if max(width, height) / min(width, height) > MAX_ASPECT_RATIO:
+        return Decision(SKIP, [], 'extreme_aspect_ratio')
+    # Every band with a single value means one flat color
+    extrema = image.getextrema()
+    if not isinstance(extrema[0], tuple):
+        extrema = [extrema]  # Single band images
+    if all(low == high for low, high in extrema):
+        return Decision(SKIP, [], 'blank_image')
+
+    if min(width, height) < REDUCED_SIDE:
+        return Decision(REDUCED, REDUCED_TASKS, 'icon_size')
+    if ICON_ALT.search(entry.get('image_alt') or ''):
+        return Decision(REDUCED, REDUCED_TASKS, 'icon_alt')
+    bw_ratio = entry.get('bw_ratio')
+    if bw_ratio is not None and bw_ratio >= GRAYSCALE_BW_RATIO:
+        return Decision(REDUCED, GRAYSCALE_TASKS, 'grayscale')
+    return FULL_DECISION
@@ -0,0 +1,286 @@
+"""
+Shared instrumentation for the pipeline stages.
+
+- **Structured logs**: log_event appends one JSON object per line to pipeline_log.jsonl (or the file given to
+  configure_log). Lines are buffered and written every FLUSH_LINES lines or FLUSH_SECONDS seconds, and at exit.
+- **Timers**: `with timer("html", "fetch"):` records the duration of a step of a stage in a latency histogram.
+  The stages are cdx (fetch, parse), html (fetch, decompress, parse, recorded as warc in CommonCrawlPipeline),
+  bw_ratio (fetch, decode, compute) and link_check (fetch). timers.report() returns one line per step, grouped by stage, with the count, total time
+  and estimated percentiles, and timers.report("html") only the steps of one stage.
+- **Progress**: ProgressReporter prints at most one line per interval with the rate and the time left,
+  instead of a line per record.
+- **Profiling**: add_profile_arguments adds --profile to a script, and `with profiled(args.profile, ...):`
+  runs the work under cProfile (pstats file, calling thread only) or under a sampling profiler that sees every
+  thread and writes folded stacks for flamegraph.pl or speedscope.
+
+Usage:
+    from instrumentation import ProgressReporter, log_event, timer, timers
+
+    with timer("html", "fetch"):
+        response = requests.get(url)
+    log_event("record_failed", stage="html", urlkey=urlkey, error=str(e))
+    print(timers.report("html"))
+
+Dependencies:
+- None (standard library only)
+"""
+
+import atexit
+import cProfile
+import io
+import json
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+DEFAULT_LOG_PATH = "pipeline_log.jsonl"
+FLUSH_LINES = 200
+FLUSH_SECONDS = 2.0
+
+# Upper bounds (in seconds) of the step duration histogram buckets
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                    2.5, 5.0, 10.0, 30.0, 60.0)
+
+class JsonLinesLog:
+    """Appends JSON events to a file in batches, from any thread."""
+
+    def __init__(self, path, flush_lines=FLUSH_LINES, flush_seconds=FLUSH_SECONDS):
+        self.path = path
+        self.flush_lines = flush_lines
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def write(self, event, **fields):
+        line = json.dumps({"time": datetime.now().isoformat(timespec="milliseconds"), "event": event, **fields},
+                          default=str, ensure_ascii=False)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.flush_lines or time.monotonic() - self._last_flush >= self.flush_seconds:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._buffer:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(self._buffer) + "\n")
+            self._buffer = []
+        self._last_flush = time.monotonic()
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(DURATION_BUCKETS) + 1)  # The last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        for index, upper_bound in enumerate(DURATION_BUCKETS):
+            if seconds <= upper_bound:
+                break
+        else:
+            index = len(DURATION_BUCKETS)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of observations, capped at the largest one."""
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(DURATION_BUCKETS[index], self.max) if index < len(DURATION_BUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "total_seconds": round(self.total, 4),
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else None,
+            "p50_ms": round(self.percentile(0.50) * 1000, 3),
+            "p90_ms": round(self.percentile(0.90) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+class Timers:
+    """Duration histograms per (stage, step), shared by every thread of the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = defaultdict(Histogram)
+
+    def observe(self, stage, step, seconds):
+        with self._lock:
+            self.histograms[stage, step].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage, step):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, step, time.perf_counter() - started)
+
+    def summary(self, stage=None):
+        """Step summaries per stage, or only the steps of the given stage."""
+        stages = defaultdict(dict)
+        with self._lock:
+            for (stage_name, step), histogram in sorted(self.histograms.items()):
+                stages[stage_name][step] = histogram.summary()
+        return stages.get(stage, {}) if stage else dict(stages)
+
+    def report(self, stage=None):
+        stages = {stage: self.summary(stage)} if stage else self.summary()
+        return "\n".join(
+            f"{stage_name:<10} {step:<11} count={values['count']:<8} total={values['total_seconds']:9.2f}s "
+            f"p50={values['p50_ms']:9.2f}ms p90={values['p90_ms']:9.2f}ms p99={values['p99_ms']:9.2f}ms"
+            for stage_name, steps in stages.items() for step, values in steps.items())
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+
+class ProgressReporter:
+    """Counts processed items and prints a progress line at most once per interval."""
+
+    def __init__(self, label, total=None, interval=5.0):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.started = time.monotonic()
+        self._last_report = self.started
+        self._lock = threading.Lock()
+
+    def update(self, count=1):
+        with self._lock:
+            self.done += count
+            now = time.monotonic()
+            if now - self._last_report < self.interval:
+                return
+            self._last_report = now
+        print(self.line())
+
+    def line(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        rate = self.done / elapsed
+        if not self.total:
+            return f"[{self.label}] {self.done} done, {rate:.1f}/s"
+        remaining = (self.total - self.done) / rate if rate else float("inf")
+        return (f"[{self.label}] {self.done}/{self.total} ({self.done / self.total:.0%}), {rate:.1f}/s, "
+                f"{remaining:.0f}s left")
+
+    def finish(self):
+        print(self.line())
+
+class SamplingProfiler:
+    """Records the stack of every thread at a fixed interval, from a background thread."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_folded(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top_functions(self, limit=15):
+        """Functions most often found on top of a stack, with their share of the samples."""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return "\n".join(f"{count / total:6.1%}  {function}" for function, count in leaves.most_common(limit))
+
+def add_profile_arguments(parser):
+    parser.add_argument("--profile", choices=["cprofile", "sampling"],
+                        help="Profile the run. cprofile sees the main thread only, sampling sees every thread.")
+    parser.add_argument("--profile-output", type=str,
+                        help="Profile file (default is profile.prof for cprofile, profile.folded for sampling).")
+    parser.add_argument("--profile-interval", type=float, default=0.005,
+                        help="Seconds between samples of the sampling profiler (default is 0.005).")
+
+@contextmanager
+def profiled(mode, output=None, interval=0.005):
+    """Runs the block under the given profiler, or as is when mode is None."""
+    if mode is None:
+        yield
+        return
+
+    if mode == "cprofile":
+        output = output or "profile.prof"
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(output)
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(15)
+            print(summary.getvalue())
+            print(f"cProfile stats written to {output} (open with python -m pstats or snakeviz).")
+    elif mode == "sampling":
+        output = output or "profile.folded"
+        profiler = SamplingProfiler(interval)
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            profiler.write_folded(output)
+            print(f"Top functions over {profiler.samples} samples:\n{profiler.top_functions()}")
+            print(f"Folded stacks written to {output} (open with flamegraph.pl or speedscope).")
+    else:
+        raise ValueError(f"Unknown profile mode: {mode}")
+
+timers = Timers()
+timer = timers.timer
+event_log = JsonLinesLog(DEFAULT_LOG_PATH)
+atexit.register(lambda: event_log.flush())
+
+def configure_log(path):
+    """Sends the events logged from now on to another file."""
+    global event_log
+    event_log.flush()
+    event_log = JsonLinesLog(path)
+
+def log_event(event, **fields):
+    event_log.write(event, **fields)
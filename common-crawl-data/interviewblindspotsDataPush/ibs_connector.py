@@ -1,26 +1,43 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from sync_ledger import SyncLedger, content_hash
 
 # Modify the sample data in the main function
 add_sample_snippet = True  # Set to True to add a sample snippet with comments
 delete_sample_snippet = False  # Set to True to delete the sample snippet
 
 class IBSConnector:
-    def __init__(self, token):
+    def __init__(self, token, max_workers=4, ledger_path=None, create_only=False):
         self.base_url = "https://backend.interviewblindspots.com/displaycode/"
         self.cookies = {"token": token}
         self.headers = { "Authorization": f"Token {token}" }
+        self.max_workers = max_workers  # Questions synced at the same time
+        self.ledger = SyncLedger(ledger_path) if ledger_path else None  # Without a ledger every call pushes
+        # With create_only, content that changed after it was pushed is reported instead of PATCHed
+        self.create_only = create_only
+        self._username = None
+
+        # One pooled session shared by the sync threads, with a connection for each of them
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max_workers))
+        self.session.cookies.update(self.cookies)
+        self.session.headers.update(self.headers)
 
     def send_request(self, endpoint, payload=None, method='POST'):
         url = self.base_url + endpoint
+        session = self.session
         try:
             if method == 'POST':
-                response = requests.post(url, cookies=self.cookies, data=payload, headers=self.headers)
+                response = session.post(url, data=payload)
+            elif method == 'PATCH':
+                response = session.patch(url, data=payload)
             elif method == 'DELETE':
-                response = requests.delete(url, cookies=self.cookies, headers=self.headers)
+                response = session.delete(url)
             elif method == 'GET':
-                response = requests.get(url, cookies=self.cookies, headers=self.headers)
+                response = session.get(url)
             else:
                 raise ValueError(f"Unsupported HTTP method: {method}")
                 
@@ -32,12 +49,15 @@ class IBSConnector:
 
     def get_username(self):
         # return "stackoverflow"
-        # Fetch the username from the provided route
+        # The username does not change during a run, so it is fetched once
+        if self._username:
+            return self._username
         endpoint = "api/v1/users/me/"
         response = self.send_request(endpoint, method='GET')
         print(response)
         if response:
-            return response.get("username")
+            self._username = response.get("username")
+            return self._username
         else:
             print("Failed to retrieve username.")
             return None
@@ -51,18 +71,109 @@ class IBSConnector:
         }
         return self.send_request("snippets/", payload)
 
+    def update_snippet(self, snippet_id, title, text, language='clike'):
+        payload = {
+            "title": title,
+            "text": text,
+            "language": language,
+        }
+        return self.send_request(f"snippets/{snippet_id}/", payload, method='PATCH')
+
+    def add_comment(self, snippet_id, comment):
+        payload = {
+            "line": comment["line"],
+            "snippetId": snippet_id,
+            "text": comment["text"]
+        }
+        response = self.send_request("comments/", payload)
+        if response:
+            print(f"Comment added: {response}")
+        else:
+            print(f"Failed to add comment: {comment}")
+        return response
+
+    def update_comment(self, comment_id, comment):
+        payload = {
+            "line": comment["line"],
+            "text": comment["text"]
+        }
+        response = self.send_request(f"comments/{comment_id}/", payload, method='PATCH')
+        if response:
+            print(f"Comment updated: {response}")
+        else:
+            print(f"Failed to update comment {comment_id}: {comment}")
+        return response
+
     def add_comments(self, snippet_id, comments):
+        """Posts the comments one after the other, so they are shown in order. Returns the responses in order."""
+        return [self.add_comment(snippet_id, comment) for comment in comments]
+
+    def sync_question(self, question_id, title, text, comments, language='clike'):
+        """Creates or updates the snippet of a question and pushes its comments, skipping what the ledger
+        shows as already pushed and unchanged.
+
+        The comments of a snippet are posted one at a time, in the given order, so the snippet shows them in
+        that order. A comment may carry a 'key' (for example the answer id) so an edited answer updates its
+        comment instead of adding a second one. With create_only, a changed question or comment is only
+        reported. Returns the snippet id (a string when a ledger is used), or None if the snippet could not be created.
+        """
+        if not self.ledger:
+            snippet_response = self.create_snippet(title, text, language)
+            if not snippet_response:
+                return None
+            self.add_comments(snippet_response.get("id"), comments)
+            return snippet_response.get("id")
+
+        snippet_hash = content_hash(title, text, language)
+        known = self.ledger.snippet_for(question_id)
+        if known is None:
+            snippet_response = self.create_snippet(title, text, language)
+            if not snippet_response or not snippet_response.get("id"):
+                return None
+            # Kept as the ledger keeps it, so a first run and a rerun return the same id
+            snippet_id = str(snippet_response["id"])
+            self.ledger.record_snippet(question_id, snippet_id, snippet_hash)
+        else:
+            snippet_id, pushed_hash = known
+            if pushed_hash != snippet_hash:
+                if self.create_only:
+                    print(f"Question {question_id} changed since snippet {snippet_id} was pushed, it is left as it is.")
+                elif self.update_snippet(snippet_id, title, text, language):
+                    self.ledger.record_snippet(question_id, snippet_id, snippet_hash)
+
+        # Split the comments into new ones, changed ones and ones already pushed as they are
+        pushed = self.ledger.comments_for(snippet_id)
+        new, changed = [], []
         for comment in comments:
-            payload = {
-                "line": comment["line"],
-                "snippetId": snippet_id,
-                "text": comment["text"]
-            }
-            response = self.send_request("comments/", payload)
+            comment_hash = content_hash(comment["line"], comment["text"])
+            key = str(comment.get("key") or comment_hash)
+            if key not in pushed:
+                new.append((key, comment_hash, comment))
+            elif pushed[key][1] != comment_hash and pushed[key][0]:
+                changed.append((key, comment_hash, comment, pushed[key][0]))
+
+        recorded = []
+        for key, comment_hash, comment in new:
+            response = self.add_comment(snippet_id, comment)
             if response:
-                print(f"Comment added: {response}")
-            else:
-                print(f"Failed to add comment: {comment}")
+                recorded.append((key, response.get("id"), comment_hash))
+        updated = 0
+        if not self.create_only:
+            for key, comment_hash, comment, comment_id in changed:
+                if self.update_comment(comment_id, comment):
+                    recorded.append((key, comment_id, comment_hash))
+                    updated += 1
+        self.ledger.record_comments(snippet_id, recorded)
+        print(f"Snippet {snippet_id}: {len(recorded) - updated} of {len(new)} new comments pushed, "
+              f"{updated} of {len(changed)} changed comments updated, "
+              f"{len(comments) - len(new) - len(changed)} already pushed.")
+        return snippet_id
+
+    def sync_questions(self, questions):
+        """Syncs several questions with up to max_workers at a time, each a dict of sync_question's arguments.
+        Returns the snippet ids in the order of the questions."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda question: self.sync_question(**question), questions))
 
     def create_snippet_with_comments(self, title, text, comments, language='clike'):
         # Get the username to be used as the author
@@ -86,6 +197,8 @@ class IBSConnector:
         response = self.send_request(endpoint, method='DELETE')
         if response:
             print(f"Snippet deleted: {response}")
+            if self.ledger:
+                self.ledger.forget_snippet(snippet_id)
         else:
             print(f"Failed to delete snippet with ID: {snippet_id}")
 
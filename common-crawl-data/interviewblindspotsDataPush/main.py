@@ -3,6 +3,7 @@ import os
 from dotenv import load_dotenv
 from ibs_connector import IBSConnector
 from stackexchange_fetcher import StackExchangeFetcher
+from stackexchange_mirror import StackExchangeMirror
 
 # Load environment variables from .env file
 load_dotenv()
@@ -13,13 +14,22 @@ def main():
     if not tokenidfromenv:
         raise ValueError("TOKEN_ID not found in the environment variables.")
 
-    ibs_connector = IBSConnector(tokenidfromenv)
-    fetcher = StackExchangeFetcher()
+    # The ledger records what was pushed, so a rerun only pushes new or changed questions and answers.
+    # With IBS_CREATE_ONLY=1 changed ones are only reported, not updated.
+    ibs_connector = IBSConnector(tokenidfromenv, ledger_path=os.getenv("IBS_LEDGER", "ibs_sync_ledger.db"),
+                                 create_only=os.getenv("IBS_CREATE_ONLY") == "1")
+    fetcher = StackExchangeFetcher(pagesize=100, key=os.getenv("STACKEXCHANGE_KEY"))
 
-    # Fetch top questions
-    top_questions = fetcher.fetch_top_questions()
+    # Bring the local mirror up to date, only questions with activity since the last run are fetched
+    mirror = StackExchangeMirror(os.getenv("SE_MIRROR", "stackexchange_mirror.db"), fetcher)
+    mirror.sync()
+
+    # Top questions and their answers, with bodies already converted
+    top_questions = mirror.top_questions(limit=10)
     # top_questions = top_questions[:1] 
+    answers_by_question = mirror.answers_for([question.get('question_id') for question in top_questions])
 
+    questions = []
     for idx, question in enumerate(top_questions, start=1):
         title = question.get('title')
         question_id = question.get('question_id')
@@ -34,26 +44,26 @@ def main():
         detected_language = fetcher.detect_language_from_tags(tags)
         print(f"Detected Language: {detected_language}")
         
-        # Create snippet for the question, including the detected language
-        snippet_response = ibs_connector.create_snippet(title, question_body, detected_language)
-        if snippet_response:
-            snippet_id = snippet_response.get('id')
-            
-            # Fetch answers for the question
-            answers = fetcher.fetch_answers_for_question(question_id)
-            
-            # Prepare comments from answers
-            comments = []
-            for answer in answers:
-                answer_body = answer.get('body', '[No Content]')
-                comments.append({"line": 1, "text": answer_body})
-
-            # Add comments to the snippet
-            ibs_connector.add_comments(snippet_id, comments)
-
-        else:
-            print("Failed to create snippet for the question.")
+        answers = answers_by_question.get(question_id, [])
+
+        # Prepare comments from answers, keyed by answer id so an edited answer updates its comment
+        comments = []
+        for answer in answers:
+            answer_body = answer.get('body', '[No Content]')
+            comments.append({"line": 1, "text": answer_body, "key": answer.get('answer_id')})
+
+        questions.append({"question_id": question_id, "title": title, "text": question_body,
+                          "comments": comments, "language": detected_language})
         print("\n" + "-"*80 + "\n")
 
+    # Create or update the snippets of the questions and their comments, several questions at a time
+    snippet_ids = ibs_connector.sync_questions(questions)
+    for question, snippet_id in zip(questions, snippet_ids):
+        if not snippet_id:
+            print(f"Failed to create snippet for question {question['question_id']}.")
+
+    print(fetcher.quota_report())
+    mirror.close()
+
 if __name__ == "__main__":
     main()
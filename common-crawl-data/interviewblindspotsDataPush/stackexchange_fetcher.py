@@ -1,41 +1,134 @@
+import re
+import time
 import requests
 import html2text
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+# The API accepts at most 100 ids per request and 100 items per page
+MAX_IDS_PER_REQUEST = 100
+MAX_PAGESIZE = 100
 
 class StackExchangeFetcher:
-    def __init__(self, site='codereview', pagesize=10):
+    def __init__(self, site='codereview', pagesize=10, key=None, max_retries=3):
         self.site = site
-        self.pagesize = pagesize
+        self.pagesize = min(pagesize, MAX_PAGESIZE)
+        self.key = key  # Optional app key, raises the daily quota from 300 to 10,000 requests
+        self.max_retries = max_retries
         self.base_url = "https://api.stackexchange.com/2.3/"
         self.html_converter = html2text.HTML2Text()
         self.html_converter.ignore_links = False  # Keep links in the markdown output
         self.allowed_languages = {'java', 'python', 'javascript', 'ruby', 'swift', 'go', 'rust', 'php', 'clike'}
 
-    def fetch_top_questions(self, page=1):
-        url = f"{self.base_url}questions?order=desc&sort=votes&site={self.site}&page={page}&pagesize={self.pagesize}&filter=withbody"
-        response = requests.get(url)
-        if response.status_code == 200:
-            questions = response.json().get('items', [])
+        # One pooled session, so every request reuses the same connection to the API
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+        # Quota and backoff as last reported by the API
+        self.quota_max = None
+        self.quota_remaining = None
+        self.backoff_until = 0.0
+        self.requests_made = 0
+        self.failed_requests = 0  # Requests given up on, so callers can tell a partial result from a full one
+
+    def wait_for_backoff(self):
+        delay = self.backoff_until - time.monotonic()
+        if delay > 0:
+            print(f"Backing off for {delay:.0f}s as requested by the API.")
+            time.sleep(delay)
+
+    def api_get(self, path, params):
+        """Sends one API request, honoring backoff and tracking quota. Returns the response JSON or None."""
+        params = {'site': self.site, **params}
+        if self.key:
+            params['key'] = self.key
+
+        for attempt in range(self.max_retries):
+            self.wait_for_backoff()
+            try:
+                response = self.session.get(self.base_url + path, params=params, timeout=30)
+                self.requests_made += 1
+                data = response.json()
+            except (requests.RequestException, ValueError) as e:
+                print(f"Request to {path} failed: {e}")
+                time.sleep(2 ** attempt)
+                continue
+
+            if 'quota_remaining' in data:
+                self.quota_max = data.get('quota_max')
+                self.quota_remaining = data['quota_remaining']
+            if 'backoff' in data:
+                # Any further request to the same method before the backoff ends is refused
+                self.backoff_until = time.monotonic() + data['backoff']
+
+            if response.status_code == 200:
+                return data
+            if data.get('error_name') == 'throttle_violation':
+                # The message reads "... more requests available in N seconds"
+                match = re.search(r'(\d+) seconds', data.get('error_message', ''))
+                self.backoff_until = time.monotonic() + (int(match.group(1)) if match else 2 ** attempt)
+                continue
+            print(f"Request to {path} failed. Status code: {response.status_code}, "
+                  f"{data.get('error_name')}: {data.get('error_message')}")
+            self.failed_requests += 1
+            return None
+
+        print(f"Request to {path} failed after {self.max_retries} attempts.")
+        self.failed_requests += 1
+        return None
+
+    def iter_items(self, path, params, page=1, pages=None):
+        """Yields the items of consecutive pages, starting at page, until has_more is false or pages were read."""
+        last_page = page + pages - 1 if pages else None
+        while last_page is None or page <= last_page:
+            data = self.api_get(path, {**params, 'page': page})
+            if data is None:
+                return
+            yield from data.get('items', [])
+            if not data.get('has_more'):
+                return
+            page += 1
+
+    def fetch_top_questions(self, page=1, pages=1):
+        """Fetches the top voted questions, pagesize per page, from page on for the given number of pages."""
+        return self.fetch_questions(page=page, pages=pages, order='desc', sort='votes')
+
+    def fetch_questions(self, page=1, pages=1, convert=True, **params):
+        """Fetches questions with any /questions parameters (order, sort, fromdate, tagged, ...).
+
+        pages=None reads every page. With convert=False the bodies are left as HTML.
+        """
+        questions = list(self.iter_items(
+            "questions", {**params, 'pagesize': self.pagesize, 'filter': 'withbody'}, page, pages))
+        if convert:
             for question in questions:
                 question['body'] = self.format_question_body(
                     question.get('body', ''), question.get('link', '')
                 )
-            return questions
-        else:
-            print(f"Failed to fetch questions. Status code: {response.status_code}")
-            return []
+        return questions
+
+    def fetch_answers_for_questions(self, question_ids, convert=True):
+        """Fetches the answers of many questions, up to 100 question ids per request.
+
+        Returns a dict of question id -> answers, highest voted first. With convert=False the bodies are
+        left as HTML.
+        """
+        question_ids = list(dict.fromkeys(question_ids))
+        answers_by_question = {question_id: [] for question_id in question_ids}
+        for start in range(0, len(question_ids), MAX_IDS_PER_REQUEST):
+            ids = ";".join(str(question_id) for question_id in question_ids[start:start + MAX_IDS_PER_REQUEST])
+            params = {'order': 'desc', 'sort': 'votes', 'pagesize': MAX_PAGESIZE, 'filter': 'withbody'}
+            for answer in self.iter_items(f"questions/{ids}/answers", params):
+                if convert:
+                    answer['body'] = self.convert_html_to_markdown(answer.get('body', ''))
+                answers_by_question.setdefault(answer['question_id'], []).append(answer)
+        return answers_by_question
 
     def fetch_answers_for_question(self, question_id):
-        url = f"{self.base_url}questions/{question_id}/answers?order=desc&sort=votes&site={self.site}&filter=withbody"
-        response = requests.get(url)
-        if response.status_code == 200:
-            answers = response.json().get('items', [])
-            for answer in answers:
-                answer['body'] = self.convert_html_to_markdown(answer.get('body', ''))
-            return answers
-        else:
-            print(f"Failed to fetch answers for question {question_id}. Status code: {response.status_code}")
-            return []
+        return self.fetch_answers_for_questions([question_id])[question_id]
+
+    def quota_report(self):
+        return f"{self.requests_made} API requests, quota remaining {self.quota_remaining} of {self.quota_max}"
 
     def detect_language_from_tags(self, tags):
         """Detect the programming language based on tags."""
@@ -55,11 +148,12 @@ class StackExchangeFetcher:
 
     def format_question_body(self, html_content, question_link):
         """Convert HTML to plain text and append attribution footer."""
-        plain_text_body = self.convert_html_to_text(html_content)
-        footer = (
+        return self.convert_html_to_text(html_content) + self.attribution_footer(question_link)
+
+    def attribution_footer(self, question_link):
+        return (
             "\n" * 4 +
             f"This question was originally posted on StackExchange Code Review. \n"
             f"To view the original discussion, visit the {question_link}. \n"
             f"This content is licensed under the Creative Commons Attribution-ShareAlike license https://creativecommons.org/licenses/by-sa/4.0/."
         )
-        return plain_text_body + footer
@@ -0,0 +1,217 @@
+"""
+Local SQLite mirror of StackExchange questions and answers, kept up to date with delta syncs.
+
+The first sync seeds the mirror with the top voted questions. Every later sync asks only for questions with
+activity since the previous sync (sort=activity&fromdate=). New answers and answer edits also move the
+question's last_activity_date, so the answers are refetched only for those questions.
+Votes do not count as activity, so a mirrored score is the one seen at the question's last activity.
+A delta sync reads at most delta_pages pages. When it stops there, the cursor only moves up to the last
+activity it read, so the next sync continues from that point.
+
+Question bodies are stored as plain text and answer bodies as markdown, converted once per distinct HTML
+body. The conversions are keyed by a hash of the HTML, so a body that did not change is never converted
+again. Readers get the same question and answer dicts as from StackExchangeFetcher, with bodies already
+converted.
+
+Usage:
+    mirror = StackExchangeMirror("stackexchange_mirror.db", StackExchangeFetcher(pagesize=100))
+    mirror.sync(seed_pages=5)
+    questions = mirror.top_questions(limit=10)
+    answers_by_question = mirror.answers_for([question['question_id'] for question in questions])
+
+Dependencies:
+- requests
+- html2text
+- beautifulsoup4
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+
+# Pages read by one delta sync, oldest activity first
+DELTA_PAGES = 10
+
+class StackExchangeMirror:
+    def __init__(self, path, fetcher):
+        self.fetcher = fetcher
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conversions = 0
+        self.reused_conversions = 0
+        self.create_tables()
+
+    def create_tables(self):
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS questions (
+                question_id INTEGER PRIMARY KEY,
+                site TEXT NOT NULL,
+                title TEXT,
+                link TEXT,
+                tags TEXT,  -- JSON list
+                score INTEGER,
+                last_activity_date INTEGER,
+                body_hash TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_questions_site_score ON questions (site, score);
+            CREATE TABLE IF NOT EXISTS answers (
+                answer_id INTEGER PRIMARY KEY,
+                question_id INTEGER NOT NULL,
+                score INTEGER,
+                is_accepted INTEGER,
+                last_activity_date INTEGER,
+                body_hash TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_answers_question ON answers (question_id);
+            -- Converted bodies, keyed by a hash of the format and the HTML
+            CREATE TABLE IF NOT EXISTS bodies (
+                body_hash TEXT PRIMARY KEY,
+                converted TEXT
+            );
+            CREATE TABLE IF NOT EXISTS sync_state (
+                site TEXT PRIMARY KEY,
+                synced_until INTEGER  -- Unix time the last complete sync started at
+            );
+        ''')
+        self.conn.commit()
+
+    def convert(self, html_content, body_format):
+        """Returns the hash of the body, converting it to 'text' or 'markdown' only if it is not stored yet."""
+        body_hash = hashlib.sha256(f"{body_format}\0{html_content}".encode("utf-8")).hexdigest()
+        if self.conn.execute('SELECT 1 FROM bodies WHERE body_hash = ?', (body_hash,)).fetchone():
+            self.reused_conversions += 1
+            return body_hash
+        if body_format == 'text':
+            converted = self.fetcher.convert_html_to_text(html_content)
+        else:
+            converted = self.fetcher.convert_html_to_markdown(html_content)
+        self.conn.execute('INSERT INTO bodies (body_hash, converted) VALUES (?, ?)', (body_hash, converted))
+        self.conversions += 1
+        return body_hash
+
+    def changed_questions(self, questions):
+        """Returns the questions that are not mirrored yet or had activity since they were stored."""
+        changed = {}
+        for question in questions:
+            known = self.conn.execute('SELECT last_activity_date FROM questions WHERE question_id = ?',
+                                      (question['question_id'],)).fetchone()
+            if not known or known['last_activity_date'] != question.get('last_activity_date'):
+                changed[question['question_id']] = question  # Pages can overlap, the last copy wins
+        return list(changed.values())
+
+    def store_questions(self, questions):
+        """Upserts questions with HTML bodies."""
+        for question in questions:
+            body_hash = self.convert(question.get('body', ''), 'text')
+            self.conn.execute('''
+                INSERT INTO questions (question_id, site, title, link, tags, score, last_activity_date, body_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(question_id) DO UPDATE SET
+                    title = excluded.title, link = excluded.link, tags = excluded.tags, score = excluded.score,
+                    last_activity_date = excluded.last_activity_date, body_hash = excluded.body_hash
+            ''', (question['question_id'], self.fetcher.site, question.get('title'), question.get('link'),
+                  json.dumps(question.get('tags', [])), question.get('score'),
+                  question.get('last_activity_date'), body_hash))
+        self.conn.commit()
+
+    def store_answers(self, answers_by_question):
+        """Replaces the answers of the given questions with answers that have HTML bodies."""
+        for question_id, answers in answers_by_question.items():
+            self.conn.execute('DELETE FROM answers WHERE question_id = ?', (question_id,))
+            self.conn.executemany('''
+                INSERT OR REPLACE INTO answers (answer_id, question_id, score, is_accepted, last_activity_date, body_hash)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(answer['answer_id'], question_id, answer.get('score'), int(answer.get('is_accepted', False)),
+                   answer.get('last_activity_date'), self.convert(answer.get('body', ''), 'markdown'))
+                  for answer in answers])
+        self.conn.commit()
+
+    def synced_until(self):
+        row = self.conn.execute('SELECT synced_until FROM sync_state WHERE site = ?', (self.fetcher.site,)).fetchone()
+        return row['synced_until'] if row else None
+
+    def sync(self, seed_pages=1, delta_pages=DELTA_PAGES):
+        """Brings the mirror up to date, or closer to it. Returns the number of new or changed questions."""
+        started = int(time.time())
+        cursor = started
+        failed_before = self.fetcher.failed_requests
+        synced_until = self.synced_until()
+        if synced_until is None:
+            questions = self.fetcher.fetch_questions(pages=seed_pages, convert=False, order='desc', sort='votes')
+        else:
+            # fromdate is inclusive, so activity at the exact second of the last sync start is seen again
+            questions = self.fetcher.fetch_questions(pages=delta_pages, convert=False, order='asc', sort='activity',
+                                                     fromdate=synced_until)
+            if len(questions) >= delta_pages * self.fetcher.pagesize:
+                # Probably cut off at the page limit, later activity is left for the next sync
+                last_read = max(question.get('last_activity_date') or 0 for question in questions)
+                if last_read > synced_until:
+                    cursor = last_read
+                    print(f"Read the first {delta_pages} pages of activity, the next sync continues from there.")
+
+        changed = self.changed_questions(questions)
+        failed_before_answers = self.fetcher.failed_requests
+        answers_by_question = self.fetcher.fetch_answers_for_questions(
+            [question['question_id'] for question in changed], convert=False)
+        if self.fetcher.failed_requests != failed_before_answers:
+            # Storing the questions without all their answers would mark them as up to date
+            print("Fetching answers failed, nothing was stored. The next sync retries.")
+            return 0
+        self.store_questions(changed)
+        self.store_answers(answers_by_question)
+
+        # Only a sync without failed requests moves the cursor, otherwise the next one covers the gap again
+        if self.fetcher.failed_requests == failed_before:
+            self.conn.execute('''
+                INSERT INTO sync_state (site, synced_until) VALUES (?, ?)
+                ON CONFLICT(site) DO UPDATE SET synced_until = excluded.synced_until
+            ''', (self.fetcher.site, cursor))
+            self.conn.commit()
+        print(f"Synced {len(questions)} questions with activity, {len(changed)} new or changed. "
+              f"{self.conversions} bodies converted, {self.reused_conversions} reused. {self.fetcher.quota_report()}")
+        return len(changed)
+
+    def top_questions(self, limit=10):
+        """Returns the highest scored mirrored questions, shaped like StackExchangeFetcher.fetch_top_questions."""
+        rows = self.conn.execute('''
+            SELECT q.question_id, q.title, q.link, q.tags, q.score, q.last_activity_date, b.converted
+            FROM questions q JOIN bodies b ON b.body_hash = q.body_hash
+            WHERE q.site = ?
+            ORDER BY q.score DESC, q.question_id
+            LIMIT ?
+        ''', (self.fetcher.site, limit))
+        return [{
+            'question_id': row['question_id'],
+            'title': row['title'],
+            'link': row['link'],
+            'tags': json.loads(row['tags']),
+            'score': row['score'],
+            'last_activity_date': row['last_activity_date'],
+            'body': row['converted'] + self.fetcher.attribution_footer(row['link']),
+        } for row in rows]
+
+    def answers_for(self, question_ids):
+        """Returns a dict of question id -> answers with markdown bodies, highest voted first."""
+        answers_by_question = {question_id: [] for question_id in question_ids}
+        for start in range(0, len(question_ids), 500):
+            batch = question_ids[start:start + 500]
+            rows = self.conn.execute(f'''
+                SELECT a.answer_id, a.question_id, a.score, a.is_accepted, a.last_activity_date, b.converted
+                FROM answers a JOIN bodies b ON b.body_hash = a.body_hash
+                WHERE a.question_id IN ({",".join("?" for _ in batch)})
+                ORDER BY a.score DESC, a.answer_id
+            ''', batch)
+            for row in rows:
+                answers_by_question[row['question_id']].append({
+                    'answer_id': row['answer_id'],
+                    'question_id': row['question_id'],
+                    'score': row['score'],
+                    'is_accepted': bool(row['is_accepted']),
+                    'last_activity_date': row['last_activity_date'],
+                    'body': row['converted'],
+                })
+        return answers_by_question
+
+    def close(self):
+        self.conn.close()
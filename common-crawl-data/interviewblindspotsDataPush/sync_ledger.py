@@ -0,0 +1,94 @@
+"""
+Local record of what was already pushed to Interview Blindspots, kept in a small SQLite file.
+
+- snippets: StackExchange question id -> snippet id, with a hash of the title, text and language.
+- comments: per snippet, the key of each comment (for example the answer id) -> comment id, with a hash of
+  the comment. Comments without a key use their hash as the key.
+
+IBSConnector.sync_question uses it so a rerun creates only new snippets and comments, and updates only
+the ones whose content changed (or only reports them, with create_only). The ledger can be shared by the
+threads of IBSConnector.sync_questions.
+
+Usage:
+    ledger = SyncLedger("ibs_sync_ledger.db")
+    ledger.snippet_for(question_id)  # -> (snippet_id, content_hash) or None
+
+Dependencies:
+- None (sqlite3 from the standard library)
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+def content_hash(*parts):
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+class SyncLedger:
+    def __init__(self, path):
+        # Used from the sync threads, one at a time
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS snippets (
+                question_id INTEGER PRIMARY KEY,
+                snippet_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                pushed_at TIMESTAMP
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS comments (
+                snippet_id TEXT NOT NULL,
+                comment_key TEXT NOT NULL,
+                comment_id TEXT,
+                content_hash TEXT NOT NULL,
+                pushed_at TIMESTAMP,
+                PRIMARY KEY (snippet_id, comment_key)
+            )
+        ''')
+        self.conn.commit()
+
+    def snippet_for(self, question_id):
+        with self._lock:
+            return self.conn.execute(
+                'SELECT snippet_id, content_hash FROM snippets WHERE question_id = ?', (question_id,)).fetchone()
+
+    def record_snippet(self, question_id, snippet_id, snippet_hash):
+        with self._lock:
+            self.conn.execute('''
+                INSERT INTO snippets (question_id, snippet_id, content_hash, pushed_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(question_id) DO UPDATE SET
+                    snippet_id = excluded.snippet_id, content_hash = excluded.content_hash, pushed_at = excluded.pushed_at
+            ''', (question_id, str(snippet_id), snippet_hash, datetime.now()))
+            self.conn.commit()
+
+    def comments_for(self, snippet_id):
+        """Returns {comment_key: (comment_id, content_hash)} for a snippet."""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT comment_key, comment_id, content_hash FROM comments WHERE snippet_id = ?', (str(snippet_id),))
+            return {key: (comment_id, comment_hash) for key, comment_id, comment_hash in rows}
+
+    def record_comments(self, snippet_id, comments):
+        """Records pushed comments, a list of (comment_key, comment_id, content_hash)."""
+        now = datetime.now()
+        with self._lock:
+            self.conn.executemany('''
+                INSERT INTO comments (snippet_id, comment_key, comment_id, content_hash, pushed_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(snippet_id, comment_key) DO UPDATE SET
+                    comment_id = excluded.comment_id, content_hash = excluded.content_hash, pushed_at = excluded.pushed_at
+            ''', [(str(snippet_id), str(key), None if comment_id is None else str(comment_id), comment_hash, now)
+                  for key, comment_id, comment_hash in comments])
+            self.conn.commit()
+
+    def forget_snippet(self, snippet_id):
+        with self._lock:
+            self.conn.execute('DELETE FROM comments WHERE snippet_id = ?', (str(snippet_id),))
+            self.conn.execute('DELETE FROM snippets WHERE snippet_id = ?', (str(snippet_id),))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
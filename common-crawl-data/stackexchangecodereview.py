@@ -1,25 +1,16 @@
-import requests
+import os
+import sys
 
-def fetch_top_questions(site='codereview', page=1, pagesize=10):
-    url = f"https://api.stackexchange.com/2.3/questions?order=desc&sort=votes&site={site}&page={page}&pagesize={pagesize}&filter=!9_bDE(fI5"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json().get('items', [])
-    else:
-        print(f"Failed to fetch questions. Status code: {response.status_code}")
-        return []
-
-def fetch_answers_for_question(question_id, site='codereview'):
-    url = f"https://api.stackexchange.com/2.3/questions/{question_id}/answers?order=desc&sort=votes&site={site}&filter=!9_bDE(fI5"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json().get('items', [])
-    else:
-        print(f"Failed to fetch answers for question {question_id}. Status code: {response.status_code}")
-        return []
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "interviewblindspotsDataPush"))
+from stackexchange_fetcher import StackExchangeFetcher
+from stackexchange_mirror import StackExchangeMirror
 
 def main():
-    top_questions = fetch_top_questions()
+    # Read from the local mirror, which only fetches and converts what changed since the last run
+    mirror = StackExchangeMirror(os.getenv("SE_MIRROR", "stackexchange_mirror.db"), StackExchangeFetcher(pagesize=100))
+    mirror.sync()
+    top_questions = mirror.top_questions(limit=10)
+    answers_by_question = mirror.answers_for([question['question_id'] for question in top_questions])
     
     for idx, question in enumerate(top_questions, start=1):
         title = question.get('title')
@@ -29,7 +20,7 @@ def main():
         print(f"Question {idx}: {title}")
         print(f"Link: {link}")
         
-        answers = fetch_answers_for_question(question_id)
+        answers = answers_by_question.get(question_id, [])
         if answers:
             print("Answers:")
             for answer in answers:
@@ -38,6 +29,7 @@ def main():
         else:
             print("No answers found.")
         print("\n" + "-"*80 + "\n")
+    mirror.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# The scripts import each other as top-level modules, as when they are run from their own directory
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [BASE_DIR, os.path.join(BASE_DIR, "image_description"),
+                os.path.join(BASE_DIR, "interviewblindspotsDataPush")]
+
+QUEUE_ENTRIES = 20
+
+@pytest.fixture
+def queue_app(tmp_path, monkeypatch, capsys):
+    """The app module serving a fresh table of QUEUE_ENTRIES pending entries."""
+    from load_test import create_database
+    import app as app_module
+
+    database = str(tmp_path / "queue.db")
+    create_database(database, "entries", QUEUE_ENTRIES)
+    monkeypatch.setattr(app_module, "DATABASE", database)
+    monkeypatch.setattr(app_module, "TABLE_NAME", "entries")
+    app_module.ensure_schema()
+    capsys.readouterr()  # The table setup prints a line per step
+    yield app_module
+
+    # The connection of the test thread would otherwise be reused by the next test
+    conn = getattr(app_module._thread_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        app_module._thread_local.conn = None
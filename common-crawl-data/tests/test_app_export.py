@@ -0,0 +1,51 @@
+import csv
+import gzip
+import io
+
+from conftest import QUEUE_ENTRIES
+
+def export(client, etag=None, **headers):
+    """Reads the whole export and closes the response, which closes its database connection as a server would."""
+    if etag:
+        headers["If-None-Match"] = etag
+    response = client.get("/export", headers={key.replace("_", "-"): value for key, value in headers.items()})
+    response.get_data()
+    response.close()
+    return response
+
+def test_export_streams_every_row_as_csv(queue_app):
+    response = export(queue_app.app.test_client())
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert response.status_code == 200
+    assert [int(row["id"]) for row in rows] == list(range(1, QUEUE_ENTRIES + 1))
+
+def test_unchanged_table_answers_304(queue_app):
+    client = queue_app.app.test_client()
+    etag = export(client).headers["ETag"]
+
+    response = export(client, etag)
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+def test_claims_keep_the_etag_and_results_change_it(queue_app):
+    client = queue_app.app.test_client()
+    etag = export(client).headers["ETag"]
+
+    # Claiming only touches the lock bookkeeping, which is not exported
+    entries = client.get("/get_entries", query_string={"limit": 1}).get_json()
+    assert export(client, etag).status_code == 304
+
+    client.post("/update_entries", json={"lease_token": entries[0]["lease_token"],
+                                         "entries": [{"id": entries[0]["id"], "caption": "a caption"}]})
+    response = export(client, etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+def test_gzip_export_has_its_own_etag(queue_app):
+    client = queue_app.app.test_client()
+    plain = export(client)
+    compressed = export(client, Accept_Encoding="gzip")
+
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["ETag"] != plain.headers["ETag"]
+    assert gzip.decompress(compressed.get_data()) == plain.get_data()
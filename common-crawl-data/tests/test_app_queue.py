@@ -0,0 +1,111 @@
+import threading
+
+from conftest import QUEUE_ENTRIES
+
+def claim(client, limit):
+    response = client.get("/get_entries", query_string={"limit": limit})
+    assert response.status_code == 200
+    return response.get_json(), response.headers.get("X-Lease-Token")
+
+def post(client, lease_token, entries):
+    response = client.post("/update_entries", json={"lease_token": lease_token, "entries": entries})
+    assert response.status_code == 200
+    return response.get_json()
+
+def result(entry_id):
+    return {"id": entry_id, "caption": f"caption {entry_id}"}
+
+def test_claim_locks_a_batch_under_one_lease_token(queue_app):
+    client = queue_app.app.test_client()
+    first, first_token = claim(client, 5)
+    second, second_token = claim(client, 5)
+
+    assert len(first) == len(second) == 5
+    assert {entry["lease_token"] for entry in first} == {first_token}
+    assert {entry["lease_token"] for entry in second} == {second_token}
+    assert first_token != second_token
+    assert not {entry["id"] for entry in first} & {entry["id"] for entry in second}
+
+def test_concurrent_claims_hand_out_every_entry_once(queue_app):
+    from load_test import start_server
+    import requests
+
+    server, base_url = start_server(queue_app.app)
+    claimed = []
+
+    def run_client():
+        session = requests.Session()
+        while True:
+            entries = session.get(f"{base_url}/get_entries", params={"limit": 3}, timeout=30).json()
+            if not entries:
+                return
+            claimed.extend(entry["id"] for entry in entries)
+
+    clients = [threading.Thread(target=run_client) for _ in range(8)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    server.shutdown()
+
+    assert sorted(claimed) == list(range(1, QUEUE_ENTRIES + 1))
+
+def test_update_checks_the_lease_token_of_every_entry(queue_app):
+    client = queue_app.app.test_client()
+    entries, lease_token = claim(client, 2)
+    claimed_id, other_id = entries[0]["id"], entries[1]["id"]
+
+    outcome = post(client, "not-the-lease", [result(claimed_id)])
+    assert outcome["results"] == [{"id": claimed_id, "status": "lease_mismatch",
+                                   "error": "Lease token does not match, the entry was claimed again."}]
+
+    outcome = post(client, lease_token, [result(claimed_id), result(QUEUE_ENTRIES)])
+    assert outcome["updated"] == 1
+    assert [entry["status"] for entry in outcome["results"]] == ["updated", "not_claimed"]
+
+    # An updated entry is no longer held, posting it again is rejected
+    outcome = post(client, lease_token, [result(claimed_id), result(other_id)])
+    assert [entry["status"] for entry in outcome["results"]] == ["not_claimed", "updated"]
+
+def test_expired_lease_is_claimed_again_and_the_old_token_rejected(queue_app, monkeypatch):
+    client = queue_app.app.test_client()
+    entries, old_token = claim(client, QUEUE_ENTRIES)
+    assert claim(client, 1)[0] == []
+
+    monkeypatch.setattr(queue_app, "LEASE_TTL_SECONDS", -1)
+    reclaimed, new_token = claim(client, 1)
+    assert reclaimed[0]["claim_count"] == 2
+
+    outcome = post(client, old_token, [result(reclaimed[0]["id"])])
+    assert outcome["results"][0]["status"] == "lease_mismatch"
+    assert post(client, new_token, [result(reclaimed[0]["id"])])["updated"] == 1
+
+def test_update_applies_a_repeated_id_once(queue_app):
+    client = queue_app.app.test_client()
+    entries, lease_token = claim(client, 1)
+    entry_id = entries[0]["id"]
+
+    outcome = post(client, lease_token, [result(entry_id), {**result(entry_id), "caption": "second"}])
+    assert [entry["status"] for entry in outcome["results"]] == ["updated", "invalid"]
+    caption = queue_app.get_db_connection().execute(
+        "SELECT caption FROM entries WHERE id = ?", (entry_id,)).fetchone()[0]
+    assert caption == f"caption {entry_id}"
+
+def test_update_accepts_gzip_ndjson_and_caps_the_inflated_size(queue_app, monkeypatch):
+    import gzip
+    import json
+
+    client = queue_app.app.test_client()
+    entries, lease_token = claim(client, 2)
+    body = "".join(json.dumps(result(entry["id"])) + "\n" for entry in entries)
+    headers = {"Content-Encoding": "gzip", "X-Lease-Token": lease_token}
+
+    response = client.post("/update_entries", data=gzip.compress(body.encode()), headers=headers,
+                           content_type="application/x-ndjson")
+    assert response.get_json()["updated"] == 2
+
+    # A small gzip body can inflate far beyond MAX_BODY_BYTES, it is cut off while reading
+    monkeypatch.setattr(queue_app, "MAX_BODY_BYTES", 1000)
+    response = client.post("/update_entries", data=gzip.compress(b"\n" * 100000), headers=headers,
+                           content_type="application/x-ndjson")
+    assert response.status_code == 413
@@ -0,0 +1,30 @@
+import sqlite3
+
+def retitle(app_module, ids, title, article_url):
+    conn = sqlite3.connect(app_module.DATABASE)
+    conn.executemany(f"UPDATE {app_module.TABLE_NAME} SET article_title = ?, article_url = ? WHERE id = ?",
+                     [(title, article_url, i) for i in ids])
+    conn.commit()
+    conn.close()
+
+def test_search_matches_the_article_url(queue_app):
+    retitle(queue_app, [3, 7], "Tide tables", "https://harbour.example.org/tides/")
+    client = queue_app.app.test_client()
+
+    page = client.get("/api/images?q=harbour").get_json()
+    assert [item["id"] for item in page["items"]] == [3, 7]
+    assert page["next_cursor"] is None
+    assert client.get("/api/images?q=nowhere").get_json()["items"] == []
+
+def test_titles_count_every_matching_image(queue_app):
+    retitle(queue_app, [3, 7, 9], "Tide tables", "https://harbour.example.org/tides/")
+    client = queue_app.app.test_client()
+
+    # Counted over every image, not over one page of /api/images
+    response = client.get("/api/titles")
+    assert response.headers["Access-Control-Allow-Origin"] == "*"
+    assert response.get_json()["titles"] == [
+        {"article_title": "Example", "count": 17},
+        {"article_title": "Tide tables", "count": 3},
+    ]
+    assert client.get("/api/titles?q=tide").get_json()["titles"] == [{"article_title": "Tide tables", "count": 3}]
@@ -0,0 +1,11 @@
+from benchmark_pipeline import run_in_fresh_process
+
+def test_queue_stage_claims_every_entry_without_errors(tmp_path):
+    config = {"queue_entries": 200, "queue_batch_size": 16, "queue_clients": 4}
+    # A fresh process, as the benchmark runs it, so the stage's chdir and app import stay out of this one
+    result = run_in_fresh_process("queue", str(tmp_path), config)
+
+    assert "error" not in result and "skipped" not in result, result
+    assert result["records"] == config["queue_entries"]
+    assert result["errors"] == 0
+    assert result["gave_up"] == 0
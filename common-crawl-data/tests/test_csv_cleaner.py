@@ -0,0 +1,86 @@
+import os
+
+import pandas as pd
+import pytest
+
+import CSVCleaner
+import RemoveEmptyBWRatio
+
+ROWS = [
+    # id, urlkey, article_title, image_url, image_alt, article_url
+    (1, "k1", " Title one ", "https://example.com/a.png", "alt a", "https://example.com/post/index.html"),
+    (2, "k2", "Title two", "img/b.png", "alt b", "https://example.com/post/index.html"),
+    (3, "k3", "Title three", "./img/b.png", "alt b", "https://example.com/post/"),
+    (4, "k4", "Title four", "../c.png", "", "https://example.com/post/deep/page.html"),
+    (5, "k5", "Title five", "", "alt e", "https://example.com/post/"),
+    (6, "k6", "Title six", "/d.png", "alt d", "https://example.com/post/"),
+    (7, "k7", "Title seven", "https://example.com/a.png", " alt a ", "https://example.com/other/"),
+    (8, "k8", "Title eight", "https://example.com/c.png", "", "https://example.com/"),
+]
+
+@pytest.fixture
+def input_csv(tmp_path):
+    path = tmp_path / "images.csv"
+    pd.DataFrame(ROWS, columns=["id", "urlkey", "article_title", "image_url", "image_alt", "article_url"]).to_csv(
+        path, index=False)
+    return str(path)
+
+def test_relative_urls_are_resolved_and_duplicates_removed(input_csv):
+    CSVCleaner.process_csv(input_csv)
+    df = pd.read_csv(os.path.splitext(input_csv)[0] + "_updated.csv")
+
+    # k3 repeats k2 once resolved, k7 repeats k1 once trimmed and k5 has no image_url
+    assert df["id"].tolist() == [1, 2, 3, 4, 5]
+    assert df["urlkey"].tolist() == ["k1", "k2", "k4", "k6", "k8"]
+    assert df["image_url"].tolist() == [
+        "https://example.com/a.png",
+        "https://example.com/post/img/b.png",
+        "https://example.com/post/c.png",
+        "https://example.com/d.png",
+        "https://example.com/c.png",
+    ]
+    assert df["article_title"][0] == "Title one"
+
+@pytest.mark.parametrize("chunksize", [1, 3, 100])
+def test_chunked_output_is_identical(input_csv, tmp_path, chunksize):
+    CSVCleaner.process_csv(input_csv)
+    expected = open(os.path.splitext(input_csv)[0] + "_updated.csv", "rb").read()
+
+    chunked_csv = str(tmp_path / "chunked.csv")
+    os.rename(input_csv, chunked_csv)
+    CSVCleaner.process_csv_chunked(chunked_csv, chunksize=chunksize)
+    assert open(str(tmp_path / "chunked_updated.csv"), "rb").read() == expected
+
+def test_failed_chunked_run_keeps_the_previous_output(input_csv, monkeypatch):
+    output_csv = os.path.splitext(input_csv)[0] + "_updated.csv"
+    with open(output_csv, "w") as f:
+        f.write("previous run\n")
+
+    clean_rows = CSVCleaner.clean_rows
+    calls = []
+    def failing_clean_rows(df, *args):
+        calls.append(len(df))
+        if len(calls) == 2:
+            raise RuntimeError("stopped")
+        return clean_rows(df, *args)
+    monkeypatch.setattr(CSVCleaner, "clean_rows", failing_clean_rows)
+
+    with pytest.raises(RuntimeError):
+        CSVCleaner.process_csv_chunked(input_csv, chunksize=3)
+    assert open(output_csv).read() == "previous run\n"
+    assert not os.path.exists(output_csv + ".part")
+
+def test_bw_ratio_chunked_output_is_identical(tmp_path):
+    input_csv = str(tmp_path / "ratios.csv")
+    pd.DataFrame({
+        "id": range(1, 8),
+        "image_url": [f"https://example.com/{n}.png" for n in range(7)],
+        "bw_ratio": [0.5, None, 0.1, None, None, 0.9, 0.0],
+    }).to_csv(input_csv, index=False)
+
+    RemoveEmptyBWRatio.remove_empty_bw_ratio(input_csv, str(tmp_path / "whole.csv"))
+    RemoveEmptyBWRatio.remove_empty_bw_ratio_chunked(input_csv, str(tmp_path / "chunked.csv"), chunksize=2)
+    whole = open(str(tmp_path / "whole.csv"), "rb").read()
+    assert open(str(tmp_path / "chunked.csv"), "rb").read() == whole
+    assert pd.read_csv(str(tmp_path / "whole.csv"))["id"].tolist() == [1, 2, 3, 4]
+    assert sorted(os.listdir(tmp_path)) == ["chunked.csv", "ratios.csv", "whole.csv"]
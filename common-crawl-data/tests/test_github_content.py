@@ -0,0 +1,47 @@
+import pytest
+
+from GetGithubContent import ERROR, NOT_FOUND, OK, BlobLocation, FileResult, fetch_github_file, parse_blob_url
+
+def test_parse_blob_url_splits_owner_repo_ref_and_path():
+    assert parse_blob_url("https://github.com/owner/repo/blob/main/src/app.py") == \
+        BlobLocation("owner", "repo", "main", "src/app.py")
+    assert parse_blob_url("https://github.com/owner/repo/raw/v1.0/README%20old.md") == \
+        BlobLocation("owner", "repo", "v1.0", "README old.md")
+
+@pytest.mark.parametrize("url", [
+    "https://github.com/owner/repo/blob/main/../../../etc/passwd",
+    "https://github.com/owner/repo/blob/main/%2e%2e/%2e%2e/etc/passwd",
+    "https://github.com/owner/repo/blob/main/docs%2F..%2F..%2Fsecret",
+    "https://github.com/owner/repo/blob/main/..%5C..%5Csecret",
+    "https://github.com/owner/../blob/main/file.txt",
+    "https://github.com/owner/repo/blob/./file.txt",
+    "https://github.com/owner/repo/blob/main/a//b.txt",
+    "https://github.com/owner/repo/blob/main/file%00.txt",
+])
+def test_parse_blob_url_rejects_segments_that_climb_out_of_the_output_dir(url):
+    assert parse_blob_url(url) is None
+
+@pytest.mark.parametrize("url", [
+    "https://gitlab.com/owner/repo/blob/main/file.txt",
+    "https://github.com/owner/repo/tree/main/src",
+    "https://github.com/owner/repo",
+])
+def test_parse_blob_url_rejects_other_urls(url):
+    assert parse_blob_url(url) is None
+
+class StubFetcher:
+    def __init__(self, result):
+        self.result = result
+
+    def fetch_files(self, urls):
+        return {url: self.result._replace(url=url) for url in urls}
+
+@pytest.mark.parametrize("result, expected", [
+    (FileResult(None, OK, b"contents", "raw", None), "contents"),
+    (FileResult(None, NOT_FOUND, None, "raw", "404 Not Found"), "Failed to fetch file: 404"),
+    (FileResult(None, ERROR, None, "raw", "HTTP 500"), "Failed to fetch file: 500"),
+    (FileResult(None, ERROR, None, "raw", "Connection refused"), "An error occurred: Connection refused"),
+])
+def test_fetch_github_file_still_returns_a_string(result, expected):
+    url = "https://github.com/owner/repo/blob/main/file.txt"
+    assert fetch_github_file(url, StubFetcher(result)) == expected
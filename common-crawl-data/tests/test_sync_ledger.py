@@ -0,0 +1,92 @@
+import itertools
+import threading
+
+import pytest
+
+from ibs_connector import IBSConnector
+from sync_ledger import SyncLedger
+
+class RecordingConnector(IBSConnector):
+    """Answers every request locally and records it instead of calling the API."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__("token", *args, **kwargs)
+        self.requests = []
+        self._ids = itertools.count(1)
+        self._requests_lock = threading.Lock()
+
+    def send_request(self, endpoint, payload=None, method='POST'):
+        with self._requests_lock:
+            self.requests.append((method, endpoint, payload))
+            return {"id": next(self._ids)} if method == 'POST' else {"id": endpoint.split("/")[1]}
+
+def comment_texts(requests):
+    return [payload["text"] for method, endpoint, payload in requests if endpoint == "comments/"]
+
+@pytest.fixture
+def ledger_path(tmp_path):
+    return str(tmp_path / "ledger.db")
+
+COMMENTS = [
+    {"line": 1, "text": "first", "key": 11},
+    {"line": 2, "text": "second", "key": 12},
+    {"line": 3, "text": "third"},
+]
+
+def test_rerun_pushes_nothing(ledger_path):
+    first = RecordingConnector(ledger_path=ledger_path)
+    snippet_id = first.sync_question(1, "title", "text", COMMENTS)
+    assert [endpoint for _, endpoint, _ in first.requests] == ["snippets/"] + ["comments/"] * 3
+    assert comment_texts(first.requests) == ["first", "second", "third"]
+
+    rerun = RecordingConnector(ledger_path=ledger_path)
+    assert rerun.sync_question(1, "title", "text", COMMENTS) == snippet_id
+    assert rerun.requests == []
+
+def test_changed_content_is_patched_and_new_comments_added(ledger_path):
+    RecordingConnector(ledger_path=ledger_path).sync_question(1, "title", "text", COMMENTS)
+
+    edited = [dict(COMMENTS[0], text="first, edited"), COMMENTS[1], COMMENTS[2], {"line": 4, "text": "fourth"}]
+    rerun = RecordingConnector(ledger_path=ledger_path)
+    rerun.sync_question(1, "new title", "text", edited)
+    assert [(method, endpoint) for method, endpoint, _ in rerun.requests] == [
+        ("PATCH", "snippets/1/"), ("POST", "comments/"), ("PATCH", "comments/2/")]
+    assert rerun.requests[1][2]["text"] == "fourth"
+    assert rerun.requests[2][2]["text"] == "first, edited"
+
+    assert RecordingConnector(ledger_path=ledger_path).sync_question(1, "new title", "text", edited) == "1"
+
+def test_create_only_reports_changes_without_patching(ledger_path, capsys):
+    RecordingConnector(ledger_path=ledger_path).sync_question(1, "title", "text", COMMENTS)
+
+    edited = [dict(COMMENTS[0], text="first, edited")] + COMMENTS[1:]
+    rerun = RecordingConnector(ledger_path=ledger_path, create_only=True)
+    rerun.sync_question(1, "new title", "text", edited)
+    assert rerun.requests == []
+    assert "left as it is" in capsys.readouterr().out
+
+def test_unkeyed_comments_are_keyed_by_their_content(ledger_path):
+    RecordingConnector(ledger_path=ledger_path).sync_question(1, "title", "text", COMMENTS)
+
+    # An unkeyed comment that changed is a different comment, so it is added rather than patched
+    edited = COMMENTS[:2] + [{"line": 3, "text": "third, edited"}]
+    rerun = RecordingConnector(ledger_path=ledger_path)
+    rerun.sync_question(1, "title", "text", edited)
+    assert [(method, endpoint) for method, endpoint, _ in rerun.requests] == [("POST", "comments/")]
+    assert len(SyncLedger(ledger_path).comments_for("1")) == 4
+
+def test_sync_questions_keeps_comment_order_within_each_snippet(ledger_path):
+    connector = RecordingConnector(max_workers=4, ledger_path=ledger_path)
+    questions = [
+        {"question_id": q, "title": f"q{q}", "text": "text",
+         "comments": [{"line": n, "text": f"q{q} c{n}", "key": q * 100 + n} for n in range(5)]}
+        for q in range(8)
+    ]
+    snippet_ids = connector.sync_questions(questions)
+    assert len(set(snippet_ids)) == 8
+
+    for q, snippet_id in enumerate(snippet_ids):
+        posted = [payload["text"] for method, endpoint, payload in connector.requests
+                  if endpoint == "comments/" and payload["snippetId"] == snippet_id]
+        assert posted == [f"q{q} c{n}" for n in range(5)]
+    assert RecordingConnector(ledger_path=ledger_path).sync_questions(questions) == snippet_ids
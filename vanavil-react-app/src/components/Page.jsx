@@ -1,18 +1,21 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useMemo } from "react";
 import Papa from "papaparse";
 import Card from "./Card";
-import Pagination from "./Pagination";
 import Masonry from "react-masonry-css";
 import "./Page.css";
 import { useParams } from "react-router-dom";
 import SearchBar from "./SearchBar";
-import InputLabel from "@mui/material/InputLabel";
+import Button from "@mui/material/Button";
 import MenuItem from "@mui/material/MenuItem";
 import FormControl from "@mui/material/FormControl";
 import Select from "@mui/material/Select";
 import WordCloudComponent from "./WordCloudComponent";
+import datasetApiMapping from "../datasetApiMapping";
 import csvFileMapping from "../csvFileMapping.json";
 
+// Milliseconds to wait after the last keystroke before searching
+const SEARCH_DELAY = 300;
+
 const shuffleArray = (array) => {
   for (let i = array.length - 1; i > 0; i--) {
     const j = Math.floor(Math.random() * (i + 1));
@@ -22,71 +25,129 @@ const shuffleArray = (array) => {
 };
 
 const Page = () => {
-  const [data, setData] = useState([]);
-  const [filteredData, setFilteredData] = useState([]);
+  const [items, setItems] = useState([]);
+  // cursors[i] is the ?after= value of page i, the API pages by id instead of by offset
+  const [cursors, setCursors] = useState([0]);
   const [currentPage, setCurrentPage] = useState(0);
+  const [nextCursor, setNextCursor] = useState(null);
+  // Titles of every image matching the search with their image counts, for the word cloud
+  const [titleCounts, setTitleCounts] = useState([]);
+  // Every row of the static CSV, only used for a dataset without an API
+  const [csvRows, setCsvRows] = useState([]);
   const [itemsPerPage, setItemsPerPage] = useState(
     parseInt(localStorage.getItem("itemsPerPage")) || 50
   );
   const [searchQuery, setSearchQuery] = useState("");
+  const [debouncedQuery, setDebouncedQuery] = useState("");
   const { csv } = useParams();
+  const apiUrl = datasetApiMapping[csv];
+
+  useEffect(() => {
+    localStorage.setItem("itemsPerPage", itemsPerPage);
+  }, [itemsPerPage]);
+
+  useEffect(() => {
+    const timeout = setTimeout(() => setDebouncedQuery(searchQuery), SEARCH_DELAY);
+    return () => clearTimeout(timeout);
+  }, [searchQuery]);
 
+  // Start from the first page whenever the dataset, the search or the page size changes
   useEffect(() => {
+    setCursors([0]);
+    setCurrentPage(0);
+  }, [csv, debouncedQuery, itemsPerPage]);
+
+  useEffect(() => {
+    if (apiUrl || !csvFileMapping[csv]) return;
+    setCsvRows([]);
     fetch(`/data/${csvFileMapping[csv]}`)
       .then((response) => response.text())
       .then((text) => {
         Papa.parse(text, {
           header: true,
           dynamicTyping: true,
-          complete: (result) => {
-            const shuffledData = shuffleArray(result.data);
-            setData(shuffledData);
-            setFilteredData(shuffledData);
-          },
+          complete: (result) => setCsvRows(shuffleArray(result.data)),
         });
       })
       .catch((error) => {
         console.error("Error fetching and parsing CSV file:", error);
       });
-  }, [csv]);
+  }, [csv, apiUrl]);
 
   useEffect(() => {
-    localStorage.setItem("itemsPerPage", itemsPerPage);
-  }, [itemsPerPage]);
+    if (!apiUrl) return;
+    const params = new URLSearchParams({
+      limit: itemsPerPage,
+      after: cursors[currentPage] ?? 0,
+    });
+    if (debouncedQuery.trim()) params.set("q", debouncedQuery.trim());
+
+    // Ignore the answer of a request that a newer one has replaced
+    const controller = new AbortController();
+    fetch(`${apiUrl}/api/images?${params}`, { signal: controller.signal })
+      .then((response) => response.json())
+      .then((page) => {
+        setItems(page.items);
+        setNextCursor(page.next_cursor);
+      })
+      .catch((error) => {
+        if (error.name !== "AbortError") {
+          console.error("Error fetching images:", error);
+        }
+      });
+    return () => controller.abort();
+  }, [apiUrl, debouncedQuery, itemsPerPage, cursors, currentPage]);
 
   useEffect(() => {
-    if (!data) return;
-    const filtered = data.filter(
+    if (!apiUrl) return;
+    const params = new URLSearchParams();
+    if (debouncedQuery.trim()) params.set("q", debouncedQuery.trim());
+
+    const controller = new AbortController();
+    fetch(`${apiUrl}/api/titles?${params}`, { signal: controller.signal })
+      .then((response) => response.json())
+      .then((result) => setTitleCounts(result.titles))
+      .catch((error) => {
+        if (error.name !== "AbortError") {
+          console.error("Error fetching titles:", error);
+        }
+      });
+    return () => controller.abort();
+  }, [apiUrl, debouncedQuery]);
+
+  const filteredRows = useMemo(() => {
+    const query = debouncedQuery.toLowerCase();
+    return csvRows.filter(
       (item) =>
-        item?.image_alt?.toLowerCase().includes(searchQuery?.toLowerCase()) ||
-        String(item?.article_title)
-          ?.toLowerCase()
-          .includes(searchQuery?.toLowerCase()) ||
-        item?.article_url?.toLowerCase().includes(searchQuery?.toLowerCase())
+        item?.image_alt?.toLowerCase().includes(query) ||
+        String(item?.article_title)?.toLowerCase().includes(query) ||
+        item?.article_url?.toLowerCase().includes(query)
     );
-    setFilteredData(filtered);
-    setCurrentPage(0); // Reset to first page on new search
-  }, [searchQuery, data]);
+  }, [csvRows, debouncedQuery]);
 
-  const handlePageClick = (event) => {
-    setCurrentPage(event.selected);
+  const offset = currentPage * itemsPerPage;
+  const pageItems = apiUrl ? items : filteredRows.slice(offset, offset + itemsPerPage);
+  const hasNextPage = apiUrl ? nextCursor !== null : offset + itemsPerPage < filteredRows.length;
+
+  const handleNextPage = () => {
+    if (apiUrl) {
+      setCursors((previous) => [...previous.slice(0, currentPage + 1), nextCursor]);
+    }
+    setCurrentPage(currentPage + 1);
+  };
+
+  const handlePreviousPage = () => {
+    setCurrentPage(currentPage - 1);
   };
 
   const handleItemsPerPageChange = (event) => {
     setItemsPerPage(parseInt(event.target.value));
-    setCurrentPage(0); // Reset to first page
   };
 
   const handleSearchChange = (event) => {
-    console.log("searching");
-    console.log(event.target.value);
     setSearchQuery(event.target.value);
   };
 
-  const offset = currentPage * itemsPerPage;
-  const currentData = filteredData.slice(offset, offset + itemsPerPage);
-  const pageCount = Math.ceil(filteredData.length / itemsPerPage);
-
   // Define breakpoints for masonry layout
   const breakpointColumnsObj = {
     default: 4,
@@ -100,7 +161,7 @@ const Page = () => {
       <div className="left-column">
         <h1>Word Cloud</h1>
         <SearchBar value={searchQuery} onChange={handleSearchChange} />
-        <WordCloudComponent data={filteredData} />
+        <WordCloudComponent data={apiUrl ? titleCounts : filteredRows} />
       </div>
       <div className="right-column">
         <h1>Image Gallery</h1>
@@ -133,11 +194,19 @@ const Page = () => {
           className="my-masonry-grid"
           columnClassName="my-masonry-grid_column"
         >
-          {currentData.map((item, index) => (
-            <Card key={index} image={item} />
+          {pageItems.map((item, index) => (
+            <Card key={item.id ?? index} image={item} />
           ))}
         </Masonry>
-        <Pagination pageCount={pageCount} onPageChange={handlePageClick} />
+        <div className="pagination">
+          <Button onClick={handlePreviousPage} disabled={currentPage === 0}>
+            previous
+          </Button>
+          <span style={{ alignSelf: "center" }}>page {currentPage + 1}</span>
+          <Button onClick={handleNextPage} disabled={!hasNextPage}>
+            next
+          </Button>
+        </div>
       </div>
     </div>
   );
@@ -1,24 +0,0 @@
-// src/components/Pagination.js
-
-import React from 'react';
-import ReactPaginate from 'react-paginate';
-
-const Pagination = ({ pageCount, onPageChange }) => {
-  return (
-    <ReactPaginate
-      previousLabel={'previous'}
-      nextLabel={'next'}
-      breakLabel={'...'}
-      breakClassName={'break-me'}
-      pageCount={pageCount}
-      marginPagesDisplayed={2}
-      pageRangeDisplayed={5}
-      onPageChange={onPageChange}
-      containerClassName={'pagination'}
-      subContainerClassName={'pages pagination'}
-      activeClassName={'active'}
-    />
-  );
-};
-
-export default Pagination;
@@ -8,12 +8,14 @@ const WordCloudComponent = ({ data, onWordClick }) => {
 
   useEffect(() => {
     if (!data) return;
-    const titles = data.map(item => item.article_title).join(' ');
-    const filteredWords = removeStopwords(titles.split(' '));
-    const wordCount = filteredWords.reduce((acc, word) => {
-      acc[word] = (acc[word] || 0) + 1;
-      return acc;
-    }, {});
+    // A title from /api/titles stands for `count` images, a CSV row for one
+    const wordCount = {};
+    data.forEach(item => {
+      const words = removeStopwords(String(item.article_title ?? '').split(' '));
+      words.forEach(word => {
+        wordCount[word] = (wordCount[word] || 0) + (item.count || 1);
+      });
+    });
     const wordArray = Object.keys(wordCount).map(word => ({
       text: word,
       value: wordCount[word],
@@ -0,0 +1,9 @@
+// Base URL of the app.py instance serving each dataset, set at build time, for example
+// REACT_APP_STANFORD_API_URL=https://vanavil.example.org/stanford npm run build
+// A dataset without one is read from its static CSV in public/data (csvFileMapping.json) instead.
+const datasetApiMapping = {
+  ncsu: process.env.REACT_APP_NCSU_API_URL,
+  stanford: process.env.REACT_APP_STANFORD_API_URL,
+};
+
+export default datasetApiMapping;